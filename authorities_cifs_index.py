@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Trigram blocking index over the authority names of the ef4ktur CSV file (cifs/data.csv).
+
+Scoring every contract authority against all the names of the CSV with thefuzz is too slow,
+so we use this index to get a small list of candidates first and we only score those.
+
+The index is saved in the cache folder and it is only rebuilt when the CSV file changes.
+"""
+import json
+import os
+from collections import Counter
+
+from utils import file_checksum, trigrams
+
+CIFS_FILENAME = "cifs/data.csv"
+INDEX_FILENAME = "cache/authorities_cifs_index.json"
+MAX_CANDIDATES = 20
+
+
+class AuthorityCIFIndex:
+    def __init__(self, keys, postings, sizes, checksum=""):
+        self.keys = keys
+        self.postings = postings
+        self.sizes = sizes
+        self.checksum = checksum
+
+    @classmethod
+    def build(cls, names, checksum=""):
+        """ build the trigram -> names index for the given names """
+        keys = list(names)
+        postings = {}
+        sizes = []
+        for position, key in enumerate(keys):
+            key_trigrams = trigrams(key)
+            sizes.append(len(key_trigrams))
+            for trigram in key_trigrams:
+                postings.setdefault(trigram, []).append(position)
+
+        return cls(keys, postings, sizes, checksum)
+
+    @classmethod
+    def load(cls, names, cifs_filename=CIFS_FILENAME, index_filename=INDEX_FILENAME):
+        """load the index from the cache, or build it and save it if the CSV file has changed
+        since the last time it was built
+        """
+        checksum = file_checksum(cifs_filename)
+        try:
+            with open(index_filename) as fp:
+                data = json.load(fp)
+            if data["checksum"] == checksum and data["keys"] == list(names):
+                return cls(data["keys"], data["postings"], data["sizes"], checksum)
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        index = cls.build(names, checksum)
+        index.dump(index_filename)
+        return index
+
+    def dump(self, index_filename=INDEX_FILENAME):
+        os.makedirs(os.path.dirname(index_filename), exist_ok=True)
+        with open(index_filename, "w") as fp:
+            json.dump(
+                {
+                    "checksum": self.checksum,
+                    "keys": self.keys,
+                    "postings": self.postings,
+                    "sizes": self.sizes,
+                },
+                fp,
+            )
+
+    def candidates(self, name, limit=MAX_CANDIDATES):
+        """ return the names that share most trigrams with the given name, best ones first"""
+        name_trigrams = trigrams(name)
+        if not name_trigrams:
+            return []
+
+        overlaps = Counter()
+        for trigram in name_trigrams:
+            overlaps.update(self.postings.get(trigram, []))
+
+        # Dice coefficient, so that long names do not win just because they are long
+        scores = {
+            position: 2.0 * overlap / (len(name_trigrams) + self.sizes[position])
+            for position, overlap in overlaps.items()
+        }
+        best = sorted(scores, key=lambda position: (-scores[position], position))
+        return [self.keys[position] for position in best[:limit]]
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Indexing throughput benchmark, against the local Elastic stand-in (elastic_standin.py).
+
+The stand-in runs in its own process, so the CPU time reported is only the one used by
+the client (reading the files, serializing and sending the bulk requests). Examples:
+
+    python benchmark_indexing.py --contracts 10000 --mode parallel
+    python benchmark_indexing.py --demo --mode sequential --latency 0.01
+    python benchmark_indexing.py --contracts 10000 --mode async
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import step_05_index_contracts as indexing
+from synthetic_corpus import generate_processed_contracts
+
+YEAR = "2021"
+MODES = ["sequential", "async", "parallel", "buffered"]
+
+
+def start_standin(latency=0.0, rejection_rate=0.0):
+    """ start the stand-in in another process and return it with the port it listens on"""
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "elastic_standin.py"),
+            "--port",
+            "0",
+            "--latency",
+            str(latency),
+            "--rejection-rate",
+            str(rejection_rate),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    port = int(process.stdout.readline().strip().split(":")[-1])
+    return process, port
+
+
+def get_standin_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_standin/stats") as response:
+        return json.load(response)
+
+
+def index_buffered(processed_folder, year):
+    indexer = indexing.ContractIndexer(year, processed_folder)
+    with indexing.BufferedIndexer() as buffered:
+        for language in indexing.LANGUAGES:
+            for action in indexer.generate_actions(language):
+                buffered.add(action["_source"], language)
+    return buffered.indexed
+
+
+def run_benchmark(processed_folder, year, mode, port, **options):
+    indexing.ELASTIC_HOST = "127.0.0.1"
+    indexing.ELASTIC_PORT = port
+    indexing._CLIENT = None
+
+    before = get_standin_stats(port)
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    if mode == "sequential":
+        indexer = indexing.ContractIndexer(
+            year, processed_folder, max_retries=3, initial_backoff=0.1
+        )
+        indexer.index_contracts()
+    elif mode == "async":
+        indexer = indexing.ContractIndexer(
+            year, processed_folder, max_retries=3, initial_backoff=0.1
+        )
+        asyncio.run(indexer.index_contracts_async())
+    elif mode == "parallel":
+        indexer = indexing.ContractIndexer(
+            year, processed_folder, max_retries=3, initial_backoff=0.1
+        )
+        indexer.index_contracts_parallel(**options)
+    else:
+        index_buffered(processed_folder, year)
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - start_cpu
+    after = get_standin_stats(port)
+
+    docs = after["indexed"] - before["indexed"]
+    sent_bytes = after["bytes"] - before["bytes"]
+    return {
+        "mode": mode,
+        "docs": docs,
+        "seconds": round(seconds, 3),
+        "docs_per_second": round(docs / seconds, 1),
+        "bytes": sent_bytes,
+        "bytes_per_second": round(sent_bytes / seconds, 1),
+        "client_cpu_seconds": round(cpu_seconds, 3),
+        "client_cpu_ratio": round(cpu_seconds / seconds, 3),
+        "bulk_requests": after["bulk_requests"] - before["bulk_requests"],
+        "rejected": after["rejected"] - before["rejected"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the contract indexing")
+    parser.add_argument(
+        "--contracts",
+        type=int,
+        default=1000,
+        help="Number of synthetic contracts to index",
+    )
+    parser.add_argument(
+        "--demo", action="store_true", help="Index the demo contracts instead"
+    )
+    parser.add_argument("--mode", choices=MODES, default="sequential")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rejection-rate", type=float, default=0.0)
+    parser.add_argument("--threads", type=int, default=indexing.BULK_THREAD_COUNT)
+    parser.add_argument("--chunk-size", type=int, default=indexing.BULK_CHUNK_SIZE)
+    parser.add_argument(
+        "--max-chunk-bytes", type=int, default=indexing.BULK_MAX_CHUNK_BYTES
+    )
+    myargs = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="kontrata-benchmark-")
+    standin, port = start_standin(myargs.latency, myargs.rejection_rate)
+    try:
+        if myargs.demo:
+            shutil.copytree(
+                "demo/processed/contracts", f"{folder}/contracts/{YEAR}"
+            )
+        else:
+            generate_processed_contracts(folder, YEAR, myargs.contracts)
+
+        options = {}
+        if myargs.mode == "parallel":
+            options = {
+                "thread_count": myargs.threads,
+                "chunk_size": myargs.chunk_size,
+                "max_chunk_bytes": myargs.max_chunk_bytes,
+            }
+        result = run_benchmark(folder, YEAR, myargs.mode, port, **options)
+        print(json.dumps(result, indent=4))
+    finally:
+        standin.terminate()
+        standin.wait()
+        shutil.rmtree(folder)
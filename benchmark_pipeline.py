@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the processing steps, with synthetic contracts in both XML formats built from
+the demo samples (see synthetic_corpus.py).
+
+For each corpus size it times, per contract and language:
+
+- build_dict, post_process_contract and post_process_old_contract (step_02)
+- the extraction of authorities and companies, and the company resolution (step_03)
+- fix_contents (step_04), with reference data built from the same corpus
+- the generation of the bulk actions (step_05), without sending them
+
+The results are written as JSON to benchmark_results/, named after the current commit, so
+that two runs can be compared with --compare:
+
+    python benchmark_pipeline.py --sizes 1000 100000
+    python benchmark_pipeline.py --sizes 1000 --compare benchmark_results/abc1234.json
+
+Big sizes need a lot of disk space: every contract is written to disk, as in a real run.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from company_resolution import resolve_companies
+from contract_shape import upgrade_contract_shape
+from step_02_process_contracts import ContractProcessor as ContractParser
+from step_03_build_data_dicts import ContractProcessor as DataDictsBuilder
+from synthetic_corpus import generate_raw_contracts
+
+BASE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+YEAR = "2021"
+LANGUAGES = ["es", "eu"]
+SIZES = [1000]
+RESULTS_FOLDER = "benchmark_results"
+REGRESSION_THRESHOLD = 1.25
+
+
+class Timings:
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def results(self):
+        return {
+            name: {
+                "seconds": round(seconds, 4),
+                "calls": self.calls[name],
+                "microseconds_per_call": round(seconds / self.calls[name] * 1e6, 2),
+            }
+            for name, seconds in self.seconds.items()
+        }
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_FOLDER,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def contract_folders(base_folder):
+    for contract_id in sorted(os.listdir(base_folder)):
+        for language in LANGUAGES:
+            yield f"{base_folder}/{contract_id}/{language}"
+
+
+def benchmark_step_02(timings):
+    parser = ContractParser(YEAR)
+    for folder in contract_folders(f"contracts/{YEAR}"):
+        with timings.measure("build_dict"):
+            raw_contract = parser.build_dict(
+                f"{folder}/metadata.xml", f"{folder}/data.xml", f"{folder}/data.json"
+            )
+        raw_contract["id"] = folder.split("/")[-2]
+        if "contractingAnnouncement" in raw_contract:
+            with timings.measure("post_process_contract"):
+                contract = parser.post_process_contract(raw_contract)
+        else:
+            with timings.measure("post_process_old_contract"):
+                contract = parser.post_process_old_contract(raw_contract)
+        contract["year"] = YEAR
+
+        os.makedirs(f"processed/{folder}", exist_ok=True)
+        with open(f"processed/{folder}/contract.json", "w") as fp:
+            json.dump(contract, fp)
+
+
+def benchmark_step_03(timings):
+    builder = DataDictsBuilder()
+    for folder in contract_folders(f"processed/contracts/{YEAR}"):
+        with timings.measure("step_03_extract"):
+            builder.process_contract(folder)
+
+    with timings.measure("step_03_resolve_companies"):
+        builder.companies_mapping = resolve_companies(
+            builder.companies, builder.companies_names
+        )
+    builder.dump_files()
+
+    # step_04 needs the contractors downloaded in step_00, build them from the corpus
+    contractors = [
+        {
+            "codPerfil": int(code),
+            "nombreLargoEs": authority.get("es", {}).get("name", ""),
+            "nombreLargoEu": authority.get("eu", {}).get("name", ""),
+        }
+        for code, authority in builder.authorities.items()
+        if code
+    ]
+    with open("cache/contractors.json", "w") as fp:
+        json.dump(contractors, fp)
+
+
+def benchmark_step_04(timings):
+    from step_04_fix_authority_and_company_data_async import (
+        ContractProcessor as ContractFixer,
+    )
+
+    with timings.measure("step_04_load_reference"):
+        fixer = ContractFixer(YEAR)
+    for folder in contract_folders(f"processed/contracts/{YEAR}"):
+        with open(f"{folder}/contract.json") as fp:
+            contract = upgrade_contract_shape(json.load(fp))
+        language = folder.split("/")[-1]
+        with timings.measure("fix_contents"):
+            contract = fixer.fix_contents(contract, language)
+        with open(f"{folder}/contract.json", "w") as fp:
+            json.dump(contract, fp)
+
+
+def benchmark_step_05(timings):
+    from step_05_index_contracts import ContractIndexer
+
+    indexer = ContractIndexer(YEAR)
+    for language in LANGUAGES:
+        with timings.measure("generate_actions"):
+            for action in indexer.generate_actions(language):
+                pass
+
+
+def run_benchmark(size, seed=0):
+    """run the benchmark with size synthetic contracts in a temporary folder"""
+    cwd = os.getcwd()
+    folder = tempfile.mkdtemp(prefix="kontrata-benchmark-")
+    os.chdir(folder)
+    try:
+        os.makedirs("cache")
+        os.makedirs("cifs")
+        shutil.copy(f"{BASE_FOLDER}/cifs/data.csv", "cifs/data.csv")
+
+        timings = Timings()
+        with timings.measure("generate_corpus"):
+            generate_raw_contracts(".", YEAR, size, seed, f"{BASE_FOLDER}/demo")
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            benchmark_step_02(timings)
+            benchmark_step_03(timings)
+            benchmark_step_04(timings)
+            benchmark_step_05(timings)
+
+        return timings.results()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+
+def compare_results(previous, current, threshold=REGRESSION_THRESHOLD):
+    """print the per call time of each benchmark in both runs, return the regressions: the
+    benchmarks that are more than threshold times slower than before
+    """
+    regressions = []
+    for size, benchmarks in current["sizes"].items():
+        previous_benchmarks = previous["sizes"].get(size, {})
+        for name, result in benchmarks.items():
+            if name not in previous_benchmarks:
+                continue
+            before = previous_benchmarks[name]["microseconds_per_call"]
+            after = result["microseconds_per_call"]
+            ratio = after / before if before else 1.0
+            flag = ""
+            if ratio > threshold:
+                flag = " REGRESSION"
+                regressions.append((size, name, ratio))
+            print(
+                f"{size:>8} {name:<28} {before:>10.2f} {after:>10.2f} {ratio:.2f}x{flag}"
+            )
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the processing steps")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=SIZES,
+        help="Number of synthetic contracts of each run (1000 100000 1000000)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", help="JSON file to write the results to (named after the commit)"
+    )
+    parser.add_argument(
+        "--compare", help="JSON file of a previous run to compare the results with"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help="Slowdown ratio reported as a regression when comparing",
+    )
+    myargs = parser.parse_args()
+
+    commit = get_commit()
+    results = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sizes": {},
+    }
+    for size in myargs.sizes:
+        print(f"Benchmarking {size} contracts")
+        results["sizes"][str(size)] = run_benchmark(size, myargs.seed)
+
+    output = myargs.output or f"{BASE_FOLDER}/{RESULTS_FOLDER}/{commit}.json"
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump(results, fp, indent=4)
+    print(f"Results written to {output}")
+
+    if myargs.compare:
+        with open(myargs.compare) as fp:
+            if compare_results(json.load(fp), results, myargs.threshold):
+                sys.exit(1)
+    else:
+        print(json.dumps(results["sizes"], indent=4))
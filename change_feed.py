@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Change feed of the contracts listed in the JSON files of each year (contratos.json and
+kontratuak.json), kept by step_01.
+
+Every time step_01 reads the listing of a year, the fingerprint of each contract (a hash
+of its entries in both languages, including the dataXML, metadataXML and zipFile urls) is
+compared with the one of the previous listing, and the ids of the contracts added,
+changed and removed since then are written to cache/{year}/changes/{sequence}.json. A
+listing that has not changed does not add a feed, so running step_01 again (or in
+several shards) is harmless.
+
+The next steps accept --changes to process only the contracts added or changed in the
+last feed, or in every feed after a given sequence, and step_05 deletes the removed ones
+from the index:
+
+    python step_01_get_contracts.py --year 2021
+    python step_02_process_contracts.py --year 2021 --changes
+    python step_05_index_contracts.py --year 2021 --changes 3
+"""
+import hashlib
+import json
+import os
+import time
+
+CHANGES_FOLDER = "cache/{year}/changes"
+FINGERPRINTS_FILENAME = "fingerprints.json"
+CHANGE_TYPES = ["added", "changed", "removed"]
+LATEST = -1
+
+
+def contract_fingerprint(contract):
+    """ hash of the language -> listing entry of the contract, without the id we add """
+    content = {
+        language: {key: value for key, value in data.items() if key != "id"}
+        for language, data in contract.items()
+    }
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def write_json(filename, data):
+    """ write the file atomically, so that a reader never finds half of it """
+    temporary = f"{filename}.tmp"
+    with open(temporary, "w") as fp:
+        json.dump(data, fp)
+    os.replace(temporary, filename)
+
+
+class ChangeFeed:
+    def __init__(self, year, folder=None):
+        self.year = year
+        self.folder = folder or CHANGES_FOLDER.format(year=year)
+
+    def feed_filename(self, sequence):
+        return f"{self.folder}/{sequence:06d}.json"
+
+    def sequences(self):
+        try:
+            filenames = os.listdir(self.folder)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            int(filename[:-5])
+            for filename in filenames
+            if filename.endswith(".json") and filename[:-5].isdigit()
+        )
+
+    def load_feed(self, sequence):
+        with open(self.feed_filename(sequence)) as fp:
+            return json.load(fp)
+
+    def load_fingerprints(self):
+        try:
+            with open(f"{self.folder}/{FINGERPRINTS_FILENAME}") as fp:
+                return json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return {"snapshot": None, "contracts": {}}
+
+    def record(self, contracts):
+        """compare the contract id -> language -> listing entry dict with the previous
+        listing, and write a feed with the differences. Return the new feed, or the last
+        one if the listing has not changed (as when another shard has already recorded
+        it).
+        """
+        fingerprints = {
+            contract_id: contract_fingerprint(contract)
+            for contract_id, contract in contracts.items()
+        }
+        snapshot = hashlib.sha1(
+            json.dumps(fingerprints, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        previous = self.load_fingerprints()
+        sequences = self.sequences()
+        if previous["snapshot"] == snapshot and sequences:
+            return self.load_feed(sequences[-1])
+
+        previous_contracts = previous["contracts"]
+        feed = {
+            "sequence": sequences[-1] + 1 if sequences else 1,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "added": sorted(set(fingerprints) - set(previous_contracts)),
+            "changed": sorted(
+                contract_id
+                for contract_id, fingerprint in fingerprints.items()
+                if contract_id in previous_contracts
+                and previous_contracts[contract_id] != fingerprint
+            ),
+            "removed": sorted(set(previous_contracts) - set(fingerprints)),
+        }
+        os.makedirs(self.folder, exist_ok=True)
+        write_json(self.feed_filename(feed["sequence"]), feed)
+        write_json(
+            f"{self.folder}/{FINGERPRINTS_FILENAME}",
+            {"snapshot": snapshot, "contracts": fingerprints},
+        )
+        return feed
+
+    def changes_since(self, since=LATEST):
+        """the ids added, changed and removed in the last feed (with LATEST), or in all the
+        feeds after the since sequence, as sets. A contract is reported by its last change.
+        """
+        sequences = self.sequences()
+        if since == LATEST:
+            sequences = sequences[-1:]
+        else:
+            sequences = [sequence for sequence in sequences if sequence > since]
+
+        status = {}
+        for sequence in sequences:
+            feed = self.load_feed(sequence)
+            for change_type in CHANGE_TYPES:
+                for contract_id in feed[change_type]:
+                    if change_type == "added" and status.get(contract_id) == "removed":
+                        status[contract_id] = "changed"
+                    else:
+                        status[contract_id] = change_type
+
+        changes = {change_type: set() for change_type in CHANGE_TYPES}
+        for contract_id, change_type in status.items():
+            changes[change_type].add(contract_id)
+        return changes
+
+
+def load_changes(year, since):
+    """ the changes of the year to process with --changes, None to process everything """
+    if since is None:
+        return None
+    return ChangeFeed(year).changes_since(since)
+
+
+def in_changes(contract_id, changes):
+    """ True if the contract was added or changed, or there are no changes to follow """
+    if changes is None:
+        return True
+    return contract_id in changes["added"] or contract_id in changes["changed"]
+
+
+def add_argument(parser):
+    parser.add_argument(
+        "--changes",
+        type=int,
+        nargs="?",
+        const=LATEST,
+        metavar="SEQUENCE",
+        help="Process only the contracts added or changed in the last change feed of "
+        "step_01, or in every feed after SEQUENCE",
+    )
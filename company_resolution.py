@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Batch entity resolution for the companies that won a contract but have no CIF.
+
+Comparing each name with all the known companies is quadratic, so the names are grouped
+in blocks that share some normalized tokens, and they are only scored inside each block.
+The matching names are clustered using union-find, and every name without CIF that ends
+up in the same cluster as a company with CIF is mapped to that company. Every CIF is a
+company of its own, even if it shares its name with other CIFs, and the names without CIF
+that match companies with different CIFs are not mapped to any of them.
+"""
+from thefuzz import fuzz
+
+from utils import normalize_text
+
+# Legal forms and stop words that do not help to tell a company from another
+IGNORED_TOKENS = {
+    "s",
+    "l",
+    "a",
+    "u",
+    "sl",
+    "sa",
+    "slu",
+    "sau",
+    "sll",
+    "sal",
+    "slp",
+    "sc",
+    "scoop",
+    "coop",
+    "cb",
+    "sociedad",
+    "limitada",
+    "anonima",
+    "cooperativa",
+    "y",
+    "e",
+    "de",
+    "del",
+    "la",
+    "el",
+    "los",
+    "las",
+    "eta",
+}
+MAX_BLOCK_SIZE = 500
+SCORE_THRESHOLD = 90
+
+
+def significant_tokens(name):
+    return [
+        token for token in normalize_text(name).split() if token not in IGNORED_TOKENS
+    ]
+
+
+def blocking_keys(tokens):
+    """the keys of the blocks where a name will be compared with the rest:
+    - all the significant tokens (same name with another legal form or punctuation)
+    - the first significant token (typos in the rest of the name)
+    - the first two significant tokens in any order
+    """
+    if not tokens:
+        return []
+
+    return [
+        "full:" + " ".join(tokens),
+        "first:" + tokens[0],
+        "pair:" + " ".join(sorted(tokens[:2])),
+    ]
+
+
+class UnionFind:
+    """ union-find of names, that never joins two clusters with a different CIF """
+
+    def __init__(self):
+        self.parents = {}
+        self.cifs = {}
+
+    def add(self, item, cif=""):
+        if item not in self.parents:
+            self.parents[item] = item
+            self.cifs[item] = cif
+
+    def find(self, item):
+        root = item
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[item] != root:
+            self.parents[item], item = root, self.parents[item]
+        return root
+
+    def union(self, item_a, item_b):
+        root_a = self.find(item_a)
+        root_b = self.find(item_b)
+        if root_a == root_b:
+            return True
+
+        cif_a = self.cifs[root_a]
+        cif_b = self.cifs[root_b]
+        if cif_a and cif_b and cif_a != cif_b:
+            return False
+
+        self.parents[root_b] = root_a
+        self.cifs[root_a] = cif_a or cif_b
+        return True
+
+    def cif(self, item):
+        return self.cifs[self.find(item)]
+
+
+def resolve_companies(companies, companies_names, threshold=SCORE_THRESHOLD):
+    """build the name -> company mapping for the companies without CIF
+
+    companies is the cif -> company dict and companies_names the name -> company dict
+    built in step_03.
+    """
+    # the items are (name, cif) tuples, so companies with the same name and different
+    # CIFs are kept apart
+    clusters = UnionFind()
+    for cif, company in companies.items():
+        clusters.add((company["name"], cif), cif)
+    for name in companies_names:
+        clusters.add((name, ""))
+
+    blocks = {}
+    tokens = {}
+    for item in clusters.parents:
+        tokens[item] = significant_tokens(item[0])
+        for key in blocking_keys(tokens[item]):
+            blocks.setdefault(key, []).append(item)
+
+    # names without CIF that match companies with different CIFs, and the ones with the
+    # same significant tokens as a single CIF, that are not ambiguous because of a typo
+    ambiguous = set()
+    exact = set()
+
+    def join(item_a, item_b):
+        if not clusters.union(item_a, item_b):
+            ambiguous.update(item for item in (item_a, item_b) if not item[1])
+
+    # the names that are the same go first, so that they are not joined by a typo before
+    full_keys_first = sorted(blocks, key=lambda key: not key.startswith("full:"))
+    for key in full_keys_first:
+        items = blocks[key]
+        if len(items) < 2 or len(items) > MAX_BLOCK_SIZE:
+            continue
+
+        if key.startswith("full:"):
+            cifs = {item[1] for item in items if item[1]}
+            if len(cifs) > 1:
+                ambiguous.update(item for item in items if not item[1])
+                continue
+            if cifs:
+                exact.update(items)
+            for item in items[1:]:
+                join(items[0], item)
+            continue
+
+        for i, item_a in enumerate(items):
+            text_a = " ".join(tokens[item_a])
+            for item_b in items[i + 1 :]:
+                if clusters.find(item_a) == clusters.find(item_b):
+                    continue
+                text_b = " ".join(tokens[item_b])
+                if fuzz.token_sort_ratio(text_a, text_b) >= threshold:
+                    join(item_a, item_b)
+
+    mapping = {}
+    for name in companies_names:
+        item = (name, "")
+        cif = clusters.cif(item)
+        if cif and (item in exact or item not in ambiguous):
+            mapping[name] = {"cif": cif, "name": companies[cif]["name"]}
+
+    return mapping
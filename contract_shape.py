@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Processed contracts used to have a numbered key for each winner and resolution
+(winner_0, winner_1, resolution_0...). Now they are lists (winners and resolutions),
+so that the index mapping has always the same fields.
+
+This module upgrades the contracts processed with the old shape, so that the rest
+of the steps can work with both.
+"""
+import re
+
+NUMBERED_KEY_RE = re.compile(r"^(winner|resolution)_(.+)$")
+
+
+def sort_key(suffix):
+    return (0, int(suffix), "") if suffix.isdigit() else (1, 0, suffix)
+
+
+def upgrade_contract_shape(contract):
+    """ move the winner_N and resolution_N values of the contract to winners and resolutions"""
+    numbered = {"winner": {}, "resolution": {}}
+    for key in list(contract.keys()):
+        match = NUMBERED_KEY_RE.match(key)
+        if match:
+            numbered[match.group(1)][match.group(2)] = contract.pop(key)
+
+    if "winner" in contract:
+        contract.pop("winner")
+
+    for name, values in numbered.items():
+        if f"{name}s" not in contract:
+            contract[f"{name}s"] = [
+                values[suffix] for suffix in sorted(values, key=sort_key)
+            ]
+
+    return contract
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+Differential harness for faster replacements of the step_02 parsers and cleaners.
+
+It runs the current implementation (the reference) and a candidate side by side over a
+corpus of contracts, the demo ones or any local contracts/<year> tree, and reports every
+field where their outputs differ and how fast the candidate is. These are the targets,
+and the arguments the candidate is called with (the same ones of the reference, without
+self):
+
+- build_dict: the metadata.xml, data.xml and data.json filenames of every contract
+- parse_old_xml: the text of every data.xml file in the old <item> format
+- post_process_contract and post_process_old_contract: the raw contracts of each format
+- clean_bool_value, clean_float_value, clean_float_value_old_xml and clean_date_value:
+  every value the post_process methods clean while processing the corpus
+
+A candidate is a function given as module:function:
+
+    python differential.py --candidate clean_float_value=fast_cleaners:clean_float_value
+    python differential.py --folder contracts/2021 \
+        --candidate build_dict=fast_xml:build_dict
+
+Two outputs are equal when they have the same values of the same types (1 and 1.0 are
+different, because they are written differently to the contract files), and when both
+implementations raise, the same exception type. The report lists the fields that were
+identical in every contract, which are the ones a fast path can be enabled for, and the
+command exits with 1 when there is any mismatch.
+"""
+import argparse
+import contextlib
+import copy
+import importlib
+import json
+import math
+import os
+import re
+import sys
+import time
+
+import step_02_process_contracts
+from step_02_process_contracts import ContractProcessor
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+LANGUAGES = ["es", "eu"]
+CLEANERS = [
+    "clean_bool_value",
+    "clean_float_value",
+    "clean_float_value_old_xml",
+    "clean_date_value",
+]
+TARGETS = [
+    "build_dict",
+    "parse_old_xml",
+    "post_process_contract",
+    "post_process_old_contract",
+] + CLEANERS
+# mismatch examples kept for every field, and characters of their values
+MAX_EXAMPLES = 5
+MAX_EXAMPLE_LENGTH = 200
+# the whole value, for the targets that return a single value
+VALUE_FIELD = "(value)"
+
+
+class Corpus:
+    """the inputs of every target, taken from the contract folders of base_folder
+    ({base_folder}/{id}/{language}), parsed with the reference implementation
+    """
+
+    def __init__(self, base_folder=f"{DEMO_FOLDER}/contracts", limit=None):
+        self.folders = [
+            f"{base_folder}/{contract_id}/{language}"
+            for contract_id in sorted(os.listdir(base_folder))[:limit]
+            for language in LANGUAGES
+            if os.path.isdir(f"{base_folder}/{contract_id}/{language}")
+        ]
+        self.processor = ReferenceProcessor()
+        self._raw_contracts = None
+        self._cleaner_inputs = None
+
+    def get_inputs(self, target):
+        """ a (label, args) tuple for every call of the target in the corpus """
+        if target == "build_dict":
+            return [
+                (
+                    folder,
+                    (
+                        f"{folder}/metadata.xml",
+                        f"{folder}/data.xml",
+                        f"{folder}/data.json",
+                    ),
+                )
+                for folder in self.folders
+            ]
+        if target == "parse_old_xml":
+            inputs = []
+            for folder in self.folders:
+                text = read_data_xml(folder)
+                if text is not None and "contractingAnnouncement" not in text:
+                    inputs.append((folder, (text,)))
+            return inputs
+        if target == "post_process_contract":
+            return [
+                (folder, (raw_contract,))
+                for folder, raw_contract in self.raw_contracts
+                if "contractingAnnouncement" in raw_contract
+            ]
+        if target == "post_process_old_contract":
+            return [
+                (folder, (raw_contract,))
+                for folder, raw_contract in self.raw_contracts
+                if "contractingAnnouncement" not in raw_contract
+            ]
+        if target in CLEANERS:
+            return [(repr(args[0]), args) for args in self.cleaner_inputs[target]]
+        raise ValueError(f"Unknown target {target}, it must be one of {TARGETS}")
+
+    @property
+    def raw_contracts(self):
+        """ (folder, raw contract) of every folder that can be parsed """
+        if self._raw_contracts is None:
+            self._raw_contracts = []
+            for folder in self.folders:
+                raw_contract = self.processor.build_dict(
+                    f"{folder}/metadata.xml",
+                    f"{folder}/data.xml",
+                    f"{folder}/data.json",
+                )
+                if raw_contract:
+                    raw_contract["id"] = folder.split("/")[-2]
+                    self._raw_contracts.append((folder, raw_contract))
+        return self._raw_contracts
+
+    @property
+    def cleaner_inputs(self):
+        """ the arguments of every call to each cleaner when processing the corpus """
+        if self._cleaner_inputs is None:
+            with record_calls(step_02_process_contracts, CLEANERS) as calls:
+                for folder, raw_contract in self.raw_contracts:
+                    self.processor.post_process(copy.deepcopy(raw_contract))
+            self._cleaner_inputs = calls
+        return self._cleaner_inputs
+
+
+class ReferenceProcessor(ContractProcessor):
+    def __init__(self):
+        # the parsing methods do not use the state of a run, and the ContractProcessor
+        # constructor would create the processed folder of the year
+        self.year = None
+
+    def post_process(self, raw_contract):
+        if "contractingAnnouncement" in raw_contract:
+            return self.post_process_contract(raw_contract)
+        return self.post_process_old_contract(raw_contract)
+
+
+def get_reference(target):
+    """ the current implementation of the target """
+    if target in CLEANERS:
+        return getattr(step_02_process_contracts, target)
+    if target not in TARGETS:
+        raise ValueError(f"Unknown target {target}, it must be one of {TARGETS}")
+    return getattr(ReferenceProcessor(), target)
+
+
+def load_candidate(path):
+    """ the function of a module:function path """
+    module_name, _, function_name = path.partition(":")
+    if not module_name or not function_name:
+        raise ValueError(f"{path} is not a module:function path")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def read_data_xml(folder):
+    try:
+        with open(f"{folder}/data.xml", encoding="iso-8859-15") as fp:
+            return fp.read()
+    except FileNotFoundError:
+        return None
+
+
+@contextlib.contextmanager
+def record_calls(module, names):
+    """record the arguments of every call to the functions of the module while the context
+    is active, as a name -> [args] dict
+    """
+    calls = {name: [] for name in names}
+    originals = {name: getattr(module, name) for name in names}
+
+    def recorder(name, function):
+        def wrapper(*args):
+            calls[name].append(args)
+            return function(*args)
+
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(module, name, recorder(name, function))
+    try:
+        yield calls
+    finally:
+        for name, function in originals.items():
+            setattr(module, name, function)
+
+
+def field_key(path):
+    """ the field of a path, without the list positions: winners[0].name -> winners[].name """
+    return re.sub(r"\[\d+\]", "[]", path) or VALUE_FIELD
+
+
+def same_value(reference, candidate):
+    if isinstance(reference, float) and isinstance(candidate, float):
+        if math.isnan(reference) and math.isnan(candidate):
+            return True
+    return type(reference) is type(candidate) and reference == candidate
+
+
+def diff_values(reference, candidate, path=""):
+    """ yield the (path, reference value, candidate value) of every difference """
+    if isinstance(reference, dict) and isinstance(candidate, dict):
+        keys = list(reference) + [key for key in candidate if key not in reference]
+        for key in keys:
+            key_path = f"{path}.{key}" if path else str(key)
+            if key not in candidate:
+                yield key_path, reference[key], "(missing)"
+            elif key not in reference:
+                yield key_path, "(missing)", candidate[key]
+            else:
+                yield from diff_values(reference[key], candidate[key], key_path)
+    elif isinstance(reference, (list, tuple)) and isinstance(candidate, (list, tuple)):
+        if len(reference) != len(candidate):
+            yield f"{path}.length", len(reference), len(candidate)
+        for position, (item, other) in enumerate(zip(reference, candidate)):
+            yield from diff_values(item, other, f"{path}[{position}]")
+    elif not same_value(reference, candidate):
+        yield path, reference, candidate
+
+
+def field_paths(value, path=""):
+    """ the paths of every value of a result, to know which fields were compared """
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from field_paths(item, f"{path}.{key}" if path else str(key))
+    elif isinstance(value, (list, tuple)):
+        for position, item in enumerate(value):
+            yield from field_paths(item, f"{path}[{position}]")
+    else:
+        yield path
+
+
+def short_repr(value):
+    text = repr(value)
+    if len(text) > MAX_EXAMPLE_LENGTH:
+        return text[: MAX_EXAMPLE_LENGTH - 3] + "..."
+    return text
+
+
+class Outcome:
+    """ the result of a call, or the type of the exception it raised """
+
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"raised {self.error}"
+        return repr(self.value)
+
+
+def timed_call(function, args):
+    """ call the function with a copy of the args, return its outcome and duration """
+    args = copy.deepcopy(args)
+    start = time.perf_counter()
+    try:
+        outcome = Outcome(value=function(*args))
+    except Exception as e:
+        outcome = Outcome(error=type(e).__name__)
+    return outcome, time.perf_counter() - start
+
+
+class DifferentialResult:
+    def __init__(self, target):
+        self.target = target
+        self.calls = 0
+        self.mismatched_calls = 0
+        self.reference_seconds = 0.0
+        self.candidate_seconds = 0.0
+        self.fields = set()
+        # field -> number of mismatches, and examples of them
+        self.mismatches = {}
+        self.examples = {}
+
+    def add(self, label, reference, candidate, reference_seconds, candidate_seconds):
+        self.calls += 1
+        self.reference_seconds += reference_seconds
+        self.candidate_seconds += candidate_seconds
+        if reference.error is not None or candidate.error is not None:
+            self.fields.add(VALUE_FIELD)
+            differences = []
+            if reference.error != candidate.error:
+                differences = [("", reference, candidate)]
+        else:
+            self.fields.update(field_key(path) for path in field_paths(reference.value))
+            differences = list(diff_values(reference.value, candidate.value))
+
+        if differences:
+            self.mismatched_calls += 1
+        for path, reference_value, candidate_value in differences:
+            key = field_key(path)
+            self.mismatches[key] = self.mismatches.get(key, 0) + 1
+            examples = self.examples.setdefault(key, [])
+            if len(examples) < MAX_EXAMPLES:
+                examples.append(
+                    {
+                        "input": label,
+                        "path": path or VALUE_FIELD,
+                        "reference": short_repr(reference_value),
+                        "candidate": short_repr(candidate_value),
+                    }
+                )
+
+    @property
+    def speedup(self):
+        if not self.candidate_seconds:
+            return None
+        return self.reference_seconds / self.candidate_seconds
+
+    def identical_fields(self):
+        return sorted(self.fields - self.mismatches.keys())
+
+    def to_dict(self):
+        return {
+            "target": self.target,
+            "calls": self.calls,
+            "mismatched_calls": self.mismatched_calls,
+            "reference_seconds": round(self.reference_seconds, 6),
+            "candidate_seconds": round(self.candidate_seconds, 6),
+            "speedup": round(self.speedup, 3) if self.speedup else None,
+            "identical_fields": self.identical_fields(),
+            "mismatches": self.mismatches,
+            "examples": self.examples,
+        }
+
+    def print_report(self):
+        speedup = f"{self.speedup:.2f}x" if self.speedup else "-"
+        calls = self.calls or 1
+        print(
+            f"{self.target}: {self.calls} calls, "
+            f"{self.mismatched_calls} with mismatches, "
+            f"reference {self.reference_seconds / calls * 1e6:.1f} µs/call, "
+            f"candidate {self.candidate_seconds / calls * 1e6:.1f} µs/call, "
+            f"speedup {speedup}"
+        )
+        for key, count in sorted(self.mismatches.items()):
+            print(f"  {key}: {count} mismatches")
+            for example in self.examples[key]:
+                print(
+                    f"    {example['input']} {example['path']}: "
+                    f"{example['reference']} != {example['candidate']}"
+                )
+        print(f"  identical fields: {', '.join(self.identical_fields()) or '-'}")
+
+
+def run_differential(target, candidate, corpus, repeat=1):
+    """run the reference and the candidate of the target with every input of the corpus,
+    repeat times (to measure their speed), and return the DifferentialResult
+    """
+    reference = get_reference(target)
+    result = DifferentialResult(target)
+    for label, args in corpus.get_inputs(target):
+        for _ in range(repeat):
+            reference_outcome, reference_seconds = timed_call(reference, args)
+            candidate_outcome, candidate_seconds = timed_call(candidate, args)
+            result.add(
+                label,
+                reference_outcome,
+                candidate_outcome,
+                reference_seconds,
+                candidate_seconds,
+            )
+    return result
+
+
+def parse_candidate(value):
+    target, _, path = value.partition("=")
+    if target not in TARGETS:
+        raise argparse.ArgumentTypeError(
+            f"{target} must be one of {', '.join(TARGETS)}"
+        )
+    if not path:
+        raise argparse.ArgumentTypeError(
+            f"{value} is not a target=module:function pair"
+        )
+    return target, path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare a faster parser or cleaner with the current one"
+    )
+    parser.add_argument(
+        "--candidate",
+        type=parse_candidate,
+        action="append",
+        required=True,
+        help="target=module:function, the target is one of: " + ", ".join(TARGETS),
+    )
+    parser.add_argument(
+        "--folder",
+        default=f"{DEMO_FOLDER}/contracts",
+        help="Folder of the contracts, like contracts/2021 (the demo ones by default)",
+    )
+    parser.add_argument(
+        "--limit", type=int, help="Compare only with this many contracts"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Times to run each call, to time them"
+    )
+    parser.add_argument("--output", help="JSON file to write the report to")
+    myargs = parser.parse_args()
+
+    corpus = Corpus(myargs.folder, myargs.limit)
+    results = []
+    for target, path in myargs.candidate:
+        result = run_differential(target, load_candidate(path), corpus, myargs.repeat)
+        result.print_report()
+        results.append(result.to_dict())
+
+    if myargs.output:
+        with open(myargs.output, "w") as fp:
+            json.dump(results, fp, indent=4)
+    if any(result["mismatched_calls"] for result in results):
+        sys.exit(1)
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight local stand-in for Elastic, to measure and test the indexing without a cluster.
+
+It implements just enough of the Elastic HTTP API to accept what step_05 sends: bulk
+requests, single document indexing, index creation, mappings, settings, force-merge,
+refresh, aliases and completion suggestions. Documents are only counted (or kept in
+memory with --store), and the latency of each request and the rate of bulk items
+rejected with a 429 can be set.
+
+Run it with:
+
+    python elastic_standin.py --port 9200 --latency 0.01 --rejection-rate 0.01
+
+GET /_standin/stats returns the requests, documents and bytes received.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import unicodedata
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+ROOT_INFO = {
+    "name": "kontrata-standin",
+    "cluster_name": "kontrata",
+    "version": {"number": "7.15.0", "build_flavor": "default"},
+    "tagline": "You Know, for Search",
+}
+
+
+def fold_text(value):
+    """ lowercase and without accents, as the folding analyzer of the suggestions """
+    decomposed = unicodedata.normalize("NFKD", value.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class StandinState:
+    def __init__(self, latency=0.0, rejection_rate=0.0, store=False, seed=None):
+        self.latency = latency
+        self.rejection_rate = rejection_rate
+        self.store = store
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.indices = {}
+        self.aliases = {}
+        self.stats = {
+            "requests": 0,
+            "bulk_requests": 0,
+            "bytes": 0,
+            "indexed": 0,
+            "deleted": 0,
+            "rejected": 0,
+        }
+
+    def resolve(self, name):
+        """ the concrete indices of an index or alias name """
+        if name in self.indices:
+            return [name]
+        return sorted(index for index, alias in self.aliases.items() if name in alias)
+
+    def create_index(self, name, body):
+        self.indices[name] = {
+            "mappings": body.get("mappings", {}),
+            "settings": dict(body.get("settings", {})),
+            "docs": {},
+            "count": 0,
+        }
+        self.aliases[name] = set()
+
+    def delete_index(self, name):
+        self.indices.pop(name, None)
+        self.aliases.pop(name, None)
+
+    def write_index(self, name):
+        """the index to write to, creating it if needed, or None if the name is an alias of
+        several indices
+        """
+        indices = self.resolve(name)
+        if not indices:
+            self.create_index(name, {})
+            return name
+        if len(indices) == 1:
+            return indices[0]
+        return None
+
+    def index_document(self, name, doc_id, source):
+        index = self.indices[name]
+        if doc_id not in index["docs"]:
+            index["count"] += 1
+        index["docs"][doc_id] = source if self.store else None
+        self.stats["indexed"] += 1
+
+    def delete_document(self, name, doc_id):
+        index = self.indices[name]
+        if doc_id in index["docs"]:
+            del index["docs"][doc_id]
+            index["count"] -= 1
+            self.stats["deleted"] += 1
+            return True
+        return False
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body=None):
+        content = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def error(self, status, error_type, reason=""):
+        self.send_json(
+            status,
+            {"error": {"type": error_type, "reason": reason}, "status": status},
+        )
+
+    def handle_request(self):
+        body = self.read_body()
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        path = [part for part in urlparse(self.path).path.split("/") if part]
+        with self.state.lock:
+            self.state.stats["requests"] += 1
+            self.state.stats["bytes"] += len(body)
+            self.route(self.command, path, body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = handle_request
+
+    def route(self, method, path, body):
+        if not path:
+            return self.send_json(200, ROOT_INFO)
+
+        if path == ["_standin", "stats"]:
+            return self.send_json(200, self.state.stats)
+
+        if path[-1] == "_bulk":
+            return self.bulk(path[0] if len(path) == 2 else None, body)
+
+        if path == ["_aliases"]:
+            return self.update_aliases(json.loads(body))
+
+        if path[0] == "_alias":
+            return self.get_alias(path[1])
+
+        index = path[0]
+        if len(path) == 1:
+            return self.index_api(method, index, body)
+
+        indices = self.state.resolve(index)
+        action = path[1]
+        if action in ("_doc", "_create") and len(path) == 3:
+            return self.index_single(index, path[2], body)
+        if not indices:
+            return self.error(404, "index_not_found_exception", index)
+        if action == "_mapping":
+            mappings = {
+                name: {"mappings": self.state.indices[name]["mappings"]}
+                for name in indices
+            }
+            return self.send_json(200, mappings)
+        if action == "_settings":
+            return self.settings(method, indices, body)
+        if action in ("_forcemerge", "_refresh", "_flush"):
+            shards = {"total": 1, "successful": 1, "failed": 0}
+            return self.send_json(200, {"_shards": shards})
+        if action == "_count":
+            count = sum(self.state.indices[name]["count"] for name in indices)
+            return self.send_json(200, {"count": count})
+        if action == "_search":
+            return self.search(indices, json.loads(body or b"{}"))
+
+        return self.error(400, "unsupported_operation_exception", self.path)
+
+    def index_api(self, method, index, body):
+        exists = bool(self.state.resolve(index))
+        if method == "HEAD":
+            return self.send_json(200 if exists else 404)
+        if method == "PUT":
+            if exists:
+                return self.error(400, "resource_already_exists_exception", index)
+            self.state.create_index(index, json.loads(body or b"{}"))
+            return self.send_json(200, {"acknowledged": True, "index": index})
+        if method == "DELETE":
+            if not exists:
+                return self.error(404, "index_not_found_exception", index)
+            for name in self.state.resolve(index):
+                self.state.delete_index(name)
+            return self.send_json(200, {"acknowledged": True})
+        if method == "GET" and exists:
+            return self.send_json(
+                200,
+                {
+                    name: {
+                        "aliases": {alias: {} for alias in self.state.aliases[name]},
+                        "mappings": self.state.indices[name]["mappings"],
+                    }
+                    for name in self.state.resolve(index)
+                },
+            )
+        return self.error(404, "index_not_found_exception", index)
+
+    def settings(self, method, indices, body):
+        if method == "PUT":
+            settings = json.loads(body)
+            settings = settings.get("index", settings)
+            for name in indices:
+                self.state.indices[name]["settings"].update(settings)
+            return self.send_json(200, {"acknowledged": True})
+        return self.send_json(
+            200,
+            {
+                name: {"settings": {"index": self.state.indices[name]["settings"]}}
+                for name in indices
+            },
+        )
+
+    def index_single(self, index, doc_id, body):
+        name = self.state.write_index(index)
+        if name is None:
+            return self.error(400, "illegal_argument_exception", index)
+        self.state.index_document(name, doc_id, json.loads(body))
+        return self.send_json(
+            200, {"_index": name, "_id": doc_id, "result": "created", "status": 201}
+        )
+
+    def bulk(self, default_index, body):
+        self.state.stats["bulk_requests"] += 1
+        lines = body.splitlines()
+        items = []
+        errors = False
+        position = 0
+        while position < len(lines):
+            if not lines[position].strip():
+                position += 1
+                continue
+            (op_type, meta), = json.loads(lines[position]).items()
+            position += 1
+            source = None
+            if op_type != "delete":
+                source = lines[position]
+                position += 1
+
+            index = meta.get("_index", default_index)
+            doc_id = meta.get("_id") or str(self.state.stats["indexed"])
+            result = {"_index": index, "_id": doc_id}
+            name = self.state.write_index(index)
+            if self.state.rejection_rate and (
+                self.state.random.random() < self.state.rejection_rate
+            ):
+                self.state.stats["rejected"] += 1
+                result["status"] = 429
+                result["error"] = {
+                    "type": "es_rejected_execution_exception",
+                    "reason": "rejected by the stand-in",
+                }
+            elif name is None:
+                result["status"] = 400
+                result["error"] = {"type": "illegal_argument_exception"}
+            elif op_type == "delete":
+                found = self.state.delete_document(name, doc_id)
+                result["status"] = 200 if found else 404
+                result["result"] = "deleted" if found else "not_found"
+            else:
+                document = json.loads(source) if self.state.store else None
+                self.state.index_document(name, doc_id, document)
+                result["status"] = 201
+                result["result"] = "created"
+
+            errors = errors or result["status"] >= 300
+            items.append({op_type: result})
+
+        return self.send_json(200, {"took": 1, "errors": errors, "items": items})
+
+    def search(self, indices, body):
+        """only completion suggestions are supported, matched against the prefixes of the
+        inputs of the stored documents (lowercase and without accents)
+        """
+        fields = body.get("_source")
+        suggest = {}
+        for name, request in body.get("suggest", {}).items():
+            completion = request["completion"]
+            options = []
+            for index in indices:
+                for doc_id, source in self.state.indices[index]["docs"].items():
+                    option = self.complete(
+                        source, completion["field"], request["prefix"]
+                    )
+                    if option is None:
+                        continue
+                    if isinstance(fields, list):
+                        source = {key: source[key] for key in fields if key in source}
+                    options.append(
+                        dict(option, _index=index, _id=doc_id, _source=source)
+                    )
+            options.sort(key=lambda option: (-option["_score"], option["text"]))
+            suggest[name] = [
+                {
+                    "text": request["prefix"],
+                    "offset": 0,
+                    "length": len(request["prefix"]),
+                    "options": options[: completion.get("size", 5)],
+                }
+            ]
+        hits = {"total": {"value": 0, "relation": "eq"}, "hits": []}
+        return self.send_json(
+            200, {"took": 1, "timed_out": False, "hits": hits, "suggest": suggest}
+        )
+
+    def complete(self, source, field, prefix):
+        """ the option of the document for the prefix, or None if it does not match """
+        value = (source or {}).get(field)
+        inputs, weight = value, 0
+        if isinstance(value, dict):
+            inputs, weight = value.get("input", []), value.get("weight", 0)
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        prefix = fold_text(prefix)
+        for text in inputs or []:
+            if fold_text(text).startswith(prefix):
+                return {"text": text, "_score": float(weight)}
+        return None
+
+    def update_aliases(self, body):
+        for action in body.get("actions", []):
+            (action_type, data), = action.items()
+            if action_type == "add":
+                self.state.aliases[data["index"]].add(data["alias"])
+            elif action_type == "remove":
+                self.state.aliases.get(data["index"], set()).discard(data["alias"])
+            elif action_type == "remove_index":
+                self.state.delete_index(data["index"])
+        return self.send_json(200, {"acknowledged": True})
+
+    def get_alias(self, alias):
+        indices = [
+            index for index, aliases in self.state.aliases.items() if alias in aliases
+        ]
+        if not indices:
+            error = {"error": f"alias [{alias}] missing", "status": 404}
+            return self.send_json(404, error)
+        return self.send_json(
+            200, {index: {"aliases": {alias: {}}} for index in indices}
+        )
+
+
+class ElasticStandin:
+    """ the stand-in server, running in a background thread """
+
+    def __init__(
+        self, host="127.0.0.1", port=0, latency=0.0, rejection_rate=0.0, store=False
+    ):
+        self.server = ThreadingHTTPServer((host, port), StandinHandler)
+        self.server.daemon_threads = True
+        self.server.state = StandinState(latency, rejection_rate, store)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for Elastic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds to wait in each request"
+    )
+    parser.add_argument(
+        "--rejection-rate",
+        type=float,
+        default=0.0,
+        help="Ratio of bulk items rejected with a 429 status",
+    )
+    parser.add_argument(
+        "--store", action="store_true", help="Keep the indexed documents in memory"
+    )
+    myargs = parser.parse_args()
+
+    standin = ElasticStandin(
+        myargs.host, myargs.port, myargs.latency, myargs.rejection_rate, myargs.store
+    )
+    print(f"Listening on {myargs.host}:{standin.port}", flush=True)
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.stop()
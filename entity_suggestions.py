@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Suggestion indices to autocomplete the names of the authorities and companies.
+
+Searching a prefix in the contracts_es and contracts_eu indices is slow and returns a
+hit for every contract. These indices have a single document per authority or company,
+keyed by the slug of its name, with a completion field weighted by its number of
+contracts, so that type-ahead queries are answered from the in-memory completion
+structures of Elastic without touching the contract documents:
+
+- suggest_authorities_es, suggest_authorities_eu
+- suggest_companies_es, suggest_companies_eu
+
+They are built from the rollups of step_03_build_aggregates.py (run it after step 4, so
+that the names are the fixed ones), and step_05 keeps them up to date with
+--suggestions: only the entities that are new or have changed are sent, and the ones
+that have disappeared are deleted, using a manifest as the contract indices do.
+
+    python step_05_index_contracts.py --year 2021 --suggestions
+    python entity_suggestions.py --query osaki --kind authority
+"""
+import argparse
+import json
+import time
+
+from slugify import slugify
+
+import instrumentation
+from index_manifest import IndexManifest, content_hash
+from index_mappings import get_suggestion_index_body
+from instrumentation import stage
+from step_03_build_aggregates import AGGREGATES_FOLDER, EXPORT_FILENAMES
+from utils import normalize_text
+
+ELASTIC_INDEX_PREFIX = "suggest"
+LANGUAGES = ["es", "eu"]
+INDEX_NAMES = {"authority": "authorities", "company": "companies"}
+# the manifests are kept in cache/index_manifest/suggestions/
+MANIFEST_YEAR = "suggestions"
+# names can be completed from any of their first words, not only the first one
+MAX_WORD_INPUTS = 6
+MIN_WORD_LENGTH = 3
+LEGAL_FORMS = frozenset(["coop", "scoop", "sal", "sll", "slu", "sau", "sccl", "scp"])
+SUGGESTION_SIZE = 10
+
+
+def get_index(kind, language):
+    return f"{ELASTIC_INDEX_PREFIX}_{INDEX_NAMES[kind]}_{language}"
+
+
+def is_cif(key):
+    """ authorities are keyed by their code, and companies without CIF by their slug """
+    return not key.isdigit() and slugify(key) != key
+
+
+def get_inputs(name, keys):
+    """the texts the entity can be completed from: its name, the name from each of its
+    first words (skipping short ones like "de" and legal forms like "S.L."), and its CIFs
+    """
+    words = name.split()
+    inputs = [name]
+    for position in range(1, min(len(words), MAX_WORD_INPUTS)):
+        word = normalize_text(words[position]).replace(" ", "")
+        if len(word) >= MIN_WORD_LENGTH and word not in LEGAL_FORMS:
+            inputs.append(" ".join(words[position:]))
+    inputs.extend(key for key in keys if is_cif(key))
+    return list(dict.fromkeys(inputs))
+
+
+def build_suggestions(kind, language, aggregates_folder=AGGREGATES_FOLDER):
+    """slug -> suggestion document of every entity of the kind in the rollups, with the
+    contracts of the entities with the same slug added together
+    """
+    filename = f"{aggregates_folder}/{language}/{EXPORT_FILENAMES[kind]}"
+    with open(filename) as fp:
+        rollups = json.load(fp)[kind]
+
+    entities = {}
+    for key, rollup in rollups.items():
+        name = rollup["name"] or key
+        slug = slugify(name) or key
+        entity = entities.setdefault(
+            slug, {"name": name, "keys": [], "contracts": 0, "names": {}}
+        )
+        entity["keys"].append(key)
+        entity["contracts"] += int(rollup["total"]["contracts"])
+        # the name of the entity with the most contracts
+        names = entity["names"]
+        names[name] = names.get(name, 0) + int(rollup["total"]["contracts"])
+        entity["name"] = max(names, key=lambda item: (names[item], item))
+
+    return {
+        slug: {
+            "suggest": {
+                "input": get_inputs(entity["name"], entity["keys"]),
+                "weight": entity["contracts"],
+            },
+            "kind": kind,
+            "slug": slug,
+            "name": entity["name"],
+            "keys": sorted(entity["keys"]),
+            "contracts": entity["contracts"],
+        }
+        for slug, entity in sorted(entities.items())
+    }
+
+
+class SuggestionIndexer:
+    def __init__(self, language="es", aggregates_folder=AGGREGATES_FOLDER, client=None):
+        self.language = language
+        self.aggregates_folder = aggregates_folder
+        self.client = client
+
+    def get_client(self):
+        if self.client is None:
+            from step_05_index_contracts import get_client
+
+            self.client = get_client()
+        return self.client
+
+    def generate_actions(self, index, suggestions, manifest):
+        """ index the suggestions that have changed, and delete the missing ones """
+        for slug, doc in suggestions.items():
+            doc_hash = content_hash(json.dumps(doc, sort_keys=True).encode("utf-8"))
+            if manifest.check(slug, doc_hash):
+                yield {"_index": index, "_id": slug, "_source": doc}
+
+        for slug in manifest.missing_ids():
+            yield {"_op_type": "delete", "_index": index, "_id": slug}
+
+    def index_suggestions(self, full=False):
+        """update the suggestion indices of the language, and return kind -> number of
+        documents indexed or deleted. With full (or when an index is new) every
+        suggestion is indexed again.
+        """
+        from elasticsearch.helpers import streaming_bulk
+
+        client = self.get_client()
+        results = {}
+        for kind in INDEX_NAMES:
+            try:
+                suggestions = build_suggestions(
+                    kind, self.language, self.aggregates_folder
+                )
+            except FileNotFoundError:
+                print(
+                    f"There are no {kind} rollups for {self.language}, "
+                    "run step_03_build_aggregates.py first"
+                )
+                continue
+
+            index = get_index(kind, self.language)
+            reset = full
+            if not client.indices.exists(index=index):
+                client.indices.create(index=index, body=get_suggestion_index_body())
+                reset = True
+            manifest = IndexManifest.load(index, MANIFEST_YEAR, reset=reset)
+
+            results[kind] = 0
+            with stage(f"index_suggestions_{kind}_{self.language}") as current:
+                for ok, item in streaming_bulk(
+                    client,
+                    self.generate_actions(index, suggestions, manifest),
+                    raise_on_error=False,
+                ):
+                    op_type, result = next(iter(item.items()))
+                    if op_type == "delete" and (ok or result.get("status") == 404):
+                        manifest.remove(result["_id"])
+                    elif ok:
+                        manifest.confirm(result["_id"])
+                    else:
+                        current.add(ok=False)
+                        continue
+                    results[kind] += 1
+                    current.add()
+            manifest.dump()
+        return results
+
+
+def suggest(client, prefix, kind, language="es", size=SUGGESTION_SIZE):
+    """the entities of the kind whose name (or one of its words, or CIF) starts with the
+    prefix, the ones with more contracts first
+    """
+    response = client.search(
+        index=get_index(kind, language),
+        body={
+            "size": 0,
+            "_source": ["slug", "name", "keys", "contracts"],
+            "suggest": {
+                "entity": {
+                    "prefix": prefix,
+                    "completion": {
+                        "field": "suggest",
+                        "size": size,
+                        "skip_duplicates": True,
+                    },
+                }
+            },
+        },
+    )
+    return [option["_source"] for option in response["suggest"]["entity"][0]["options"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Update or query the authority and company suggestion indices"
+    )
+    parser.add_argument("--query", help="Prefix to complete")
+    parser.add_argument("--kind", choices=list(INDEX_NAMES), default="company")
+    parser.add_argument("--language", choices=LANGUAGES, default="es")
+    parser.add_argument("--size", type=int, default=SUGGESTION_SIZE)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Index all the suggestions, not only the changed ones",
+    )
+    instrumentation.add_arguments(parser)
+    myargs = parser.parse_args()
+    instrumentation.configure_from_args(myargs)
+
+    if myargs.query:
+        from step_05_index_contracts import get_client
+
+        start = time.perf_counter()
+        entities = suggest(
+            get_client(), myargs.query, myargs.kind, myargs.language, myargs.size
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        for entity in entities:
+            print(f"{entity['contracts']:>8} {entity['name']} ({entity['slug']})")
+        print(f"{len(entities)} suggestions in {elapsed:.1f} ms")
+    else:
+        for language in LANGUAGES:
+            results = SuggestionIndexer(language).index_suggestions(myargs.full)
+            print(f"{language}: {results}")
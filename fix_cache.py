@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded cache for the authority and company fixes done in step_04.
+
+The same authorities and companies are repeated in thousands of contracts, so we compute
+their fixes once and reuse them. The cache is saved to disk to reuse it in the next runs
+and years, and it is discarded when any of the reference data files changes (or the
+CACHE_VERSION, when the way the fixes are computed changes).
+"""
+import json
+import os
+import threading
+from collections import Counter, OrderedDict
+
+from utils import file_checksum
+
+CACHE_FILENAME = "cache/fix_cache.json"
+REFERENCE_FILENAMES = [
+    "cache/contractors.json",
+    "cache/companies.json",
+    "cache/companies_mapping.json",
+    "cifs/data.csv",
+]
+MAX_SIZE = 100000
+# part of the fingerprint, to discard the caches saved before the fixes changed
+CACHE_VERSION = 2
+
+
+class FixCache:
+    def __init__(self, fingerprint=None, max_size=MAX_SIZE):
+        self.fingerprint = fingerprint or {}
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls,
+        reference_filenames=REFERENCE_FILENAMES,
+        cache_filename=CACHE_FILENAME,
+        max_size=MAX_SIZE,
+    ):
+        """load the saved cache, unless the reference data used to build it has changed"""
+        fingerprint = {
+            filename: file_checksum(filename) for filename in reference_filenames
+        }
+        fingerprint["version"] = CACHE_VERSION
+        cache = cls(fingerprint, max_size)
+        try:
+            with open(cache_filename) as fp:
+                data = json.load(fp)
+            if data["fingerprint"] == fingerprint:
+                for key, value in data["entries"][-max_size:]:
+                    cache.entries[key] = value
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        return cache
+
+    def dump(self, cache_filename=CACHE_FILENAME):
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        with open(cache_filename, "w") as fp:
+            json.dump(
+                {
+                    "fingerprint": self.fingerprint,
+                    "entries": list(self.entries.items()),
+                },
+                fp,
+            )
+
+    def get_or_set(self, namespace, key, func):
+        """return the cached value for the key, or compute it calling func and cache it"""
+        cache_key = f"{namespace}:{key}"
+        with self.lock:
+            if cache_key in self.entries:
+                self.hits[namespace] += 1
+                self.entries.move_to_end(cache_key)
+                return self.entries[cache_key]
+
+            self.misses[namespace] += 1
+
+        # func may be slow, so it runs without the lock: two threads may compute the same
+        # value at the same time, which is harmless
+        value = func()
+        with self.lock:
+            self.entries[cache_key] = value
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        """ hits, misses and hit rate of each namespace """
+        result = {}
+        for namespace in sorted(set(self.hits) | set(self.misses)):
+            hits = self.hits[namespace]
+            misses = self.misses[namespace]
+            result[namespace] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses),
+            }
+        return result
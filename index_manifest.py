@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Local manifest of the contracts already indexed in Elastic, with the hash of their content.
+
+It is used to index only the contracts that are new or have changed since the last run,
+and to know which contracts have disappeared, so that they can be deleted from the index.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_FOLDER = "cache/index_manifest"
+
+
+def content_hash(content):
+    """ sha1 of the contents of a contract file """
+    return hashlib.sha1(content).hexdigest()
+
+
+class IndexManifest:
+    def __init__(self, filename, hashes=None):
+        self.filename = filename
+        self.hashes = hashes or {}
+        self.pending = {}
+        self.seen = set()
+
+    @classmethod
+    def load(cls, index, year, manifest_folder=MANIFEST_FOLDER, reset=False, shard=None):
+        """load the manifest of the index for the year, or an empty one with reset (when the
+        index is going to be rebuilt from scratch)
+
+        With a shard, only the contracts of the shard are loaded, and the manifest is saved
+        to its own file, to be merged with sharding.py when all the shards are done
+        """
+        from sharding import in_shard, sharded_filename
+
+        filename = f"{manifest_folder}/{year}/{index}.json"
+        shard_filename = sharded_filename(filename, shard)
+        if reset:
+            return cls(shard_filename)
+
+        hashes = {}
+        # the shard file has the changes of a previous run of the shard not merged yet
+        for manifest_filename in sorted({filename, shard_filename}, key=len):
+            try:
+                with open(manifest_filename) as fp:
+                    hashes.update(json.load(fp))
+            except (FileNotFoundError, ValueError):
+                pass
+
+        hashes = {
+            doc_id: doc_hash
+            for doc_id, doc_hash in hashes.items()
+            if in_shard(doc_id, shard)
+        }
+        return cls(shard_filename, hashes)
+
+    def dump(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(self.filename, "w") as fp:
+            json.dump(self.hashes, fp)
+
+    def check(self, doc_id, doc_hash):
+        """return True if the document is new or has changed since it was indexed, and keep its
+        hash until the indexing is confirmed
+        """
+        self.seen.add(doc_id)
+        if self.hashes.get(doc_id) == doc_hash:
+            return False
+
+        self.pending[doc_id] = doc_hash
+        return True
+
+    def confirm(self, doc_id):
+        """ the document has been indexed """
+        if doc_id in self.pending:
+            self.hashes[doc_id] = self.pending.pop(doc_id)
+
+    def remove(self, doc_id):
+        """ the document has been deleted from the index """
+        self.hashes.pop(doc_id, None)
+
+    def missing_ids(self):
+        """ indexed documents that have not been seen in this run """
+        return sorted(set(self.hashes) - self.seen)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Explicit mapping of the contracts_es and contracts_eu indices.
+
+Fields that are not declared here are kept in the _source of the documents but they are
+not indexed, so the number of fields of the index does not grow with the data.
+
+Increase MAPPING_VERSION every time the mapping changes, the indices created with an older
+version need to be rebuilt.
+"""
+
+MAPPING_VERSION = 1
+
+TEXT_WITH_KEYWORD = {
+    "type": "text",
+    "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+}
+
+AMOUNT = {"type": "scaled_float", "scaling_factor": 100}
+
+NAME_AND_CODE = {
+    "properties": {
+        "name": TEXT_WITH_KEYWORD,
+        "code": {"type": "keyword"},
+    }
+}
+
+CONTRACT_MAPPING = {
+    "dynamic": False,
+    "_meta": {"mapping_version": MAPPING_VERSION},
+    "properties": {
+        "id": {"type": "keyword"},
+        "year": {"type": "keyword"},
+        "title": {"type": "text"},
+        "authority": {
+            "properties": {
+                "name": TEXT_WITH_KEYWORD,
+                "cif": {"type": "keyword"},
+                "code": {"type": "keyword"},
+                "slug": {"type": "keyword"},
+            }
+        },
+        "budget": AMOUNT,
+        "status": NAME_AND_CODE,
+        "contract_type": NAME_AND_CODE,
+        "processing_type": NAME_AND_CODE,
+        "adjudication_procedure": NAME_AND_CODE,
+        "minor_contract": {"type": "boolean"},
+        "offerers": {
+            "type": "nested",
+            "properties": {
+                "name": TEXT_WITH_KEYWORD,
+                "cif": {"type": "keyword"},
+                "sme": {"type": "boolean"},
+                "date": {"type": "date"},
+            },
+        },
+        "offerer_count": {"type": "integer", "ignore_malformed": True},
+        "winners": {
+            "type": "nested",
+            "properties": {
+                "name": TEXT_WITH_KEYWORD,
+                "cif": {"type": "keyword"},
+                "slug": {"type": "keyword"},
+            },
+        },
+        "resolutions": {
+            "type": "nested",
+            "properties": {
+                "priceWithVAT": AMOUNT,
+            },
+        },
+        "adjudication_date": {"type": "date"},
+    },
+}
+
+
+def get_index_body():
+    """ body to create a contracts index """
+    return {"mappings": CONTRACT_MAPPING}
+
+
+def get_mapping_version(mapping):
+    """ mapping version of the mapping of an existing index, 0 if it has none"""
+    return mapping.get("_meta", {}).get("mapping_version", 0)
+
+
+AGGREGATE_METRIC_FIELDS = {
+    "contracts": {"type": "integer"},
+    "budget": AMOUNT,
+    "awarded": AMOUNT,
+    "minor_contracts": {"type": "integer"},
+    "offerers": {"type": "integer"},
+    "offerer_contracts": {"type": "integer"},
+    "minor_ratio": {"type": "float"},
+    "average_offerers": {"type": "float"},
+}
+
+AGGREGATE_MAPPING = {
+    "dynamic": False,
+    "_meta": {"mapping_version": MAPPING_VERSION},
+    "properties": dict(
+        {
+            "kind": {"type": "keyword"},
+            "key": {"type": "keyword"},
+            "name": TEXT_WITH_KEYWORD,
+            "year": {"type": "keyword"},
+            "contract_type": NAME_AND_CODE,
+        },
+        **AGGREGATE_METRIC_FIELDS,
+    ),
+}
+
+
+def get_aggregate_index_body():
+    """ body to create an index of the authority and company rollups """
+    return {"mappings": AGGREGATE_MAPPING}
+
+
+# lowercase and without accents, so that "osaki" suggests "Osakidetza" and "gipuzkoako"
+# suggests "Gipuzkoako Foru Aldundia"
+SUGGESTION_SETTINGS = {
+    "analysis": {
+        "analyzer": {
+            "folding": {
+                "type": "custom",
+                "tokenizer": "standard",
+                "filter": ["lowercase", "asciifolding"],
+            }
+        }
+    }
+}
+
+SUGGESTION_MAPPING = {
+    "dynamic": False,
+    "_meta": {"mapping_version": MAPPING_VERSION},
+    "properties": {
+        "suggest": {
+            "type": "completion",
+            "analyzer": "folding",
+            "max_input_length": 100,
+        },
+        "kind": {"type": "keyword"},
+        "slug": {"type": "keyword"},
+        "name": {"type": "keyword"},
+        "keys": {"type": "keyword"},
+        "contracts": {"type": "integer"},
+    },
+}
+
+
+def get_suggestion_index_body():
+    """ body to create an index of authority or company suggestions """
+    return {"settings": SUGGESTION_SETTINGS, "mappings": SUGGESTION_MAPPING}
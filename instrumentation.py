@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the steps: wall time, CPU time, items per second, peak memory and errors
+of each stage, with rate-limited progress messages instead of a print for every contract.
+
+A stage is measured with the context manager, or with the decorator for functions called
+once per item (each call counts as an item). Both work with async functions too:
+
+    from instrumentation import instrument, stage
+
+    with stage("index_es") as current:
+        for ok, item in streaming_bulk(...):
+            current.add(ok=ok)
+
+    @instrument("process_contract")
+    async def process_contract(self, folder):
+        ...
+
+Handled errors and other events can be counted in the current stage with error() and
+count("not_found").
+
+The steps accept these options:
+
+- --report to write a JSON report of the run
+- --trace-memory to measure the peak memory allocated in each stage with tracemalloc (it
+  slows the run down, and stages running at the same time share the same peak)
+- --profile cprofile|sample to profile the run with cProfile (main thread only) or with a
+  sampling profiler of every thread
+"""
+import atexit
+import contextlib
+import contextvars
+import cProfile
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+try:
+    import resource
+except ImportError:  # not available in Windows
+    resource = None
+
+PROGRESS_INTERVAL = 5.0
+SAMPLE_INTERVAL = 0.005
+PROFILE_TOP = 30
+PROFILERS = ["cprofile", "sample"]
+
+_CURRENT = contextvars.ContextVar("current_stage", default=None)
+
+
+def get_max_rss():
+    """ the peak resident memory of the process in bytes, if it can be known """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # it is measured in bytes in macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class StageStats:
+    def __init__(self, name, total=None, progress_interval=PROGRESS_INTERVAL):
+        self.name = name
+        self.total = total
+        self.progress_interval = progress_interval
+        self.calls = 0
+        self.items = 0
+        self.errors = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_traced_bytes = None
+        self.max_rss_bytes = None
+        self.counters = Counter()
+        self.running = {}
+        self.lock = threading.Lock()
+        self.last_progress = time.monotonic()
+
+    def add(self, items=1, ok=True):
+        """ count processed items (or failed ones, when ok is False) """
+        with self.lock:
+            self.items += items
+            if not ok:
+                self.errors += items
+            now = time.monotonic()
+            if now - self.last_progress < self.progress_interval:
+                return
+            self.last_progress = now
+        self.print_progress()
+
+    def error(self, errors=1):
+        with self.lock:
+            self.errors += errors
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+
+    def print_progress(self):
+        total = f"/{self.total}" if self.total else ""
+        print(
+            f"{self.name}: {self.items}{total} items, {self.errors} errors "
+            f"({self.items_per_second():.1f} items/s)"
+        )
+
+    def items_per_second(self):
+        # the time of the stage is only added when it finishes, so use the running time
+        running = self.wall_seconds + sum(
+            time.perf_counter() - start for start in self.running.values()
+        )
+        return self.items / running if running else 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "items": self.items,
+            "errors": self.errors,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "cpu_seconds": round(self.cpu_seconds, 4),
+            "items_per_second": round(self.items / self.wall_seconds, 2)
+            if self.wall_seconds
+            else None,
+            "peak_traced_bytes": self.peak_traced_bytes,
+            "max_rss_bytes": self.max_rss_bytes,
+            "counters": dict(self.counters),
+        }
+
+
+class Sampler(threading.Thread):
+    """ sampling profiler: count the functions running in every thread at regular intervals """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = 0
+        self.own = Counter()
+        self.cumulative = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                self.samples += 1
+                self.own[self.describe(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    function = self.describe(frame)
+                    if function not in seen:
+                        self.cumulative[function] += 1
+                        seen.add(function)
+                    frame = frame.f_back
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    @staticmethod
+    def describe(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+    def as_dict(self, top=PROFILE_TOP):
+        return {
+            "samples": self.samples,
+            "interval": self.interval,
+            "own": self.own.most_common(top),
+            "cumulative": self.cumulative.most_common(top),
+        }
+
+
+class RunReport:
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.report_filename = None
+        self.profile = None
+        self.profiler = None
+        self.trace_memory = False
+        self.progress_interval = PROGRESS_INTERVAL
+        self.finished = False
+
+    def get_stage(self, name, total=None):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats(name, total, self.progress_interval)
+            elif total:
+                self.stages[name].total = total
+            return self.stages[name]
+
+    def start_profiling(self, profile):
+        self.profile = profile
+        if profile == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profile == "sample":
+            self.profiler = Sampler()
+            self.profiler.start()
+
+    def stop_profiling(self):
+        """ stop the profiler and return its results for the report """
+        if self.profile == "cprofile":
+            self.profiler.disable()
+            filename = f"{os.path.splitext(self.report_filename or 'kontrata')[0]}.prof"
+            self.profiler.dump_stats(filename)
+            return {"profiler": "cprofile", "stats_filename": filename}
+        if self.profile == "sample":
+            self.profiler.stop()
+            return dict(self.profiler.as_dict(), profiler="sample")
+        return None
+
+    def as_dict(self):
+        return {
+            "argv": sys.argv,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "seconds": round(time.time() - self.started, 3),
+            "max_rss_bytes": get_max_rss(),
+            "stages": {name: stats.as_dict() for name, stats in self.stages.items()},
+        }
+
+    def finish(self):
+        """ stop profiling, print a summary of the stages and write the report, if enabled """
+        if self.finished:
+            return None
+        self.finished = True
+
+        report = self.as_dict()
+        profile = self.stop_profiling()
+        if profile:
+            report["profile"] = profile
+        for name, stats in report["stages"].items():
+            print(
+                f"{name}: {stats['items']} items, {stats['errors']} errors in "
+                f"{stats['wall_seconds']:.2f}s ({stats['cpu_seconds']:.2f}s CPU)"
+            )
+        if self.report_filename:
+            directory = os.path.dirname(self.report_filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.report_filename, "w") as fp:
+                json.dump(report, fp, indent=4)
+            print(f"Report written to {self.report_filename}")
+        return report
+
+
+REPORT = RunReport()
+
+
+def configure(
+    report=None, profile=None, trace_memory=False, progress_interval=PROGRESS_INTERVAL
+):
+    """enable the report, the profiler and memory tracing for this run. The report is
+    written when the program exits.
+    """
+    REPORT.report_filename = report
+    REPORT.trace_memory = trace_memory
+    REPORT.progress_interval = progress_interval
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile:
+        REPORT.start_profiling(profile)
+    atexit.register(REPORT.finish)
+
+
+def add_arguments(parser):
+    """ add the instrumentation options to the argument parser of a step """
+    parser.add_argument("--report", help="Write a JSON report of the run to this file")
+    parser.add_argument(
+        "--profile", choices=PROFILERS, help="Profile the run with this profiler"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Measure the peak memory of each stage with tracemalloc",
+    )
+
+
+def configure_from_args(args):
+    configure(args.report, args.profile, args.trace_memory)
+
+
+@contextlib.contextmanager
+def stage(name, total=None):
+    """measure a stage of the run, yielding its stats to count the processed items. Using
+    the same name again adds to the previous measures.
+    """
+    stats = REPORT.get_stage(name, total)
+    token = _CURRENT.set(stats)
+    key = object()
+    tracing = REPORT.trace_memory and tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    start_cpu = time.process_time()
+    stats.running[key] = start = time.perf_counter()
+    try:
+        yield stats
+    except BaseException:
+        stats.error()
+        raise
+    finally:
+        wall_seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - start_cpu
+        _CURRENT.reset(token)
+        with stats.lock:
+            del stats.running[key]
+            stats.calls += 1
+            stats.wall_seconds += wall_seconds
+            stats.cpu_seconds += cpu_seconds
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                stats.peak_traced_bytes = max(stats.peak_traced_bytes or 0, peak)
+            stats.max_rss_bytes = get_max_rss()
+
+
+def instrument(name=None):
+    """decorator to measure every call of the function in a stage (named after the function
+    unless name is given), counting each call as a processed item
+    """
+
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(stage_name) as current:
+                    result = await func(*args, **kwargs)
+                    current.add()
+                    return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name) as current:
+                result = func(*args, **kwargs)
+                current.add()
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def current_stage():
+    return _CURRENT.get()
+
+
+def count(counter, value=1):
+    """ count an event in the current stage, if any """
+    stats = _CURRENT.get()
+    if stats is not None:
+        stats.count(counter, value)
+
+
+def error(errors=1):
+    """ count a handled error in the current stage, if any """
+    stats = _CURRENT.get()
+    if stats is not None:
+        stats.error(errors)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Single entry point for every step, with a subcommand per step:
+
+    python kontrata.py download --year 2021
+    python kontrata.py process --year 2021 --changes
+    python kontrata.py index --year 2021 --incremental
+    python kontrata.py status
+    python kontrata.py reprocess --year 2021 233862
+
+The options of each step are the ones of its script (see `kontrata.py process --help`).
+The modules of a step, and the dependencies they import (elasticsearch, aiohttp,
+xmltodict...), are only imported when that step runs, so that short commands like status
+start fast when cron runs many of them.
+"""
+import argparse
+import os
+import runpy
+import sys
+
+from years import CONTRACT_URLS, LISTING_FILENAMES, get_listing_filename
+
+# subcommand -> (module, help)
+STEPS = {
+    "cache": (
+        "step_00_cache_contracts_files",
+        "Download the contractors and the listings (step 0)",
+    ),
+    "download": ("step_01_get_contracts", "Download the contracts (step 1)"),
+    "process": ("step_02_process_contracts", "Build the contract JSON files (step 2)"),
+    "dicts": (
+        "step_03_build_data_dicts",
+        "Build the authorities and companies data (step 3)",
+    ),
+    "aggregates": ("step_03_build_aggregates", "Build the spending rollups"),
+    "fix": (
+        "step_04_fix_authority_and_company_data_async",
+        "Fix the authority and company data (step 4)",
+    ),
+    "index": ("step_05_index_contracts", "Index the contracts in elastic (step 5)"),
+    "export": (
+        "step_06_export_contracts",
+        "Export the contracts to NDJSON and CSV (step 6)",
+    ),
+    "pipeline": ("pipeline", "Download, parse, fix and index in a single run"),
+    "search": ("search_index", "Build or query the embedded search index"),
+    "merge-shards": ("sharding", "Merge the files written by each shard"),
+}
+
+
+def run_step(module, argv):
+    """ run the script of the step as if it was called with the argv arguments """
+    previous_argv = sys.argv
+    sys.argv = [f"{module}.py"] + list(argv)
+    try:
+        runpy.run_module(module, run_name="__main__", alter_sys=True)
+    finally:
+        sys.argv = previous_argv
+
+
+def count_folders(folder):
+    try:
+        with os.scandir(folder) as entries:
+            return sum(1 for entry in entries if entry.is_dir())
+    except FileNotFoundError:
+        return 0
+
+
+def get_status(years):
+    """ what has been done for each year, looking only at the files in disk """
+    from change_feed import ChangeFeed
+
+    status = {}
+    for year in years:
+        sequences = ChangeFeed(year).sequences()
+        status[year] = {
+            "listings": [
+                language
+                for language in LISTING_FILENAMES
+                if os.path.exists(get_listing_filename(year, language))
+            ],
+            "downloaded": count_folders(f"contracts/{year}"),
+            "processed": count_folders(f"processed/contracts/{year}"),
+            "last_change_feed": sequences[-1] if sequences else None,
+        }
+    return status
+
+
+def status(args):
+    years = [args.year] if args.year else list(CONTRACT_URLS.keys())
+    for year, year_status in get_status(years).items():
+        print(
+            f"{year}: listings {','.join(year_status['listings']) or '-'}, "
+            f"{year_status['downloaded']} downloaded, "
+            f"{year_status['processed']} processed, "
+            f"change feed {year_status['last_change_feed'] or '-'}"
+        )
+
+
+def reprocess(args):
+    """ parse the XML files of the contracts again, and fix them with --fix """
+    import json
+
+    from step_02_process_contracts import ContractProcessor
+
+    fixer = None
+    if args.fix:
+        from step_04_fix_authority_and_company_data_async import (
+            ContractProcessor as ContractFixer,
+        )
+
+        fixer = ContractFixer(args.year)
+    processor = ContractProcessor(args.year)
+    for contract_id in args.ids:
+        for language in ("es", "eu"):
+            folder = f"contracts/{args.year}/{contract_id}/{language}"
+            contract = processor.build_contract(folder)
+            if not contract:
+                print(f"{folder} can not be processed")
+                continue
+            if fixer is not None:
+                contract = fixer.fix_contents(contract, language)
+            with open(f"processed/{folder}/contract.json", "w") as fp:
+                json.dump(contract, fp, indent=4)
+            print(f"Processed {folder}")
+    if fixer is not None:
+        fixer.save_cache()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="kontrata", description="Download, process and index public contracts"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (module, step_help) in STEPS.items():
+        # the options are parsed by the step itself, --help included
+        subparsers.add_parser(name, help=step_help, add_help=False)
+
+    status_parser = subparsers.add_parser(
+        "status", help="Show the contracts downloaded and processed of each year"
+    )
+    status_parser.add_argument("--year", choices=list(CONTRACT_URLS.keys()))
+
+    reprocess_parser = subparsers.add_parser(
+        "reprocess", help="Process some contracts again from their XML files"
+    )
+    reprocess_parser.add_argument(
+        "--year", choices=list(CONTRACT_URLS.keys()), required=True
+    )
+    reprocess_parser.add_argument("ids", nargs="+", help="Contract ids")
+    reprocess_parser.add_argument(
+        "--fix", action="store_true", help="Fix the authority and company data too"
+    )
+    return parser
+
+
+def main(argv=None):
+    args, extra = get_parser().parse_known_args(argv)
+    if args.command in STEPS:
+        run_step(STEPS[args.command][0], extra)
+    elif extra:
+        get_parser().error(f"unrecognized arguments: {' '.join(extra)}")
+    elif args.command == "status":
+        status(args)
+    elif args.command == "reprocess":
+        reprocess(args)
+
+
+if __name__ == "__main__":
+    main()
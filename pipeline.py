@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming pipeline that runs the download, parse, fix and index steps of a year at the
+same time:
+
+    download (step_01) -> parse (step_02) -> fix (step_04) -> index (step_05)
+
+Each stage has its own worker threads and is connected to the next one by a bounded
+queue, so a stage that is faster than the next one waits for it instead of piling up
+contracts, and the first contracts are indexed while the rest are still being downloaded.
+Only the files that other steps need are written: the downloaded XML files (to resume the
+downloads) and the fixed processed contracts (for step_03 and step_05).
+
+Step 3 is not part of the pipeline, because it needs all the contracts of every year to
+build the reference data used to fix them. Run it afterwards as usual.
+
+    python pipeline.py --year 2021 --download-workers 8
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import requests
+
+import sharding
+from sharding import in_shard
+from step_01_get_contracts import ContractDownloader, fetch_item
+from step_02_process_contracts import ContractProcessor
+from years import CONTRACT_URLS
+
+QUEUE_SIZE = 100
+DOWNLOAD_WORKERS = 8
+PARSE_WORKERS = 2
+FIX_WORKERS = 2
+INDEX_MAX_AGE = 1.0
+
+END = object()
+
+
+class Stage:
+    """a pipeline stage: func is called with each item of the input queue, and its result is
+    passed to the next stage, unless it is None
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.first_output = None
+
+    def stats(self, start):
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "first_output_seconds": round(self.first_output - start, 3)
+            if self.first_output is not None
+            else None,
+        }
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = stages
+
+    def run(self, items):
+        """feed the items to the first stage and wait until all of them have gone through the
+        pipeline, return the stats of each stage
+        """
+        start = time.monotonic()
+        next_stages = self.stages[1:] + [None]
+        for stage, next_stage in zip(self.stages, next_stages):
+            stage.threads = [
+                threading.Thread(
+                    target=self.work, args=(stage, next_stage), daemon=True
+                )
+                for _ in range(stage.workers)
+            ]
+            for thread in stage.threads:
+                thread.start()
+
+        first = self.stages[0]
+        for item in items:
+            first.queue.put(item)
+        for _ in range(first.workers):
+            first.queue.put(END)
+
+        for stage, next_stage in zip(self.stages, next_stages):
+            for thread in stage.threads:
+                thread.join()
+            if next_stage is not None:
+                for _ in range(next_stage.workers):
+                    next_stage.queue.put(END)
+
+        result = {stage.name: stage.stats(start) for stage in self.stages}
+        result["seconds"] = round(time.monotonic() - start, 3)
+        return result
+
+    def work(self, stage, next_stage):
+        while True:
+            item = stage.queue.get()
+            if item is END:
+                return
+
+            started = time.monotonic()
+            try:
+                output = stage.func(item)
+            except Exception as e:
+                print(f"Error in stage {stage.name}: {e!r}")
+                with stage.lock:
+                    stage.errors += 1
+                continue
+
+            with stage.lock:
+                stage.processed += 1
+                stage.busy_seconds += time.monotonic() - started
+                if output is None:
+                    stage.dropped += 1
+                elif stage.first_output is None:
+                    stage.first_output = time.monotonic()
+
+            if output is not None and next_stage is not None:
+                next_stage.queue.put(output)
+
+
+class ContractPipeline:
+    def __init__(
+        self,
+        year,
+        update=False,
+        fix=True,
+        index=True,
+        download_workers=DOWNLOAD_WORKERS,
+        parse_workers=PARSE_WORKERS,
+        fix_workers=FIX_WORKERS,
+        queue_size=QUEUE_SIZE,
+        shard=None,
+    ):
+        self.year = year
+        self.downloader = ContractDownloader(year, update, shard)
+        self.processor = ContractProcessor(year)
+        self.fixer = None
+        if fix:
+            from step_04_fix_authority_and_company_data_async import (
+                ContractProcessor as ContractFixer,
+            )
+
+            self.fixer = ContractFixer(year, shard)
+        self.index = index
+        self.indexer = None
+        self.sessions = threading.local()
+        self.stages = [
+            Stage("download", self.download, download_workers, queue_size),
+            Stage("parse", self.parse, parse_workers, queue_size),
+            Stage("fix", self.fix, fix_workers, queue_size),
+        ]
+        if index:
+            self.stages.append(Stage("index", self.index_contract, 1, queue_size))
+
+    def get_items(self):
+        for contract_id, contract in self.downloader.get_all_contracts().items():
+            if not in_shard(contract_id, self.downloader.shard):
+                continue
+            for language, contract_data in contract.items():
+                yield contract_id, language, contract_data
+
+    def get_session(self):
+        """ a requests session for each download thread """
+        if not hasattr(self.sessions, "session"):
+            self.sessions.session = requests.Session()
+        return self.sessions.session
+
+    def download(self, item):
+        contract_id, language, contract_data = item
+        for file_item in self.downloader.get_contract_items(
+            contract_id, language, contract_data
+        ):
+            fetch_item(file_item, self.get_session())
+
+        folder = f"contracts/{self.year}/{contract_id}/{language}"
+        if os.path.exists(f"{folder}/data.xml"):
+            return folder
+        return None
+
+    def parse(self, folder):
+        contract = self.processor.build_contract(folder, write_raw=False)
+        if contract:
+            return folder, contract
+        return None
+
+    def fix(self, item):
+        folder, contract = item
+        language = folder.split("/")[-1]
+        if self.fixer is not None:
+            contract = self.fixer.fix_contents(contract, language)
+
+        with open(f"processed/{folder}/contract.json", "w") as fp:
+            json.dump(contract, fp, indent=4)
+        return language, contract
+
+    def index_contract(self, item):
+        language, contract = item
+        self.indexer.add(contract, language)
+        return contract["id"]
+
+    def run(self):
+        if self.index:
+            from step_05_index_contracts import BufferedIndexer
+
+            self.indexer = BufferedIndexer(max_age=INDEX_MAX_AGE)
+        try:
+            stats = Pipeline(self.stages).run(self.get_items())
+        finally:
+            if self.indexer is not None:
+                self.indexer.close()
+        if self.fixer is not None:
+            self.fixer.save_cache()
+        if self.indexer is not None:
+            stats["index"]["indexed"] = self.indexer.indexed
+            stats["index"]["index_errors"] = len(self.indexer.errors)
+        return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download, parse, fix and index the contracts in a single run"
+    )
+    parser.add_argument("--year", help="Enter the year to process")
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Download again the existing contracts",
+    )
+    parser.add_argument(
+        "--no-fix",
+        action="store_true",
+        help="Do not fix the authority and company data",
+    )
+    parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help="Do not index the contracts in elastic",
+    )
+    parser.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS)
+    parser.add_argument("--fix-workers", type=int, default=FIX_WORKERS)
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=QUEUE_SIZE,
+        help="Maximum contracts waiting between two stages",
+    )
+    sharding.add_argument(parser)
+    myargs = parser.parse_args()
+
+    def run_year(year):
+        contract_pipeline = ContractPipeline(
+            year,
+            update=myargs.update,
+            fix=not myargs.no_fix,
+            index=not myargs.no_index,
+            download_workers=myargs.download_workers,
+            parse_workers=myargs.parse_workers,
+            fix_workers=myargs.fix_workers,
+            queue_size=myargs.queue_size,
+            shard=myargs.shard,
+        )
+        print(json.dumps(contract_pipeline.run(), indent=4))
+
+    year = myargs.year
+    if year and year not in CONTRACT_URLS.keys():
+        print(
+            "Year must be one of the followings: {}".format(
+                ",".join(CONTRACT_URLS.keys())
+            )
+        )
+    elif year:
+        run_year(year)
+    else:
+        for year in CONTRACT_URLS.keys():
+            print(f"Processing year {year}")
+            run_year(year)
+            print(f"Done year {year}")
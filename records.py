@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory representation of the processed contracts.
+
+A processed contract repeats the same labels in full: the status, contract type,
+processing type and adjudication procedure as {name, code} pairs, the authority and the
+winners (the same ones in many contracts) and the dates. ContractRecord keeps:
+
+- only the code of those categories, with their name in each language in the code table
+  of the year, so every name is kept once per year
+- a single shared instance of each different authority, winner, offerer and resolution
+- interned strings for the values that are repeated across contracts
+- __slots__ instead of a dict per object
+
+The records are read only, convert them back with to_dict() to change them, and
+ContractRecord.from_dict(contract, table, language).to_dict() is always equal to the
+contract.
+
+    table = get_code_table("2021")
+    filename = "processed/contracts/2021/233862/es/contract.json"
+    record = load_contract_record(filename, table)
+    record["contract_type"]  # {"name": "Servicios", "code": "2"}
+"""
+import json
+import sys
+
+from contract_shape import upgrade_contract_shape
+
+CATEGORIES = ["status", "contract_type", "processing_type", "adjudication_procedure"]
+CATEGORY_KEYS = ("name", "code")
+
+_CODE_TABLES = {}
+
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class CodeTable:
+    """the names of the categories of a year in each language, and the shared instances
+    of the records repeated across its contracts
+    """
+
+    def __init__(self, year=None):
+        self.year = year
+        self.names = {category: {} for category in CATEGORIES}
+        self.instances = {}
+        self.key_tuples = {}
+
+    def add_name(self, category, code, language, name):
+        """keep the name of the code, return False if the code already has another name
+        in the language
+        """
+        names = self.names[category].setdefault(code, {})
+        return names.setdefault(language, intern_value(name)) == name
+
+    def get_name(self, category, code, language):
+        return self.names[category][code][language]
+
+    def intern_keys(self, keys):
+        """ a single tuple for every record with the same keys in the same order """
+        return self.key_tuples.setdefault(keys, keys)
+
+    def get_instance(self, cls, data):
+        """ the shared record of the class with this data """
+        try:
+            key = (cls, tuple(data.items()))
+            instance = self.instances.get(key)
+        except TypeError:  # values that can not be hashed can not be shared
+            return cls.from_dict(data, self)
+        if instance is None:
+            instance = self.instances[key] = cls.from_dict(data, self)
+        return instance
+
+    def __len__(self):
+        return sum(len(codes) for codes in self.names.values())
+
+
+def get_code_table(year):
+    """ the code table of the year, shared by every record of the year """
+    if year not in _CODE_TABLES:
+        _CODE_TABLES[year] = CodeTable(year)
+    return _CODE_TABLES[year]
+
+
+class SlottedRecord:
+    """a record with a slot for each known key, the keys it had (in the same order) and
+    the unknown ones in extra
+    """
+
+    __slots__ = ("keys", "extra")
+    FIELDS = frozenset()
+
+    @classmethod
+    def from_dict(cls, data, table):
+        record = cls.__new__(cls)
+        for field in cls.FIELDS:
+            setattr(record, field, None)
+        extra = {}
+        for key, value in data.items():
+            if key in cls.FIELDS:
+                setattr(record, key, intern_value(value))
+            else:
+                extra[key] = value
+        record.keys = table.intern_keys(tuple(data))
+        record.extra = extra or None
+        return record
+
+    def get_value(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return self.extra[key]
+
+    def __getitem__(self, key):
+        if key not in self.keys:
+            raise KeyError(key)
+        return self.get_value(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self.keys else default
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def to_dict(self):
+        return {key: self.get_value(key) for key in self.keys}
+
+
+class Party(SlottedRecord):
+    """ an authority or a company that won a contract """
+
+    __slots__ = ("name", "cif", "code", "slug")
+    FIELDS = frozenset(__slots__)
+
+
+class Offerer(SlottedRecord):
+    __slots__ = ("name", "cif", "sme", "date")
+    FIELDS = frozenset(__slots__)
+
+
+class Resolution(SlottedRecord):
+    __slots__ = ("priceWithVAT",)
+    FIELDS = frozenset(__slots__)
+
+
+# key -> record class of the values of the key, that are shared between contracts
+SHARED = {"authority": Party}
+SHARED_LISTS = {"winners": Party, "offerers": Offerer, "resolutions": Resolution}
+# strings that are repeated across contracts, and are worth interning
+INTERNED = frozenset(["year", "adjudication_date", "offerer_count"])
+
+
+class ContractRecord(SlottedRecord):
+    __slots__ = (
+        "id",
+        "year",
+        "title",
+        "authority",
+        "budget",
+        "minor_contract",
+        "offerers",
+        "offerer_count",
+        "winners",
+        "resolutions",
+        "adjudication_date",
+        "table",
+        "language",
+    ) + tuple(CATEGORIES)
+    FIELDS = frozenset(__slots__) - {"table", "language"}
+
+    @classmethod
+    def from_dict(cls, contract, table, language="es"):
+        record = cls.__new__(cls)
+        for field in cls.FIELDS:
+            setattr(record, field, None)
+        record.table = table
+        record.language = language
+        extra = {}
+        for key, value in contract.items():
+            if key not in cls.FIELDS:
+                extra[key] = value
+            elif key in CATEGORIES:
+                code = cls.compact_category(table, key, value, language)
+                if code is None:
+                    extra[key] = value
+                else:
+                    setattr(record, key, code)
+            elif key in SHARED and isinstance(value, dict):
+                setattr(record, key, table.get_instance(SHARED[key], value))
+            elif key in SHARED_LISTS and isinstance(value, list):
+                if all(isinstance(item, dict) for item in value):
+                    value = tuple(
+                        table.get_instance(SHARED_LISTS[key], item) for item in value
+                    )
+                setattr(record, key, value)
+            elif key in INTERNED:
+                setattr(record, key, intern_value(value))
+            else:
+                setattr(record, key, value)
+        record.keys = table.intern_keys(tuple(contract))
+        record.extra = extra or None
+        return record
+
+    @staticmethod
+    def compact_category(table, category, value, language):
+        """the code of the category, or None when the value is not a {name, code} pair
+        or its name is not the one of the code table
+        """
+        if not isinstance(value, dict) or tuple(value) != CATEGORY_KEYS:
+            return None
+        code = intern_value(value["code"])
+        if not isinstance(code, str) or not table.add_name(
+            category, code, language, value["name"]
+        ):
+            return None
+        return code
+
+    def get_value(self, key):
+        if key not in self.FIELDS or (self.extra is not None and key in self.extra):
+            return self.extra[key]
+        value = getattr(self, key)
+        if key in CATEGORIES:
+            name = self.table.get_name(key, value, self.language)
+            return {"name": name, "code": value}
+        if isinstance(value, SlottedRecord):
+            return value.to_dict()
+        if isinstance(value, tuple):
+            return [item.to_dict() for item in value]
+        return value
+
+
+def record_to_json(value):
+    """ json.dump default, to write the records as dicts """
+    if isinstance(value, SlottedRecord):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def load_contract_record(filename, table, language=None):
+    """ load a processed contract file as a record, in the language of its folder """
+    with open(filename) as fp:
+        contract = upgrade_contract_shape(json.load(fp))
+    language = language or filename.replace("\\", "/").split("/")[-2]
+    return ContractRecord.from_dict(contract, table, language)
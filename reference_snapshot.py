@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled snapshot of the reference data used to fix the contracts in step_04:
+
+- authorities_cifs: the ef4ktur CSV data (cifs/data.csv), keyed by name and province
+- authorities_cifs_index: the trigram index over those names
+- authorities: the contractors data (cache/contractors.json), keyed by codPerfil
+- companies: the companies data (cache/companies.json), keyed by name
+- companies_mapping: the name -> company mapping of companies without CIF
+
+Parsing and re-keying all those files takes a while, so the tables are pickled together
+in a single file that is rebuilt only when any of the sources changes. The loaded snapshot
+is kept in memory too, so all the years processed in the same run share the same tables.
+Worker processes only share that copy when they are forked after it is loaded: with the
+spawn start method (the default on Windows and macOS), and in every shard, each process
+loads the pickled file again.
+"""
+import csv
+import json
+import os
+import pickle
+
+from authorities_cifs_index import AuthorityCIFIndex
+
+SNAPSHOT_FILENAME = "cache/reference_snapshot.pickle"
+AUTHORITIES_CIFS_FILENAME = "cifs/data.csv"
+AUTHORITIES_FILENAME = "cache/contractors.json"
+COMPANIES_FILENAME = "cache/companies.json"
+COMPANIES_MAPPING_FILENAME = "cache/companies_mapping.json"
+SOURCE_FILENAMES = [
+    AUTHORITIES_CIFS_FILENAME,
+    AUTHORITIES_FILENAME,
+    COMPANIES_FILENAME,
+    COMPANIES_MAPPING_FILENAME,
+]
+
+_SNAPSHOT = None
+
+
+def read_authorities_cifs():
+    """Using the CSV data of ef4ktur published here:
+        https://www.ef4ktur.com/index.php?option=com_content&task=view&id=198&Itemid=314
+
+    build a dict with the name and CIF of every administration.
+    """
+    contractors_data = {}
+    with open(AUTHORITIES_CIFS_FILENAME) as fp:
+        reader = csv.DictReader(fp, delimiter=";")
+        for item in reader:
+            item_key = " ".join([item["Razón social"], item["Provincia"]])
+            contractors_data[item_key] = item
+
+    return contractors_data
+
+
+def read_authorities():
+    """ load the contractors data from cache, keyed by their code """
+    contractors_data = {}
+    with open(AUTHORITIES_FILENAME) as fp:
+        contractors = json.load(fp)
+        for contractor in contractors:
+            contractors_data[contractor["codPerfil"]] = contractor
+
+    return contractors_data
+
+
+def read_companies():
+    """ load the companies data from cache, keyed by their name """
+    companies_data = {}
+    with open(COMPANIES_FILENAME) as fp:
+        companies = json.load(fp)
+        for company in companies.values():
+            companies_data[company["name"]] = company
+
+    return companies_data
+
+
+def read_companies_mapping():
+    """load the name -> company mapping of the companies without CIF, built in step_03"""
+    try:
+        with open(COMPANIES_MAPPING_FILENAME) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+
+
+def get_sources_stamp():
+    """ size and modification time of every source file, to know when to rebuild the snapshot"""
+    stamp = {}
+    for filename in SOURCE_FILENAMES:
+        try:
+            stat = os.stat(filename)
+            stamp[filename] = [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            stamp[filename] = None
+
+    return stamp
+
+
+def build_snapshot(stamp=None):
+    authorities_cifs = read_authorities_cifs()
+    snapshot = {
+        "stamp": stamp or get_sources_stamp(),
+        "authorities_cifs": authorities_cifs,
+        "authorities_cifs_index": AuthorityCIFIndex.load(authorities_cifs.keys()),
+        "authorities": read_authorities(),
+        "companies": read_companies(),
+        "companies_mapping": read_companies_mapping(),
+    }
+    os.makedirs(os.path.dirname(SNAPSHOT_FILENAME), exist_ok=True)
+    with open(SNAPSHOT_FILENAME, "wb") as fp:
+        pickle.dump(snapshot, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return snapshot
+
+
+def load_snapshot():
+    """return the reference snapshot, from memory or from disk, rebuilding it if any of the
+    sources has changed since it was built
+    """
+    global _SNAPSHOT
+    stamp = get_sources_stamp()
+    if _SNAPSHOT is not None and _SNAPSHOT["stamp"] == stamp:
+        return _SNAPSHOT
+
+    try:
+        with open(SNAPSHOT_FILENAME, "rb") as fp:
+            snapshot = pickle.load(fp)
+        if snapshot["stamp"] != stamp:
+            snapshot = build_snapshot(stamp)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, KeyError):
+        snapshot = build_snapshot(stamp)
+
+    _SNAPSHOT = snapshot
+    return snapshot
+
+
+if __name__ == "__main__":
+    build_snapshot()
+    print(f"Snapshot created {SNAPSHOT_FILENAME}")
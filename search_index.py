@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+Embedded search index over the processed contracts (the output of step_02 and step_04),
+to query them without Elastic.
+
+There is an index per language in cache/search_index/{language}, with:
+
+- an inverted index of the words of the title, the authority name and the winner names,
+  normalized as slugify does, with the postings of every word in a single binary file
+- a column per numeric field (budget, price, adjudication date, year and authority)
+  and the winners of each contract, to filter the results and aggregate them
+
+The binary files are memory-mapped when the index is loaded, so loading it is immediate
+and only the parts used by the queries are read from disk.
+
+    python search_index.py --build
+    python search_index.py --query "garbiketa" --language eu --group-by company
+    python search_index.py --query "limpieza" --year 2021 --min-price 10000
+
+The index is always built with every year, --year only filters the searches.
+"""
+import argparse
+import datetime
+import json
+import math
+import mmap
+import os
+from array import array
+from collections import defaultdict
+
+from contract_shape import upgrade_contract_shape
+from utils import normalize_text
+from years import CONTRACT_URLS
+
+INDEX_FOLDER = "cache/search_index"
+LANGUAGES = ["es", "eu"]
+FIELDS = ["title", "authority", "company"]
+GROUP_BY = ["authority", "company", "year"]
+INDEX_VERSION = 1
+
+MISSING_DATE = -(2 ** 31)
+EPOCH = datetime.date(1970, 1, 1)
+
+# file name -> array type code
+COLUMNS = {
+    "postings": "I",
+    "budget": "d",
+    "price": "d",
+    "date": "i",
+    "year": "i",
+    "authority": "i",
+    "company_offsets": "I",
+    "company_values": "I",
+}
+
+
+def parse_date(value):
+    """ days since 1970 of an ISO date, or MISSING_DATE """
+    try:
+        return (datetime.date.fromisoformat(value) - EPOCH).days
+    except (TypeError, ValueError):
+        return MISSING_DATE
+
+
+def format_date(days):
+    if days == MISSING_DATE:
+        return None
+    return (EPOCH + datetime.timedelta(days=days)).isoformat()
+
+
+def tokenize(value):
+    return normalize_text(value).split()
+
+
+def get_contract_price(contract):
+    prices = [
+        resolution["priceWithVAT"]
+        for resolution in contract.get("resolutions", [])
+        if isinstance(resolution.get("priceWithVAT"), (int, float))
+    ]
+    return sum(prices) if prices else math.nan
+
+
+def get_amount(value):
+    return value if isinstance(value, (int, float)) else math.nan
+
+
+class ValueTable:
+    """ key -> number table of the values to group by, with the label of each one """
+
+    def __init__(self, keys=None, labels=None):
+        self.keys = keys or []
+        self.labels = labels or []
+        self.numbers = {key: number for number, key in enumerate(self.keys)}
+
+    def add(self, key, label):
+        if key not in self.numbers:
+            self.numbers[key] = len(self.keys)
+            self.keys.append(key)
+            self.labels.append(label)
+        return self.numbers[key]
+
+    def as_dict(self):
+        return {"keys": self.keys, "labels": self.labels}
+
+
+class SearchIndexBuilder:
+    def __init__(self, language, processed_folder="processed"):
+        self.language = language
+        self.processed_folder = processed_folder
+        self.docs = []
+        self.postings = {field: defaultdict(lambda: array("I")) for field in FIELDS}
+        self.columns = {
+            name: array(code)
+            for name, code in COLUMNS.items()
+            if name not in ("postings", "company_offsets", "company_values")
+        }
+        self.company_offsets = array("I", [0])
+        self.company_values = array("I")
+        self.authorities = ValueTable()
+        self.companies = ValueTable()
+
+    def add_contracts(self, years):
+        for year in years:
+            base_folder = f"{self.processed_folder}/contracts/{year}"
+            if not os.path.isdir(base_folder):
+                continue
+            for folder in sorted(os.listdir(base_folder)):
+                filename = f"{base_folder}/{folder}/{self.language}/contract.json"
+                try:
+                    with open(filename) as fp:
+                        contract = upgrade_contract_shape(json.load(fp))
+                except FileNotFoundError:
+                    continue
+                self.add_contract(contract, year)
+
+    def add_contract(self, contract, year):
+        doc = len(self.docs)
+        self.docs.append([contract.get("id", ""), str(contract.get("year") or year)])
+
+        authority = contract.get("authority") or {}
+        names = {
+            "title": [contract.get("title") or ""],
+            "authority": [authority.get("name") or ""],
+            "company": [winner.get("name") or "" for winner in contract["winners"]],
+        }
+        for field, values in names.items():
+            for token in {token for value in values for token in tokenize(value)}:
+                self.postings[field][token].append(doc)
+
+        authority_key = authority.get("code") or normalize_text(authority.get("name"))
+        self.columns["authority"].append(
+            self.authorities.add(authority_key, authority.get("name") or "")
+        )
+        for winner in contract["winners"]:
+            company_key = winner.get("cif") or normalize_text(winner.get("name"))
+            if company_key:
+                self.company_values.append(
+                    self.companies.add(company_key, winner.get("name") or "")
+                )
+        self.company_offsets.append(len(self.company_values))
+
+        self.columns["budget"].append(get_amount(contract.get("budget")))
+        self.columns["price"].append(get_contract_price(contract))
+        self.columns["date"].append(parse_date(contract.get("adjudication_date")))
+        self.columns["year"].append(int(self.docs[doc][1] or 0))
+
+    def dump(self, index_folder=INDEX_FOLDER):
+        folder = f"{index_folder}/{self.language}"
+        os.makedirs(folder, exist_ok=True)
+
+        postings = array("I")
+        terms = {}
+        for field in FIELDS:
+            terms[field] = {}
+            for term, docs in self.postings[field].items():
+                terms[field][term] = [len(postings), len(docs)]
+                postings.extend(docs)
+
+        arrays = dict(
+            self.columns,
+            postings=postings,
+            company_offsets=self.company_offsets,
+            company_values=self.company_values,
+        )
+        for name, values in arrays.items():
+            with open(f"{folder}/{name}.bin", "wb") as fp:
+                values.tofile(fp)
+
+        with open(f"{folder}/terms.json", "w") as fp:
+            json.dump(terms, fp)
+        with open(f"{folder}/docs.json", "w") as fp:
+            json.dump(self.docs, fp)
+        with open(f"{folder}/values.json", "w") as fp:
+            json.dump(
+                {
+                    "authority": self.authorities.as_dict(),
+                    "company": self.companies.as_dict(),
+                },
+                fp,
+            )
+        # the meta file is written at the end, an index without it is not complete
+        with open(f"{folder}/meta.json", "w") as fp:
+            json.dump({"version": INDEX_VERSION, "doc_count": len(self.docs)}, fp)
+
+
+def build_index(language, processed_folder="processed", index_folder=INDEX_FOLDER):
+    """build the index of the language with the contracts of every year, that replaces the
+    previous one
+    """
+    builder = SearchIndexBuilder(language, processed_folder)
+    builder.add_contracts(list(CONTRACT_URLS.keys()))
+    builder.dump(index_folder)
+    return len(builder.docs)
+
+
+def map_array(filename, code):
+    """ memory-map the binary file as a read only memoryview of the given type """
+    if not os.path.getsize(filename):
+        return memoryview(array(code))
+    with open(filename, "rb") as fp:
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast(code)
+
+
+class SearchIndex:
+    def __init__(self, folder):
+        with open(f"{folder}/meta.json") as fp:
+            self.meta = json.load(fp)
+        with open(f"{folder}/terms.json") as fp:
+            self.terms = json.load(fp)
+        with open(f"{folder}/docs.json") as fp:
+            self.docs = json.load(fp)
+        with open(f"{folder}/values.json") as fp:
+            values = json.load(fp)
+        self.values = {
+            name: ValueTable(table["keys"], table["labels"])
+            for name, table in values.items()
+        }
+        self.columns = {
+            name: map_array(f"{folder}/{name}.bin", code)
+            for name, code in COLUMNS.items()
+        }
+
+    @classmethod
+    def load(cls, language, index_folder=INDEX_FOLDER):
+        return cls(f"{index_folder}/{language}")
+
+    def __len__(self):
+        return self.meta["doc_count"]
+
+    def get_postings(self, field, term):
+        offset, count = self.terms[field].get(term, (0, 0))
+        return self.columns["postings"][offset : offset + count]
+
+    def match(self, text, fields=FIELDS):
+        """the documents with all the words of the text in any of the fields, as a
+        sorted list. Every document matches an empty text.
+        """
+        docs = None
+        for token in tokenize(text):
+            token_docs = set()
+            for field in fields:
+                token_docs.update(self.get_postings(field, token))
+            docs = token_docs if docs is None else docs & token_docs
+            if not docs:
+                return []
+        if docs is None:
+            return range(len(self))
+        return sorted(docs)
+
+    def get_number(self, kind, key):
+        """the number of the authority or company, by its key (code or CIF) or by its name
+        when it has none, or -1
+        """
+        numbers = self.values[kind].numbers
+        if key in numbers:
+            return numbers[key]
+        return numbers.get(normalize_text(key), -1)
+
+    def search(
+        self,
+        text="",
+        fields=FIELDS,
+        year=None,
+        authority=None,
+        company=None,
+        min_budget=None,
+        max_budget=None,
+        min_price=None,
+        max_price=None,
+        date_from=None,
+        date_to=None,
+    ):
+        """ the documents that match the text and every filter given """
+        docs = self.match(text, fields)
+        if company is not None:
+            number = self.get_number("company", company)
+            offsets = self.columns["company_offsets"]
+            values = self.columns["company_values"]
+            docs = [
+                doc
+                for doc in docs
+                if number in values[offsets[doc] : offsets[doc + 1]]
+            ]
+        filters = []
+        if year is not None:
+            filters.append(("year", int(year), int(year)))
+        if authority is not None:
+            number = self.get_number("authority", authority)
+            filters.append(("authority", number, number))
+        if min_budget is not None or max_budget is not None:
+            filters.append(("budget", min_budget, max_budget))
+        if min_price is not None or max_price is not None:
+            filters.append(("price", min_price, max_price))
+        if date_from is not None or date_to is not None:
+            filters.append(
+                (
+                    "date",
+                    parse_date(date_from) if date_from else None,
+                    parse_date(date_to) if date_to else None,
+                )
+            )
+
+        for name, minimum, maximum in filters:
+            column = self.columns[name]
+            # comparisons with NaN and MISSING_DATE leave the missing values out
+            if name == "date" and minimum is None:
+                minimum = MISSING_DATE + 1
+            if minimum is not None and maximum is not None:
+                docs = [doc for doc in docs if minimum <= column[doc] <= maximum]
+            elif minimum is not None:
+                docs = [doc for doc in docs if column[doc] >= minimum]
+            else:
+                docs = [doc for doc in docs if column[doc] <= maximum]
+        return list(docs)
+
+    def get_groups(self, doc, group_by):
+        if group_by == "year":
+            return [self.columns["year"][doc]]
+        if group_by == "authority":
+            return [self.columns["authority"][doc]]
+        offsets = self.columns["company_offsets"]
+        return self.columns["company_values"][offsets[doc] : offsets[doc + 1]]
+
+    def aggregate(self, docs, group_by, size=10):
+        """count the documents and add up their budget and price by authority, company
+        or year, sorted by the number of documents
+        """
+        budgets = self.columns["budget"]
+        prices = self.columns["price"]
+        groups = defaultdict(lambda: [0, 0.0, 0.0])
+        for doc in docs:
+            budget = budgets[doc]
+            price = prices[doc]
+            for group in self.get_groups(doc, group_by):
+                values = groups[group]
+                values[0] += 1
+                if budget == budget:  # not NaN
+                    values[1] += budget
+                if price == price:
+                    values[2] += price
+
+        result = []
+        for group, (count, budget, price) in sorted(
+            groups.items(), key=lambda item: (-item[1][0], item[0])
+        )[:size]:
+            if group_by == "year":
+                key = label = str(group)
+            else:
+                key = self.values[group_by].keys[group]
+                label = self.values[group_by].labels[group]
+            result.append(
+                {
+                    "key": key,
+                    "label": label,
+                    "count": count,
+                    "budget": round(budget, 2),
+                    "price": round(price, 2),
+                }
+            )
+        return result
+
+    def describe(self, doc):
+        """ the stored values of a document """
+        contract_id, year = self.docs[doc]
+        budget = self.columns["budget"][doc]
+        price = self.columns["price"][doc]
+        return {
+            "id": contract_id,
+            "year": year,
+            "authority": self.values["authority"].labels[
+                self.columns["authority"][doc]
+            ],
+            "budget": budget if budget == budget else None,
+            "price": price if price == price else None,
+            "adjudication_date": format_date(self.columns["date"][doc]),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build or query the search index of the processed contracts"
+    )
+    parser.add_argument("--build", action="store_true", help="Build the index")
+    parser.add_argument("--language", choices=LANGUAGES, default="es")
+    parser.add_argument("--query", default="", help="Words to search")
+    parser.add_argument("--field", choices=FIELDS, help="Search only in this field")
+    parser.add_argument("--year", help="Enter the year to search")
+    parser.add_argument("--authority", help="Authority code (or name if it has none)")
+    parser.add_argument("--company", help="Company CIF (or name if it has none)")
+    parser.add_argument("--min-budget", type=float)
+    parser.add_argument("--max-budget", type=float)
+    parser.add_argument("--min-price", type=float)
+    parser.add_argument("--max-price", type=float)
+    parser.add_argument("--date-from", help="Minimum adjudication date, as YYYY-MM-DD")
+    parser.add_argument("--date-to", help="Maximum adjudication date, as YYYY-MM-DD")
+    parser.add_argument("--group-by", choices=GROUP_BY)
+    parser.add_argument("--size", type=int, default=10)
+    myargs = parser.parse_args()
+
+    if myargs.build and myargs.year:
+        # the new index replaces the previous one, that has the rest of the years
+        print("The index is built with every year, build it without --year")
+    elif myargs.build:
+        for language in LANGUAGES:
+            count = build_index(language)
+            print(f"Indexed {count} contracts in {INDEX_FOLDER}/{language}")
+    else:
+        index = SearchIndex.load(myargs.language)
+        docs = index.search(
+            myargs.query,
+            [myargs.field] if myargs.field else FIELDS,
+            year=myargs.year,
+            authority=myargs.authority,
+            company=myargs.company,
+            min_budget=myargs.min_budget,
+            max_budget=myargs.max_budget,
+            min_price=myargs.min_price,
+            max_price=myargs.max_price,
+            date_from=myargs.date_from,
+            date_to=myargs.date_to,
+        )
+        print(f"{len(docs)} contracts found")
+        if myargs.group_by:
+            result = index.aggregate(docs, myargs.group_by, myargs.size)
+        else:
+            result = [index.describe(doc) for doc in docs[: myargs.size]]
+        print(json.dumps(result, indent=4, ensure_ascii=False))
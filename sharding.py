@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic partitioning of the contracts in shards, to run a step in several machines
+sharing the same filesystem:
+
+    python step_02_process_contracts.py --year 2021 --shard 0/4  # in the 1st machine
+    python step_02_process_contracts.py --year 2021 --shard 3/4  # in the 4th machine
+
+Shards are numbered from 0, and a contract belongs to the shard given by the sha1 of its
+id, so the same contract always goes to the same shard, in every step and every run.
+
+The files shared by all the contracts of a run (index manifests, the step_04 fix cache
+and the run reports) are written per shard, and merged when all the shards are done:
+
+    python sharding.py --year 2021
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+
+from fix_cache import CACHE_FILENAME
+from index_manifest import MANIFEST_FOLDER
+
+SHARDS_FOLDER = "cache/shards"
+SHARD_FILENAME_RE = re.compile(r"\.shard-(\d+)-of-(\d+)\.json$")
+
+
+def parse_shard(value):
+    """ parse an i/N shard, to use it as an argparse type """
+    try:
+        index, count = [int(part) for part in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a shard like 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(
+            f"{value} is not a shard between 0/{count} and {count - 1}/{count}"
+        )
+    return index, count
+
+
+def shard_of(contract_id, count):
+    """ the shard of the contract, stable between runs and machines (unlike hash()) """
+    digest = hashlib.sha1(str(contract_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def in_shard(contract_id, shard):
+    """ True if the contract belongs to the shard, or there is no shard """
+    if shard is None:
+        return True
+    index, count = shard
+    return shard_of(contract_id, count) == index
+
+
+def shard_suffix(shard):
+    index, count = shard
+    return f"shard-{index}-of-{count}"
+
+
+def sharded_filename(filename, shard):
+    """ the per shard version of a shared file: data.json -> data.shard-0-of-4.json """
+    if shard is None:
+        return filename
+    base, extension = os.path.splitext(filename)
+    return f"{base}.{shard_suffix(shard)}{extension}"
+
+
+def add_argument(parser):
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Process only the contracts of this shard, like 0/4 (numbered from 0)",
+    )
+
+
+def get_report_filename(step, year, shard):
+    """ the run report of each shard, to merge the progress of all of them at the end """
+    return f"{SHARDS_FOLDER}/{step}/{year or 'all'}/{shard_suffix(shard)}.json"
+
+
+def set_report_filename(args, step):
+    """write the run report of the shard where merge_reports finds it, unless the report
+    filename is given
+    """
+    if args.shard is not None and not args.report:
+        args.report = get_report_filename(step, args.year, args.shard)
+
+
+def merge_json_files(filename, merge):
+    """merge the shard files of filename into it with merge(data, shard_data, shard), and
+    remove them. Return the shard files merged.
+    """
+    base, extension = os.path.splitext(filename)
+    shard_filenames = sorted(glob.glob(f"{base}.shard-*-of-*{extension}"))
+    if not shard_filenames:
+        return []
+
+    try:
+        with open(filename) as fp:
+            data = json.load(fp)
+    except FileNotFoundError:
+        data = None
+    for shard_filename in shard_filenames:
+        index, count = SHARD_FILENAME_RE.search(shard_filename).groups()
+        with open(shard_filename) as fp:
+            data = merge(data, json.load(fp), (int(index), int(count)))
+
+    with open(filename, "w") as fp:
+        json.dump(data, fp)
+    for shard_filename in shard_filenames:
+        os.remove(shard_filename)
+    return shard_filenames
+
+
+def merge_manifests(year, manifest_folder=MANIFEST_FOLDER):
+    """merge the index manifests written by each shard into the manifest of each index. The
+    manifest of a shard has all the contracts of the shard, including the deleted ones.
+    """
+
+    def merge(data, shard_data, shard):
+        data = {
+            doc_id: doc_hash
+            for doc_id, doc_hash in (data or {}).items()
+            if not in_shard(doc_id, shard)
+        }
+        data.update(shard_data)
+        return data
+
+    filenames = {
+        SHARD_FILENAME_RE.sub(".json", filename)
+        for filename in glob.glob(f"{manifest_folder}/{year}/*.shard-*-of-*.json")
+    }
+    merged = []
+    for filename in sorted(filenames):
+        merged.extend(merge_json_files(filename, merge))
+    return merged
+
+
+def merge_fix_caches(cache_filename=CACHE_FILENAME):
+    """merge the fix caches written by each shard into the main one. Entries of caches built
+    with other reference data are discarded.
+    """
+
+    def merge(data, shard_data, shard):
+        if data is None or data["fingerprint"] != shard_data["fingerprint"]:
+            data = {"fingerprint": shard_data["fingerprint"], "entries": []}
+        entries = dict(data["entries"])
+        entries.update(shard_data["entries"])
+        data["entries"] = list(entries.items())
+        return data
+
+    return merge_json_files(cache_filename, merge)
+
+
+def merge_reports(step, year):
+    """ add up the stages of the run reports of every shard of the step """
+    stages = {}
+    shards = []
+    folder = f"{SHARDS_FOLDER}/{step}/{year or 'all'}"
+    for filename in sorted(glob.glob(f"{folder}/shard-*.json")):
+        with open(filename) as fp:
+            report = json.load(fp)
+        shards.append(os.path.splitext(os.path.basename(filename))[0])
+        for name, stats in report["stages"].items():
+            merged = stages.setdefault(
+                name,
+                {"items": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0},
+            )
+            for key in merged:
+                merged[key] += stats[key]
+    return {"shards": shards, "stages": stages}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge the files written by each shard when all of them are done"
+    )
+    parser.add_argument("--year", help="Enter the year to merge")
+    myargs = parser.parse_args()
+
+    year = myargs.year
+    if year:
+        years = [year]
+    else:
+        years = os.listdir(MANIFEST_FOLDER) if os.path.isdir(MANIFEST_FOLDER) else []
+    for manifest_year in years:
+        for filename in merge_manifests(manifest_year):
+            print(f"Merged {filename}")
+    for filename in merge_fix_caches():
+        print(f"Merged {filename}")
+
+    for folder in sorted(glob.glob(f"{SHARDS_FOLDER}/*")):
+        step = os.path.basename(folder)
+        for report_year in sorted(os.listdir(folder)):
+            if year and report_year not in (year, "all"):
+                continue
+            report = merge_reports(step, report_year)
+            with open(f"{folder}/{report_year}/merged.json", "w") as fp:
+                json.dump(report, fp, indent=4)
+            for name, stats in report["stages"].items():
+                print(
+                    f"{step} {report_year} {name}: {stats['items']} items, "
+                    f"{stats['errors']} errors in {len(report['shards'])} shards"
+                )
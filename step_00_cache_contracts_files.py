@@ -7,13 +7,21 @@ https://opendata.euskadi.eus/catalogo/-/contrataciones-administrativas-del-2021/
 
 https://opendata.euskadi.eus/katalogoa/-/2021eko-kontratazio-administratiboak/
 
+With --listings, the listings of every year (or just --year) are cached too, both
+languages in parallel over a pool of connections. Each listing is streamed to a .part
+file next to its cache file, and an interrupted download is resumed from where it
+stopped with a Range request (or started again if the file changed in the server).
+
 """
 
 import requests
 import json
 import os
 import re
-from utils import print_progress
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from instrumentation import instrument, stage
+from years import CONTRACT_URLS, LISTING_FILENAMES, get_listing_filename
 import argparse
 
 
@@ -21,105 +29,222 @@ CONTRACTORS_URL_1 = "https://www.contratacion.euskadi.eus/w32-kpeperfi/es/ac70cP
 CONTRACTORS_URL_2 = "https://www.contratacion.euskadi.eus/ac70cPublicidadWar/busquedaContrato/autocompleteObtenerPoderes?R01HNoPortal=true&q=&c=true&_=1636384471030"
 
 
-CONTRACT_URLS = {
-    "2021": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2021/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2021/opendata/kontratuak.json",
-    },
-    "2020": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2020/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2020/opendata/kontratuak.json",
-    },
-    "2019": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2019/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2019/opendata/kontratuak.json",
-    },
-    "2018": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2018/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2018/opendata/kontratuak.json",
-    },
-    "2017": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2017/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2017/opendata/kontratuak.json",
-    },
-    "2016": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2016/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2016/opendata/kontratuak.json",
-    },
-    "2015": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2015/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2015/opendata/kontratuak.json",
-    },
-    "2014": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2014/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2014/opendata/kontratuak.json",
-    },
-    "2013": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2013/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2013/opendata/kontratuak.json",
-    },
-    "2012": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2012/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2012/opendata/kontratuak.json",
-    },
-    "2011": {
-        "es": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2011/opendata/contratos.json",
-        "eu": "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_2011/opendata/kontratuak.json",
-    },
-}
-
-
 LIMIT = 30
 
 REALLY_DOWNLOADED = 0
 COUNT = 0
 
+DOWNLOAD_WORKERS = 8
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 60
+MAX_RETRIES = 3
+RETRY_BACKOFF = 2
+
 
 class IDNotFoundError(Exception):
     pass
 
 
-class ContractDownloader:
-    def __init__(self, year, update=False):
-        self.year = year
-        self.update = update
+class IncompleteDownload(Exception):
+    """Exception to raise when the server sent less bytes than the size of the file"""
 
-    def get_contracts_from_json(self, language):
-        """download, cache and extract values from the given JSON url"""
-        url = CONTRACT_URLS[self.year][language]
-        filename = url.split("/")[-1]
 
-        os.makedirs(f"cache/{self.year}/{language}", exist_ok=True)
+def get_session(workers=DOWNLOAD_WORKERS):
+    """ a session with a connection pool big enough for all the workers """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=workers, pool_maxsize=workers
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-        if not self.update:
-            if os.path.isfile(f"cache/{self.year}/{language}/{filename}"):
-                print(
-                    f"{url} already downloaded to cache/{self.year}/{language}/{filename}"
-                )
-                return
 
-        print(f"Downloading {url}")
-        sock = requests.get(url)
-        if sock.ok:
-            data = sock.text
+def load_part_state(state_filename):
+    try:
+        with open(state_filename) as fp:
+            return json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def remove_files(*filenames):
+    for filename in filenames:
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+
+def get_total_size(response):
+    """ the size of the whole file, from the Content-Range or Content-Length headers """
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    if response.status_code == 200 and "Content-Length" in response.headers:
+        # with compression it is the compressed size, not the size written to disk
+        if not response.headers.get("Content-Encoding"):
+            return int(response.headers["Content-Length"])
+    return None
+
+
+def download_file(session, url, filename, timeout=TIMEOUT):
+    """stream the url to {filename}.part, resuming the part downloaded by a previous
+    attempt, and return the state of the download (its url, validators and encoding).
+    Raise IncompleteDownload if the connection was closed before the end of the file.
+    """
+    part_filename = f"{filename}.part"
+    state_filename = f"{filename}.part.json"
+    state = load_part_state(state_filename)
+    offset = 0
+    if state.get("url") == url and os.path.isfile(part_filename):
+        offset = os.path.getsize(part_filename)
+
+    # the offset is counted in bytes written to disk, and the ranges of a compressed
+    # response would be counted in compressed bytes
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        # if the file changed in the server, it sends the whole new file
+        validator = state.get("etag") or state.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416:
+            if get_total_size(response) == offset:
+                # the part already has the whole file
+                return state
+            remove_files(part_filename, state_filename)
+            raise IncompleteDownload(f"{url} changed, it will be downloaded again")
+
+        response.raise_for_status()
+        if response.status_code != 206:
+            offset = 0
+        state = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "encoding": response.encoding if offset == 0 else state.get("encoding"),
+        }
+        with open(state_filename, "w") as fp:
+            json.dump(state, fp)
 
-            if data.startswith("jsonCallback"):
-                data_json_txt = data.split("(", 1)[1].strip(");")  # convert to json
-            else:
-                data_json_txt = data
+        total_size = get_total_size(response)
+        with open(part_filename, "ab" if offset else "wb") as fp:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                fp.write(chunk)
+            size = fp.tell()
 
-            with open(f"cache/{self.year}/{language}/{filename}", "w") as cache_file:
-                cache_file.write(data_json_txt)
+    if total_size is not None and size < total_size:
+        raise IncompleteDownload(f"{url}: {size} of {total_size} bytes downloaded")
+    return state
 
-            print(f"File created cache/{self.year}/{language}/{filename}")
-        else:
-            print(f"Error downloading {url}")
+
+def unwrap_listing(part_filename, filename, encoding=None):
+    """write the downloaded listing to filename as JSON, without the jsonCallback( ... );
+    wrapper of JSONP, reading it in chunks
+    """
+    temporary_filename = f"{filename}.tmp"
+    with open(
+        part_filename, encoding=encoding or "utf-8", errors="replace", newline=""
+    ) as source, open(temporary_filename, "w", newline="") as target:
+        text = source.read(CHUNK_SIZE)
+        wrapped = text.startswith("jsonCallback")
+        if wrapped:
+            text = text.split("(", 1)[1].lstrip(");")  # convert to json
+        # the closing ); of the wrapper, kept until the next chunk
+        pending = ""
+        while text:
+            text = pending + text
+            if wrapped:
+                body = text.rstrip(");")
+                pending = text[len(body) :]
+                text = body
+            target.write(text)
+            text = source.read(CHUNK_SIZE)
+
+    os.replace(temporary_filename, filename)
+
+
+def download_listing(session, year, language, update=False, max_retries=MAX_RETRIES):
+    """download and cache the listing of the year in the language, retrying (and
+    resuming) interrupted downloads. Return "cached", "downloaded" or "failed".
+    """
+    url = CONTRACT_URLS[year][language]
+    filename = get_listing_filename(year, language)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    if not update and os.path.isfile(filename):
+        print(f"{url} already downloaded to {filename}")
+        return "cached"
+
+    print(f"Downloading {url}")
+    for attempt in range(max_retries + 1):
+        try:
+            state = download_file(session, url, filename)
+            break
+        except requests.HTTPError as e:
+            # there is no point in retrying a missing file
+            if e.response is not None and e.response.status_code < 500:
+                print(f"Error downloading {url}: {e}")
+                return "failed"
+            error = e
+        except (requests.RequestException, IncompleteDownload) as e:
+            error = e
+        if attempt < max_retries:
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+    else:
+        print(f"Error downloading {url}: {error}")
+        return "failed"
+
+    unwrap_listing(f"{filename}.part", filename, state.get("encoding"))
+    remove_files(f"{filename}.part", f"{filename}.part.json")
+    print(f"File created {filename}")
+    return "downloaded"
+
+
+def warm_cache(years=None, update=False, workers=DOWNLOAD_WORKERS, session=None):
+    """download the listings of the years (every year by default) in both languages in
+    parallel, and return (year, language) -> "cached", "downloaded" or "failed"
+    """
+    years = years or list(CONTRACT_URLS.keys())
+    session = session or get_session(workers)
+    listings = [(year, language) for year in years for language in LISTING_FILENAMES]
+    results = {}
+    with stage("download_listings", total=len(listings)) as current:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for year, language in listings:
+                future = executor.submit(
+                    download_listing, session, year, language, update
+                )
+                futures[future] = (year, language)
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                current.add(ok=result != "failed")
+    return results
+
+
+class ContractDownloader:
+    def __init__(self, year, update=False):
+        self.year = year
+        self.update = update
+
+    def get_contracts_from_json(self, language, session=None):
+        """download and cache the listing of the year in the given language"""
+        return download_listing(
+            session or get_session(1), self.year, language, self.update
+        )
 
     def get_contracts(self):
-        self.get_contracts_from_json("es")
-        self.get_contracts_from_json("eu")
+        session = get_session(len(LISTING_FILENAMES))
+        self.get_contracts_from_json("es", session)
+        self.get_contracts_from_json("eu", session)
 
 
+@instrument()
 def get_contractors():
     """ Download the list of contractors, with their codes and official names """
     items = []
@@ -134,8 +259,34 @@ def get_contractors():
 
 
 if __name__ == "__main__":
-    # for year in CONTRACT_URLS.keys():
-    #     cd = ContractDownloader(year)
-    #     cd.get_contracts()
+    parser = argparse.ArgumentParser(
+        description="Download the contractors, and cache the listings of the contracts"
+    )
+    parser.add_argument(
+        "--listings",
+        action="store_true",
+        help="Download the listings of every year (or --year) in parallel",
+    )
+    parser.add_argument("--year", choices=list(CONTRACT_URLS.keys()))
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Download the listings again, even if they are already cached",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DOWNLOAD_WORKERS,
+        help="Listings downloaded at the same time",
+    )
+    myargs = parser.parse_args()
 
     get_contractors()
+
+    if myargs.listings:
+        results = warm_cache(
+            [myargs.year] if myargs.year else None, myargs.update, myargs.workers
+        )
+        for (year, language), result in sorted(results.items()):
+            if result == "failed":
+                print(f"The {language} listing of {year} could not be downloaded")
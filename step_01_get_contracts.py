@@ -11,6 +11,7 @@ https://opendata.euskadi.eus/katalogoa/-/2021eko-kontratazio-administratiboak/
 
 import argparse
 import asyncio
+import hashlib
 import json
 import os
 import re
@@ -23,8 +24,12 @@ import tqdm
 import tqdm.asyncio
 from aiohttp.client import ClientSession
 
-from step_00_cache_contracts_files import CONTRACT_URLS
-from utils import print_progress
+import instrumentation
+import sharding
+from change_feed import ChangeFeed
+from instrumentation import instrument
+from sharding import in_shard
+from years import CONTRACT_URLS
 
 # Mock a list of different pdfs to download
 
@@ -34,6 +39,9 @@ MAX_TIME = 10
 
 LIMIT = 30
 
+CONTRACT_FOLDER_RE = re.compile(r"/anuncio_contratacion/[^/\d]*(\d+)/")
+CONTENT_ID_LENGTH = 16
+
 
 REALLY_DOWNLOADED = 0
 COUNT = 0
@@ -55,9 +63,12 @@ class IDNotFoundError(Exception):
 
 
 class ContractDownloader:
-    def __init__(self, year, update=False):
+    def __init__(self, year, update=False, shard=None):
         self.year = year
         self.update = update
+        self.shard = shard
+        # contracts whose listing entry changed since the previous run, to download again
+        self.changed_ids = set()
 
     def get_contracts_from_json(self, language):
         """download, cache and extract values from the given JSON url"""
@@ -91,18 +102,38 @@ class ContractDownloader:
             return json.loads(data_json_txt)
 
     def get_contract_id(self, contract):
+        """the number in the name of the zip file of the contract, or in the name of its folder
+        in the other urls (which is the same in both languages). Otherwise the id is derived
+        from the contents of the contract, so that it is the same in every run.
+        """
         if "zipFile" in contract:
             zip_file = contract["zipFile"]
             zip_filename = zip_file.split("/")[-1]
 
             return re.compile("[\d]+").search(zip_filename).group()
 
-        import uuid
+        for key in ("metadataXML", "dataXML", "physicalUrl"):
+            match = CONTRACT_FOLDER_RE.search(contract.get(key) or "")
+            if match:
+                return match.group(1)
 
-        return uuid.uuid4().hex
-        raise IDNotFoundError("Could not find contract ID")
+        content = json.dumps(contract, sort_keys=True).encode("utf-8")
+        return hashlib.sha1(content).hexdigest()[:CONTENT_ID_LENGTH]
 
     def parse_contract(self, contract_id, language, contract):
+        """write the contract data.json and return the XML files that need to be downloaded,
+        which are also added to ITEMS
+        """
+        items = self.get_contract_items(contract_id, language, contract)
+        ITEMS.extend(items)
+        return items
+
+    def get_contract_items(self, contract_id, language, contract):
+        """write the contract data.json and return the XML files that need to be downloaded,
+        without keeping them in ITEMS (the pipeline downloads them right away)
+        """
+        items = []
+        update = self.update or contract_id in self.changed_ids
         if "dataXML" in contract and "metadataXML" in contract:
             contract_base_url = (
                 f"contracts/{self.year}/{contract_id}/{language}"
@@ -111,7 +142,7 @@ class ContractDownloader:
             data_xml_url = contract["dataXML"]
             metadata_xml_url = contract["metadataXML"]
 
-            if self.update or not os.path.exists(
+            if update or not os.path.exists(
                 f"{contract_base_url}/data.xml"
             ):
                 # global REALLY_DOWNLOADED
@@ -120,21 +151,21 @@ class ContractDownloader:
                 #     if r.ok:
                 #         with open(f"{contract_base_url}/data.xml", "wb") as f:
                 #             f.write(r.content)
-                ITEMS.append(
+                items.append(
                     {
                         "url": data_xml_url,
                         "file": f"{contract_base_url}/data.xml",
                     }
                 )
 
-            if self.update or not os.path.exists(
+            if update or not os.path.exists(
                 f"{contract_base_url}/metadata.xml"
             ):
                 # with requests.get(metadata_xml_url) as r:
                 #     if r.ok:
                 #         with open(f"{contract_base_url}/metadata.xml", "wb") as f:
                 #             f.write(r.content)
-                ITEMS.append(
+                items.append(
                     {
                         "url": metadata_xml_url,
                         "file": f"{contract_base_url}/metadata.xml",
@@ -149,6 +180,8 @@ class ContractDownloader:
         else:
             print(f"{contract_id} is not correct")
 
+        return items
+
     def build_contracts_dict(self, contracts, language):
 
         return {
@@ -170,13 +203,34 @@ class ContractDownloader:
             except:
                 print(f"Error parsing contract: {contract_id}")
 
-    def get_contracts(self):
+    def get_all_contracts(self):
+        """ contract id -> language -> contract data, from the JSON files of the year """
         contracts_es = self.get_contracts_from_json("es")
         contracts_eu = self.get_contracts_from_json("eu")
-        contracts = self.merge_contracts(contracts_es, contracts_eu)
+        return self.merge_contracts(contracts_es, contracts_eu)
+
+    def record_changes(self, contracts):
+        """write the change feed of the listing of the year, and download again the files of
+        the contracts that have changed
+        """
+        feed = ChangeFeed(self.year).record(contracts)
+        self.changed_ids = set(feed["changed"])
+        print(
+            f"Changes {feed['sequence']} in {self.year}: {len(feed['added'])} added, "
+            f"{len(feed['changed'])} changed, {len(feed['removed'])} removed"
+        )
+
+    def get_contracts(self):
+        contracts = self.get_all_contracts()
+        self.record_changes(contracts)
 
         global COUNT
         COUNT = 0
+        contracts = {
+            contract_id: contract
+            for contract_id, contract in contracts.items()
+            if in_shard(contract_id, self.shard)
+        }
         for contract_id, contract in tqdm.tqdm(contracts.items()):
             self.parse_multilingual_contract(contract_id, contract)
             # COUNT += 1
@@ -212,6 +266,7 @@ async def download(pdf_list):
         ]
 
 
+@instrument("download")
 async def download_one(item, sess, sem):
     url = item["url"]
     dest_file = item["file"]
@@ -223,16 +278,36 @@ async def download_one(item, sess, sem):
 
             # Check everything went well
             if res.status != 200:
-                # print(f"Download failed: {res.status}")
+                instrumentation.count(f"status_{res.status}")
                 return
 
             async with aiofiles.open(dest_file, "wb") as f:
                 await f.write(content)
                 # No need to use close(f) when using with statement
         except:
+            instrumentation.error()
             print(f"Exception when downloading {url}")
 
 
+def fetch_item(item, session):
+    """download a single item synchronously with a requests session, return True if the file
+    was written
+    """
+    url = item["url"]
+    try:
+        with session.get(url, timeout=MAX_TIME) as res:
+            if res.status_code != 200:
+                return False
+            content = res.content
+
+        with open(item["file"], "wb") as f:
+            f.write(content)
+        return True
+    except requests.RequestException:
+        print(f"Exception when downloading {url}")
+        return False
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Download contracts from the Euskadi Open Data portal"
@@ -243,10 +318,15 @@ if __name__ == "__main__":
         action="store_true",
         help="Update existing contracts",
     )
+    instrumentation.add_arguments(parser)
+    sharding.add_argument(parser)
     myargs = parser.parse_args()
 
     year = myargs.year
     update = myargs.update
+    shard = myargs.shard
+    sharding.set_report_filename(myargs, "step_01")
+    instrumentation.configure_from_args(myargs)
 
     if year and year not in CONTRACT_URLS.keys():
         print(
@@ -255,7 +335,7 @@ if __name__ == "__main__":
             )
         )
     elif year:
-        cd = ContractDownloader(year, update)
+        cd = ContractDownloader(year, update, shard)
         cd.get_contracts()
         print(len(ITEMS), " items to download")
         run(download(ITEMS))
@@ -263,7 +343,7 @@ if __name__ == "__main__":
 
         for year in CONTRACT_URLS.keys():
             print(f"Processing year {year}")
-            cd = ContractDownloader(year)
+            cd = ContractDownloader(year, shard=shard)
             cd.get_contracts()
             print(f"Done year {year}")
 
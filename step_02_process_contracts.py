@@ -12,7 +12,13 @@ from xml.parsers.expat import ExpatError
 
 import xmltodict
 
-from step_00_cache_contracts_files import CONTRACT_URLS
+import change_feed
+import instrumentation
+import sharding
+from change_feed import in_changes
+from instrumentation import instrument
+from sharding import in_shard
+from years import CONTRACT_URLS
 
 TRUE_BOOL_VALUES = ["sí", "si", "bai"]
 
@@ -106,27 +112,68 @@ class WrongXMLFileFormat(Exception):
 
 
 class ContractProcessor:
-    def __init__(self, year):
+    def __init__(self, year, fixer=None, shard=None, changes_since=None):
+        """fixer is an optional step_04 ContractProcessor, used to fix the authority and company
+        data before writing the contract, so that step_04 does not need to run afterwards
+
+        shard is an optional (i, N) tuple, to process only the contracts of that shard
+
+        changes_since is an optional change feed sequence of step_01 (LATEST for the last
+        feed), to process only the contracts added or changed since then
+        """
         self.year = year
+        self.fixer = fixer
+        self.shard = shard
+        self.changes = change_feed.load_changes(year, changes_since)
         self.contracts_folder = f"contracts/{year}"
         os.makedirs(f"processed/{self.contracts_folder}", exist_ok=True)
 
     async def process_contracts(self):
         print(f"Processing {self.contracts_folder}")
+        tasks = []
         for count, folder in enumerate(os.listdir(self.contracts_folder)):
+            if not in_shard(folder, self.shard):
+                continue
+            if not in_changes(folder, self.changes):
+                continue
             try:
-                asyncio.create_task(
-                    self.process_contract(f"{self.contracts_folder}/{folder}/es")
+                tasks.append(
+                    asyncio.create_task(
+                        self.process_contract(f"{self.contracts_folder}/{folder}/es")
+                    )
                 )
-                asyncio.create_task(
-                    self.process_contract(f"{self.contracts_folder}/{folder}/eu")
+                tasks.append(
+                    asyncio.create_task(
+                        self.process_contract(f"{self.contracts_folder}/{folder}/eu")
+                    )
                 )
                 # print(f"Processed {count} contracts")
             except NotADirectoryError:
                 pass
 
+        await asyncio.gather(*tasks)
+        if self.fixer is not None:
+            self.fixer.save_cache()
+
+    @instrument("process_contract")
     async def process_contract(self, folder):
-        print(f"Processing: {folder}")
+        contract_json = self.build_contract(folder)
+        if contract_json:
+            if self.fixer is not None:
+                language = folder.split("/")[-1]
+                contract_json = self.fixer.fix_contents(contract_json, language)
+
+            with open(f"processed/{folder}/contract.json", "w") as fp:
+                json.dump(contract_json, fp, indent=4)
+
+        else:
+            instrumentation.count("not_found")
+
+    def build_contract(self, folder, write_raw=True):
+        """parse the XML files of the contract in the folder and return the processed contract,
+        or None if they can not be parsed. The raw contract is written to the processed folder
+        unless write_raw is False.
+        """
         metadata_filename = f"{folder}/metadata.xml"
         data_filename = f"{folder}/data.xml"
         json_filename = f"{folder}/data.json"
@@ -134,28 +181,25 @@ class ContractProcessor:
         raw_contract_json = self.build_dict(
             metadata_filename, data_filename, json_filename
         )
-        if raw_contract_json:
-            raw_contract_json["id"] = folder.split("/")[-2]
+        if not raw_contract_json:
+            return None
+
+        raw_contract_json["id"] = folder.split("/")[-2]
 
-            os.makedirs(f"processed/{folder}", exist_ok=True)
+        os.makedirs(f"processed/{folder}", exist_ok=True)
 
+        if write_raw:
             with open(f"processed/{folder}/raw_contract.json", "w") as fp:
                 json.dump(raw_contract_json, fp, indent=4)
 
-            # We have 2 different formats for the data.xml file
-            if "contractingAnnouncement" in raw_contract_json:
-                contract_json = self.post_process_contract(raw_contract_json)
-            else:
-                contract_json = self.post_process_old_contract(raw_contract_json)
-
-            contract_json["year"] = self.year
-
-            with open(f"processed/{folder}/contract.json", "w") as fp:
-                json.dump(contract_json, fp, indent=4)
-
+        # We have 2 different formats for the data.xml file
+        if "contractingAnnouncement" in raw_contract_json:
+            contract_json = self.post_process_contract(raw_contract_json)
         else:
-            print(f"File not found: {data_filename}")
-        print(f"Finished processing: {folder}")
+            contract_json = self.post_process_old_contract(raw_contract_json)
+
+        contract_json["year"] = self.year
+        return contract_json
 
     def post_process_old_contract(self, raw_contract_json):
         contract_json = {}
@@ -265,17 +309,23 @@ class ContractProcessor:
         formalizations = contract.get(
             "contratacion_informe_adjudicacion_definitiva", {}
         )
+        contract_json["winners"] = []
+        contract_json["resolutions"] = []
         for item in sorted(formalizations.keys()):
             formalization = formalizations[item]
-            contract_json[f"winner_{item}"] = {
-                "cif": "",
-                "name": formalization.get("empresa", ""),
-            }
-            contract_json[f"resolution_{item}"] = {
-                "priceWithVAT": clean_float_value_old_xml(
-                    formalization.get("precioIVA", "")
-                ),
-            }
+            contract_json["winners"].append(
+                {
+                    "cif": "",
+                    "name": formalization.get("empresa", ""),
+                }
+            )
+            contract_json["resolutions"].append(
+                {
+                    "priceWithVAT": clean_float_value_old_xml(
+                        formalization.get("precioIVA", "")
+                    ),
+                }
+            )
 
         contract_json["adjudication_date"] = clean_date_value(
             contract.get("contratacion_fecha_adjudicacion_definitiva", "")
@@ -377,31 +427,35 @@ class ContractProcessor:
             or {}
         )
 
+        contract_json["winners"] = []
         if formalizations:
             if isinstance(formalizations, dict):
                 formalizations = [formalizations]
-            for i, formalization in enumerate(formalizations):
-                contract_json[f"winner_{i}"] = {
-                    "cif": formalization["id"]["#text"],
-                    "name": formalization["businessName"]["#text"],
-                }
-        else:
-            contract_json["winner"] = None
+            for formalization in formalizations:
+                contract_json["winners"].append(
+                    {
+                        "cif": formalization["id"]["#text"],
+                        "name": formalization["businessName"]["#text"],
+                    }
+                )
 
         resolutions = (
             contract.get("resolutions", {})
             and contract.get("resolutions", {}).get("resolution", {})
             or {}
         )
+        contract_json["resolutions"] = []
         if resolutions:
             if isinstance(resolutions, dict):
                 resolutions = [resolutions]
-            for i, resolution in enumerate(resolutions):
-                contract_json[f"resolution_{i}"] = {
-                    "priceWithVAT": clean_float_value(
-                        resolution.get("priceWithVAT", {}).get("#text", "0")
-                    )
-                }
+            for resolution in resolutions:
+                contract_json["resolutions"].append(
+                    {
+                        "priceWithVAT": clean_float_value(
+                            resolution.get("priceWithVAT", {}).get("#text", "0")
+                        )
+                    }
+                )
                 contract_json["adjudication_date"] = clean_date_value(
                     resolution.get("adjInfo", {}).get("date", {}).get("#text", "")
                 )
@@ -457,11 +511,31 @@ if __name__ == "__main__":
         description="Parse contracts and extract valuable information"
     )
     parser.add_argument("--year", help="Enter the year to parse")
+    parser.add_argument(
+        "--fix",
+        action="store_true",
+        help="Fix authority and company data as step_04 does, before writing the files",
+    )
 
+    instrumentation.add_arguments(parser)
+    sharding.add_argument(parser)
+    change_feed.add_argument(parser)
     myargs = parser.parse_args()
+    sharding.set_report_filename(myargs, "step_02")
+    instrumentation.configure_from_args(myargs)
 
     year = myargs.year
 
+    def get_fixer(year):
+        if not myargs.fix:
+            return None
+
+        from step_04_fix_authority_and_company_data_async import (
+            ContractProcessor as ContractFixer,
+        )
+
+        return ContractFixer(year, myargs.shard)
+
     if year and year not in CONTRACT_URLS.keys():
         print(
             "Year must be one of the followings: {}".format(
@@ -469,11 +543,13 @@ if __name__ == "__main__":
             )
         )
     elif year is not None:
-        cp = ContractProcessor(year)
+        cp = ContractProcessor(year, get_fixer(year), myargs.shard, myargs.changes)
         asyncio.run(cp.process_contracts())
     else:
         for year in CONTRACT_URLS.keys():
             print(f"Processing year {year}")
-            cp = ContractProcessor(year)
+            cp = ContractProcessor(
+                year, get_fixer(year), myargs.shard, myargs.changes
+            )
             asyncio.run(cp.process_contracts())
             print(f"Done year {year}")
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Spending rollups of every authority (by code) and company (by CIF, or slug when it has
+none), broken down by year and contract type, built from the processed contracts.
+
+Each rollup has the number of contracts, the budget, the awarded amount (the price of
+the resolutions, counted in full for each winner of a contract), the minor contracts and
+the offerers, and the exported files add the minor contract ratio and the average
+offerers.
+
+The contribution of every contract to the rollups is kept in a ledger with the hash of
+the contract file, so that only new, changed and deleted contracts are applied in later
+runs:
+
+    python step_03_build_aggregates.py
+    python step_03_build_aggregates.py --year 2021 --index
+
+The rollups are exported to cache/aggregates/{language}/authorities.json and
+companies.json, and with --index to the aggregates_es and aggregates_eu indices.
+"""
+import argparse
+import json
+import os
+
+from slugify import slugify
+
+import instrumentation
+from contract_shape import upgrade_contract_shape
+from index_manifest import IndexManifest, content_hash
+from index_mappings import get_aggregate_index_body
+from instrumentation import instrument, stage
+from years import CONTRACT_URLS
+
+AGGREGATES_FOLDER = "cache/aggregates"
+ELASTIC_INDEX_PREFIX = "aggregates"
+LANGUAGES = ["es", "eu"]
+KINDS = ["authority", "company"]
+METRICS = [
+    "contracts",
+    "budget",
+    "awarded",
+    "minor_contracts",
+    "offerers",
+    "offerer_contracts",
+]
+EXPORT_FILENAMES = {"authority": "authorities.json", "company": "companies.json"}
+# the rollups are not split by year, so their manifests are kept in their own folder
+MANIFEST_YEAR = "aggregates"
+# the state saved by other versions is discarded, and the rollups are built again
+STATE_VERSION = 2
+
+
+def get_amount(value):
+    return value if isinstance(value, (int, float)) else 0.0
+
+
+def get_offerer_count(contract):
+    try:
+        return int(contract.get("offerer_count"))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_contribution(contract, year):
+    """what the contract adds to the rollups: the authority and company keys (with their
+    names), the year and contract type of the group, and the metrics
+    """
+    authority = contract.get("authority") or {}
+    keys = []
+    if authority.get("code"):
+        keys.append(["authority", authority["code"], authority.get("name") or ""])
+    company_keys = set()
+    for winner in contract["winners"]:
+        company_key = winner.get("cif") or winner.get("slug") or slugify(
+            winner.get("name") or ""
+        )
+        # a company that wins several lots of the contract is counted once
+        if company_key and company_key not in company_keys:
+            company_keys.add(company_key)
+            keys.append(["company", company_key, winner.get("name") or ""])
+
+    contract_type = contract.get("contract_type") or {}
+    offerer_count = get_offerer_count(contract)
+    return {
+        "keys": keys,
+        "year": str(contract.get("year") or year),
+        "contract_type": [contract_type.get("code", ""), contract_type.get("name", "")],
+        "metrics": {
+            "contracts": 1,
+            "budget": get_amount(contract.get("budget")),
+            "awarded": sum(
+                get_amount(resolution.get("priceWithVAT"))
+                for resolution in contract.get("resolutions", [])
+            ),
+            "minor_contracts": 1 if contract.get("minor_contract") else 0,
+            "offerers": offerer_count or 0,
+            "offerer_contracts": 0 if offerer_count is None else 1,
+        },
+    }
+
+
+def add_ratios(metrics):
+    """ the metrics with the minor contract ratio and the average offerers """
+    contracts = metrics["contracts"]
+    offerer_contracts = metrics["offerer_contracts"]
+    return dict(
+        metrics,
+        minor_ratio=round(metrics["minor_contracts"] / contracts, 4)
+        if contracts
+        else None,
+        average_offerers=round(metrics["offerers"] / offerer_contracts, 2)
+        if offerer_contracts
+        else None,
+    )
+
+
+class Rollups:
+    """kind -> key -> {"name", "groups": {"year/contract type code": metrics}}, plus the
+    names of the contract types
+    """
+
+    def __init__(self, data=None, contract_types=None):
+        self.data = data or {kind: {} for kind in KINDS}
+        self.contract_types = contract_types or {}
+
+    def apply(self, contribution, sign=1):
+        """ add (or subtract, with sign -1) the contribution of a contract """
+        code, name = contribution["contract_type"]
+        if name and sign > 0:
+            self.contract_types[code] = name
+        group = f"{contribution['year']}/{code}"
+        for kind, key, key_name in contribution["keys"]:
+            entry = self.data[kind].setdefault(key, {"name": key_name, "groups": {}})
+            if key_name and sign > 0:
+                entry["name"] = key_name
+            metrics = entry["groups"].setdefault(group, dict.fromkeys(METRICS, 0))
+            for metric, value in contribution["metrics"].items():
+                # amounts have cents, round them so that subtracting leaves no residue
+                metrics[metric] = round(metrics[metric] + sign * value, 2)
+            if metrics["contracts"] <= 0:
+                del entry["groups"][group]
+                if not entry["groups"]:
+                    del self.data[kind][key]
+
+    def get_group(self, kind, key, group):
+        return self.data[kind].get(key, {}).get("groups", {}).get(group)
+
+    def export(self, kind):
+        """ the rollups of the kind, with the totals of every key """
+        result = {}
+        for key, entry in sorted(self.data[kind].items()):
+            total = dict.fromkeys(METRICS, 0)
+            years = {}
+            for group, metrics in sorted(entry["groups"].items()):
+                year, code = group.split("/", 1)
+                years.setdefault(year, {})[code] = add_ratios(metrics)
+                for metric, value in metrics.items():
+                    total[metric] = round(total[metric] + value, 2)
+            result[key] = {
+                "name": entry["name"],
+                "total": add_ratios(total),
+                "years": years,
+            }
+        return {"contract_types": self.contract_types, kind: result}
+
+
+class AggregateBuilder:
+    def __init__(
+        self, language="es", folder=AGGREGATES_FOLDER, processed_folder="processed"
+    ):
+        self.language = language
+        self.folder = f"{folder}/{language}"
+        self.processed_folder = processed_folder
+        self.state_filename = f"{self.folder}/state.json"
+        try:
+            with open(self.state_filename) as fp:
+                state = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        if state.get("version") != STATE_VERSION:
+            state = {"ledger": {}, "rollups": None, "contract_types": None}
+        self.ledger = state["ledger"]
+        self.rollups = Rollups(state["rollups"], state["contract_types"])
+        self.stats = dict.fromkeys(["added", "changed", "removed", "unchanged"], 0)
+
+    def update(self, years=None):
+        """apply the contracts of the years that are new or have changed since the last
+        run, and remove the ones that are not in disk anymore
+        """
+        years = years or list(CONTRACT_URLS.keys())
+        seen = set()
+        for year in years:
+            base_folder = f"{self.processed_folder}/contracts/{year}"
+            try:
+                folders = sorted(os.listdir(base_folder))
+            except FileNotFoundError:
+                continue
+            for folder in folders:
+                ledger_key = f"{year}/{folder}"
+                if self.update_contract(ledger_key, f"{base_folder}/{folder}"):
+                    seen.add(ledger_key)
+
+        with stage("remove_contracts") as current:
+            for ledger_key in list(self.ledger):
+                if ledger_key.split("/")[0] in years and ledger_key not in seen:
+                    self.rollups.apply(self.ledger.pop(ledger_key)[1], -1)
+                    self.stats["removed"] += 1
+                    current.add()
+        return self.stats
+
+    @instrument("aggregate_contract")
+    def update_contract(self, ledger_key, folder):
+        """ apply the contract if it is new or changed, False if it is missing """
+        try:
+            with open(f"{folder}/{self.language}/contract.json", "rb") as fp:
+                content = fp.read()
+        except FileNotFoundError:
+            instrumentation.count("not_found")
+            return False
+
+        doc_hash = content_hash(content)
+        previous = self.ledger.get(ledger_key)
+        if previous and previous[0] == doc_hash:
+            self.stats["unchanged"] += 1
+            return True
+
+        contract = upgrade_contract_shape(json.loads(content))
+        contribution = get_contribution(contract, ledger_key.split("/")[0])
+        if previous:
+            self.rollups.apply(previous[1], -1)
+            self.stats["changed"] += 1
+        else:
+            self.stats["added"] += 1
+        self.rollups.apply(contribution)
+        self.ledger[ledger_key] = [doc_hash, contribution]
+        return True
+
+    def dump(self):
+        os.makedirs(self.folder, exist_ok=True)
+        for kind, filename in EXPORT_FILENAMES.items():
+            with open(f"{self.folder}/{filename}", "w") as fp:
+                json.dump(self.rollups.export(kind), fp, separators=(",", ":"))
+        with open(self.state_filename, "w") as fp:
+            json.dump(
+                {
+                    "version": STATE_VERSION,
+                    "ledger": self.ledger,
+                    "rollups": self.rollups.data,
+                    "contract_types": self.rollups.contract_types,
+                },
+                fp,
+                separators=(",", ":"),
+            )
+
+    def generate_actions(self, index, manifest):
+        """ index the rollups that have changed, and delete the ones that are empty now """
+        for kind, key, group in sorted(self.all_groups()):
+            doc_id = f"{kind}-{key}-{group}"
+            metrics = self.rollups.get_group(kind, key, group)
+            year, code = group.split("/", 1)
+            doc = {
+                "kind": kind,
+                "key": key,
+                "name": self.rollups.data[kind][key]["name"],
+                "year": year,
+                "contract_type": {
+                    "code": code,
+                    "name": self.rollups.contract_types.get(code, ""),
+                },
+            }
+            doc.update(add_ratios(metrics))
+            doc_hash = content_hash(json.dumps(doc, sort_keys=True).encode("utf-8"))
+            if manifest.check(doc_id, doc_hash):
+                yield {"_index": index, "_id": doc_id, "_source": doc}
+
+        for doc_id in manifest.missing_ids():
+            yield {"_op_type": "delete", "_index": index, "_id": doc_id}
+
+    def all_groups(self):
+        return {
+            (kind, key, group)
+            for kind in KINDS
+            for key, entry in self.rollups.data[kind].items()
+            for group in entry["groups"]
+        }
+
+    def index_rollups(self, client=None, full=False):
+        """send the rollups that have changed since they were last indexed to the aggregates
+        index of the language, or all of them with full (or when the index is new). The
+        indexed rollups are kept in a manifest, so a run without --index, or with failed
+        requests, is caught up by the next one.
+        """
+        from elasticsearch.helpers import streaming_bulk
+
+        from step_05_index_contracts import get_client
+
+        client = client or get_client()
+        index = f"{ELASTIC_INDEX_PREFIX}_{self.language}"
+        if not client.indices.exists(index=index):
+            client.indices.create(index=index, body=get_aggregate_index_body())
+            full = True
+        manifest = IndexManifest.load(index, MANIFEST_YEAR, reset=full)
+
+        indexed = 0
+        with stage(f"index_aggregates_{self.language}") as current:
+            for ok, item in streaming_bulk(
+                client,
+                self.generate_actions(index, manifest),
+                raise_on_error=False,
+            ):
+                op_type, result = next(iter(item.items()))
+                # deleting a rollup that was never indexed is not an error
+                if op_type == "delete" and (ok or result.get("status") == 404):
+                    manifest.remove(result["_id"])
+                elif ok:
+                    manifest.confirm(result["_id"])
+                else:
+                    current.add(ok=False)
+                    continue
+                indexed += 1
+                current.add()
+        manifest.dump()
+        return indexed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the spending rollups of the authorities and companies"
+    )
+    parser.add_argument("--year", help="Enter the year to update")
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Index the changed rollups in the aggregates_es and aggregates_eu indices",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Index all the rollups, not only the changed ones",
+    )
+    instrumentation.add_arguments(parser)
+    myargs = parser.parse_args()
+    instrumentation.configure_from_args(myargs)
+
+    year = myargs.year
+    if year and year not in CONTRACT_URLS.keys():
+        print(
+            "Year must be one of the followings: {}".format(
+                ",".join(CONTRACT_URLS.keys())
+            )
+        )
+    else:
+        for language in LANGUAGES:
+            builder = AggregateBuilder(language)
+            stats = builder.update([year] if year else None)
+            builder.dump()
+            print(f"Rollups {language}: {stats}")
+            if myargs.index:
+                indexed = builder.index_rollups(full=myargs.full)
+                print(f"Indexed {indexed} rollups in {ELASTIC_INDEX_PREFIX}_{language}")
@@ -7,7 +7,11 @@ import os
 
 from thefuzz import fuzz, process
 
-from step_00_cache_contracts_files import CONTRACT_URLS
+import instrumentation
+from company_resolution import resolve_companies
+from instrumentation import instrument, stage
+from records import get_code_table, load_contract_record, record_to_json
+from years import CONTRACT_URLS
 
 
 class ContractProcessor:
@@ -15,41 +19,51 @@ class ContractProcessor:
         self.authorities = {}
         self.companies = {}
         self.companies_names = {}
+        self.companies_mapping = {}
 
     def process_contracts(self):
         for year in CONTRACT_URLS.keys():
             print(f"Processing year {year}")
             self.contracts_folder = f"processed/contracts/{year}"
             try:
-                for i, folder in enumerate(os.listdir(self.contracts_folder)):
+                for folder in os.listdir(self.contracts_folder):
                     self.process_contract(f"{self.contracts_folder}/{folder}/es")
                     self.process_contract(f"{self.contracts_folder}/{folder}/eu")
-                    print(f"Done contract {i}")
             except FileNotFoundError:
                 pass
 
             print(f"Done year {year}")
 
+        with stage("resolve_companies"):
+            self.companies_mapping = resolve_companies(
+                self.companies, self.companies_names
+            )
         self.dump_files()
 
+    @instrument("extract_contract")
     def process_contract(self, folder):
         try:
-            language = folder.split("/")[-1]
-            with open(f"{folder}/contract.json") as fp:
-                contract = json.load(fp)
-                self.extract_contents(contract, language)
+            year, _, language = folder.split("/")[-3:]
+            # the companies are kept as the shared records of the code table of the year
+            contract = load_contract_record(
+                f"{folder}/contract.json", get_code_table(year), language
+            )
+            self.extract_contents(contract, language)
         except FileNotFoundError:
-            print(f"No contract for {folder}")
+            instrumentation.count("not_found")
 
     def dump_files(self):
         with open("cache/authorities.json", "w") as fp:
             json.dump(self.authorities, fp, indent=4)
 
         with open("cache/companies.json", "w") as fp:
-            json.dump(self.companies, fp, indent=4)
+            json.dump(self.companies, fp, indent=4, default=record_to_json)
 
         with open("cache/companies_names.json", "w") as fp:
-            json.dump(self.companies_names, fp, indent=4)
+            json.dump(self.companies_names, fp, indent=4, default=record_to_json)
+
+        with open("cache/companies_mapping.json", "w") as fp:
+            json.dump(self.companies_mapping, fp, indent=4)
 
     def extract_contents(self, contract, language):
         """ extract the main data for authorities and companies, to have a single source of truth"""
@@ -61,9 +75,8 @@ class ContractProcessor:
         self.add_authority(authority, language)
 
     def extract_companies(self, contract, language):
-        for key in contract.keys():
-            if key.startswith("winner_"):
-                self.add_company(contract[key], language)
+        for winner in contract.winners:
+            self.add_company(winner, language)
 
     def add_authority(self, authority, language):
         if authority["code"] not in self.authorities:
@@ -96,5 +109,12 @@ class ContractProcessor:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the authorities and companies data"
+    )
+    instrumentation.add_arguments(parser)
+    myargs = parser.parse_args()
+    instrumentation.configure_from_args(myargs)
+
     cp = ContractProcessor()
     cp.process_contracts()
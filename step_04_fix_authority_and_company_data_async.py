@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import argparse
 import asyncio
-import csv
 import difflib
 import json
 import os
@@ -9,72 +8,87 @@ import os
 from slugify import slugify
 from thefuzz import fuzz, process
 
-from step_00_cache_contracts_files import CONTRACT_URLS
+import change_feed
+import instrumentation
+import sharding
+from change_feed import in_changes
+from contract_shape import upgrade_contract_shape
+from fix_cache import CACHE_FILENAME, FixCache
+from instrumentation import instrument
+from reference_snapshot import load_snapshot
+from sharding import in_shard, sharded_filename
+from years import CONTRACT_URLS
 
 
-class ContractProcessor:
-    def __init__(self, year):
-        self.year = year
-        self.contracts_folder = f"processed/contracts/{year}"
-        self.authorities_cifs = self._get_authorities_cifs()
-        self.authorities = self._get_authorities_data()
-        self.companies = self._get_companies_data()
+def normalize_company_name(name):
+    """ the name in uppercase and with single spaces, shared by the variants of a name """
+    return " ".join(name.upper().split())
 
-    def _get_authorities_data(self):
-        """load the contractors data from cache, and create a dict to have it available during the
-        processing process
-        """
-        contractors_data = {}
-        with open("cache/contractors.json") as fp:
-            contractors = json.load(fp)
-            for contractor in contractors:
-                contractors_data[contractor["codPerfil"]] = contractor
-
-        return contractors_data
 
-    def _get_authorities_cifs(self):
-        """Using the CSV data of ef4ktur published here:
-            https://www.ef4ktur.com/index.php?option=com_content&task=view&id=198&Itemid=314
+def get_companies_cifs(companies_mapping):
+    """normalized name -> CIF of the companies of the name -> company mapping built in
+    step_03, so that every variant of a name gets the same CIF
+    """
+    cifs = {}
+    for name, company in companies_mapping.items():
+        cif = company.get("cif")
+        if cif:
+            cifs.setdefault(normalize_company_name(name), cif)
+    return cifs
 
-        build a dict with the name and CIF of every administration.
-        """
-        contractors_data = {}
-        with open("cifs/data.csv") as fp:
-            reader = csv.DictReader(fp, delimiter=";")
-            for item in reader:
-                item_key = " ".join([item["Razón social"], item["Provincia"]])
-                contractors_data[item_key] = item
-
-        return contractors_data
-
-    def _get_companies_data(self):
-        """load the companies data from cache, and create a dict to have it available during the
-        processing process
-        """
-        companies_data = {}
-        with open("cache/companies.json") as fp:
-            companies = json.load(fp)
-            for company in companies.values():
-                companies_data[company["name"]] = company
 
-        return companies_data
+class ContractProcessor:
+    def __init__(self, year, shard=None, changes_since=None):
+        self.year = year
+        self.shard = shard
+        self.changes = change_feed.load_changes(year, changes_since)
+        self.contracts_folder = f"processed/contracts/{year}"
+        reference = load_snapshot()
+        self.authorities_cifs = reference["authorities_cifs"]
+        self.authorities_cifs_index = reference["authorities_cifs_index"]
+        self.authorities = reference["authorities"]
+        self.companies = reference["companies"]
+        self.companies_mapping = reference["companies_mapping"]
+        self.companies_cifs = get_companies_cifs(self.companies_mapping)
+        self.cache = FixCache.load()
 
     async def process_contracts(self):
+        tasks = []
         try:
             for i, folder in enumerate(os.listdir(self.contracts_folder)):
+                if not in_shard(folder, self.shard):
+                    continue
+                if not in_changes(folder, self.changes):
+                    continue
                 task_eu = asyncio.create_task(
                     self.process_contract(f"{self.contracts_folder}/{folder}/es")
                 )
                 task_es = asyncio.create_task(
                     self.process_contract(f"{self.contracts_folder}/{folder}/eu")
                 )
+                tasks.extend([task_es, task_eu])
                 # print(f"Done contract {i}")
         except FileNotFoundError:
             pass
 
+        await asyncio.gather(*tasks)
+        self.save_cache()
+
+    def save_cache(self):
+        """save the fixes cache for the next runs and print its stats. Each shard saves its
+        own cache, merged with sharding.py when all the shards are done.
+        """
+        self.cache.dump(sharded_filename(CACHE_FILENAME, self.shard))
+        for namespace, stats in self.cache.stats().items():
+            print(
+                "Cache {}: {} hits, {} misses ({:.1%})".format(
+                    namespace, stats["hits"], stats["misses"], stats["hit_rate"]
+                )
+            )
+
+    @instrument("fix_contract")
     async def process_contract(self, folder):
         """ load the data for each contract, process it and write it back to the same file """
-        print(f"Started processing {folder}")
         try:
             language = folder.split("/")[-1]
             fp = open(f"{folder}/contract.json")
@@ -85,8 +99,7 @@ class ContractProcessor:
             json.dump(contract, fp, indent=4)
             fp.close()
         except FileNotFoundError:
-            pass
-        print(f"Finished processing {folder}")
+            instrumentation.count("not_found")
 
     def fix_contents(self, contract, language):
         """some contracting authority data is wrong:
@@ -95,23 +108,43 @@ class ContractProcessor:
 
         In this method we try to fix it
         """
-
-        contract["authority"]["name"] = self.find_correct_authority_name(
-            contract, language
+        fixed_authority = self.cache.get_or_set(
+            "authority",
+            self.get_authority_cache_key(contract, language),
+            lambda: self.fix_authority(contract, language),
         )
-        contract["authority"]["slug"] = slugify(contract["authority"]["name"])
-        # contract["authority"]["cif"] = self.find_correct_authority_cif(
-        #     contract, language
-        # )
-
-        # self.find_correct_authority_cif(contract, language)
+        contract["authority"]["name"] = fixed_authority["name"]
+        contract["authority"]["slug"] = fixed_authority["slug"]
+        if not contract["authority"].get("cif"):
+            contract["authority"]["cif"] = fixed_authority["cif"]
 
-        for key, value in contract.items():
-            if key.startswith("winner_"):
-                contract[key] = self.find_correct_company(value)
+        upgrade_contract_shape(contract)
+        contract["winners"] = [
+            self.find_correct_company(winner) for winner in contract["winners"]
+        ]
 
         return contract
 
+    def get_authority_cache_key(self, contract, language):
+        """the fixed authority only depends on the code and the language when the code is known,
+        otherwise it depends on the name found in the contract
+        """
+        authority_code = contract.get("authority", {}).get("code", "")
+        if authority_code and int(authority_code) in self.authorities:
+            return f"{authority_code}:{language}"
+
+        return "{}:{}".format(language, contract.get("authority", {}).get("name", ""))
+
+    def fix_authority(self, contract, language):
+        name = self.find_correct_authority_name(contract, language)
+        return {
+            "name": name,
+            "slug": slugify(name),
+            "cif": self.find_correct_authority_cif(
+                {"authority": {"name": name}}, language
+            ),
+        }
+
     def find_correct_authority_name(self, contract_json, language):
         """ Using the authority code, get its correct name from the code -> authority dict"""
         authority_code = contract_json.get("authority", {}).get("code", "")
@@ -124,33 +157,38 @@ class ContractProcessor:
         return contract_json.get("authority", {}).get("name", "")
 
     def find_correct_authority_cif(self, contract, language):
-        """ find the most similar name in the list of authority_cifs using difflib and return the value of CIF"""
+        """find the most similar name in the list of authority_cifs using difflib and return the value of CIF
+
+        Only the candidates returned by the trigram index are scored, not the whole list.
+        """
         name = contract["authority"]["name"]
 
-        matches = process.extract(name, self.authorities_cifs.keys())
+        candidates = self.authorities_cifs_index.candidates(name)
+        matches = process.extract(name, candidates)
         # matches = difflib.get_close_matches(name, self.authorities_cifs.keys())
         if matches and matches[0][1] > 90:
             found_match_name = matches[0][0]
             found_match_cif = self.authorities_cifs[found_match_name]["CIF"]
-            print(f"Found match for: {name} -> {found_match_name}")
+            instrumentation.count("authority_cif_found")
             return found_match_cif
         return ""
 
     def find_correct_company(self, company):
-        """ find the most similar name in the list of contract_companies using difflib and return the value of CIF"""
+        """calculate the slug of the company, and get its CIF from the name -> company mapping
+        built in step_03 if it has none
+        """
         name = company["name"]
         cif = company["cif"]
-        company["slug"] = slugify(name)
-        # if not cif:
-        #     matches = process.extract(name, self.companies.keys())
-        #     if matches and matches[0][1] > 90:
-        #         found_match_name = matches[0][0]
-        #         found_match_company_name = self.companies[found_match_name]["name"]
-        #         found_match_company_cif = self.companies[found_match_name]["cif"]
-        #         print(
-        #             f"Found match for: {name} -> {found_match_company_name} ({found_match_company_cif})"
-        #         )
-        #         return self.companies[found_match_name]
+        # the fixes are cached by the normalized name, so the CIF is looked up by it too
+        key = normalize_company_name(name)
+        fixed_company = self.cache.get_or_set(
+            "company",
+            key,
+            lambda: {"slug": slugify(name), "cif": self.companies_cifs.get(key, "")},
+        )
+        company["slug"] = fixed_company["slug"]
+        if not cif and fixed_company["cif"]:
+            company["cif"] = fixed_company["cif"]
 
         return company
 
@@ -160,8 +198,13 @@ if __name__ == "__main__":
         description="Parse contracts and extract valuable information"
     )
     parser.add_argument("--year", help="Enter the year to parse")
+    instrumentation.add_arguments(parser)
+    sharding.add_argument(parser)
+    change_feed.add_argument(parser)
 
     myargs = parser.parse_args()
+    sharding.set_report_filename(myargs, "step_04")
+    instrumentation.configure_from_args(myargs)
 
     year = myargs.year
 
@@ -172,11 +215,11 @@ if __name__ == "__main__":
             )
         )
     elif year is not None:
-        cp = ContractProcessor(year)
-        cp.process_contracts()
+        cp = ContractProcessor(year, myargs.shard, myargs.changes)
+        asyncio.run(cp.process_contracts())
     else:
         for year in CONTRACT_URLS.keys():
             print(f"Processing year {year}")
-            cp = ContractProcessor(year)
+            cp = ContractProcessor(year, myargs.shard, myargs.changes)
             asyncio.run(cp.process_contracts())
             print(f"Done year {year}")
@@ -3,16 +3,51 @@ import asyncio
 import argparse
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import streaming_bulk
+import aiofiles
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from elasticsearch.helpers import (
+    async_streaming_bulk,
+    bulk,
+    parallel_bulk,
+    streaming_bulk,
+)
 
-from step_00_cache_contracts_files import CONTRACT_URLS
+import change_feed
+import instrumentation
+import sharding
+from change_feed import in_changes
+from contract_shape import upgrade_contract_shape
+from index_manifest import IndexManifest, content_hash
+from index_mappings import MAPPING_VERSION, get_index_body, get_mapping_version
+from instrumentation import stage
+from sharding import in_shard
+from utils import prefetch
+from years import CONTRACT_URLS
 
 ELASTIC_HOST = os.environ.get("ELASTIC_HOST", "localhost")
 ELASTIC_PORT = os.environ.get("ELASTIC_PORT", 9200)
 ELASTIC_INDEX_ES = "contracts_es"
 ELASTIC_INDEX_EU = "contracts_eu"
+LANGUAGES = ["es", "eu"]
+
+BULK_THREAD_COUNT = 4
+BULK_CHUNK_SIZE = 500
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+PREFETCH_SIZE = 1000
+MAX_IN_FLIGHT = 4
+
+LIVE_REPLICAS = 1
+LIVE_REFRESH = "1s"
+
+BUFFER_MAX_DOCS = 500
+BUFFER_MAX_BYTES = 5 * 1024 * 1024
+BUFFER_MAX_AGE = 5.0
+
+_CLIENT = None
 
 
 def get_elastic_config():
@@ -24,75 +59,761 @@ def get_elastic_config():
     return conf
 
 
-def connect(conf):
+def connect(conf, maxsize=10):
     es = Elasticsearch(
         host=conf["host"],
         port=conf["port"],
+        maxsize=maxsize,
     )
     return es
 
 
+def connect_async(conf, maxsize=10):
+    es = AsyncElasticsearch(
+        host=conf["host"],
+        port=conf["port"],
+        maxsize=maxsize,
+    )
+    return es
+
+
+def ensure_index(client, index):
+    """create the index with the explicit mapping if it does not exist yet"""
+    if not client.indices.exists(index=index):
+        client.indices.create(index=index, body=get_index_body())
+        return
+
+    for index_name, data in client.indices.get_mapping(index=index).items():
+        if get_mapping_version(data["mappings"]) < MAPPING_VERSION:
+            print(f"The mapping of {index_name} is outdated, rebuild it with --rebuild")
+
+
+async def ensure_index_async(client, index):
+    """ create the index with the explicit mapping if it does not exist yet """
+    if not await client.indices.exists(index=index):
+        await client.indices.create(index=index, body=get_index_body(), ignore=400)
+        return
+
+    for index_name, data in (await client.indices.get_mapping(index=index)).items():
+        if get_mapping_version(data["mappings"]) < MAPPING_VERSION:
+            print(f"The mapping of {index_name} is outdated, rebuild it with --rebuild")
+
+
+async def index_years_async(years, max_in_flight=MAX_IN_FLIGHT, **options):
+    """index several years at the same time in a single event loop, with both languages of
+    each year indexed concurrently and up to max_in_flight bulk requests at a time
+    """
+    client = connect_async(get_elastic_config(), maxsize=max_in_flight)
+    semaphore = asyncio.Semaphore(max_in_flight)
+    try:
+        for language in LANGUAGES:
+            await ensure_index_async(client, get_elastic_config()[f"index_{language}"])
+        results = await asyncio.gather(
+            *[
+                ContractIndexer(year, **options).index_contracts_async(
+                    client, semaphore, ensure_indices=False
+                )
+                for year in years
+            ]
+        )
+    finally:
+        await client.close()
+
+    return dict(zip(years, results))
+
+
+def get_client():
+    """ client shared by the whole process, so that its connection pool is reused """
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = connect(get_elastic_config())
+    return _CLIENT
+
+
 def index_doc(doc, language="es"):
     conf = get_elastic_config()
-    es = connect(conf)
+    es = get_client()
     es.index(index=conf[f"index_{language}"], id=doc["id"], body=doc)
 
 
+class BufferedIndexer:
+    """Index single documents, buffering them and sending them in bulk requests when the
+    buffer is too big or too old. Use it as a context manager to flush the last ones:
+
+        with BufferedIndexer() as indexer:
+            for contract in contracts:
+                indexer.add(contract, "es")
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_docs=BUFFER_MAX_DOCS,
+        max_bytes=BUFFER_MAX_BYTES,
+        max_age=BUFFER_MAX_AGE,
+    ):
+        self.client = client or get_client()
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.actions = []
+        self.actions_bytes = 0
+        self.first_added = None
+        self.indexed = 0
+        self.errors = []
+        # exceptions of the periodic flushes, that are retried with the next one
+        self.flush_exceptions = []
+        self.ready_indices = set()
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, doc, language="es"):
+        index = get_elastic_config()[f"index_{language}"]
+        with self.lock:
+            if not self.actions:
+                self.first_added = time.monotonic()
+            self.actions.append({"_index": index, "_id": doc["id"], "_source": doc})
+            self.actions_bytes += len(json.dumps(doc))
+            if (
+                len(self.actions) >= self.max_docs
+                or self.actions_bytes >= self.max_bytes
+            ):
+                self.flush()
+
+    def flush(self):
+        """send the buffered documents, return how many of them were indexed. If the request
+        fails, the documents are kept in the buffer to send them again with the next flush
+        """
+        with self.lock:
+            actions = self.actions
+            if not actions:
+                return 0
+
+            for index in {action["_index"] for action in actions} - self.ready_indices:
+                ensure_index(self.client, index)
+                self.ready_indices.add(index)
+
+            successes, errors = bulk(self.client, actions, raise_on_error=False)
+            self.actions = []
+            self.actions_bytes = 0
+            self.first_added = None
+            self.indexed += successes
+            self.errors.extend(errors)
+            return successes
+
+    def flush_periodically(self):
+        while not self.closed.wait(self.max_age / 2):
+            with self.lock:
+                if (
+                    self.first_added is not None
+                    and time.monotonic() - self.first_added >= self.max_age
+                ):
+                    # an error must not stop the thread, the buffer is sent again later
+                    try:
+                        self.flush()
+                    except Exception as e:
+                        self.flush_exceptions.append(e)
+
+    def close(self):
+        self.closed.set()
+        self.flusher.join()
+        self.flush()
+
+
 class ContractIndexer:
-    def __init__(self, year):
+    def __init__(
+        self,
+        year,
+        processed_folder="processed",
+        incremental=False,
+        delete_missing=False,
+        indices=None,
+        save_manifests=True,
+        max_retries=0,
+        initial_backoff=2,
+        shard=None,
+        changes_since=None,
+    ):
+        """with incremental, only the contracts that are new or have changed since the last run
+        are indexed, and with delete_missing, the contracts that are not in disk anymore are
+        deleted from the index
+
+        shard is an optional (i, N) tuple, to index only the contracts of that shard
+
+        changes_since is an optional change feed sequence of step_01 (LATEST for the last
+        feed), to index only the contracts added or changed since then, and delete the
+        removed ones
+
+        max_retries and initial_backoff are used to retry the documents rejected with a 429
+        status by Elastic (the other failed documents are counted, without raising errors)
+
+        indices is an optional language -> index name dict, to index the contracts in other
+        indices than the configured ones (when rebuilding them, for instance)
+        """
         self.year = year
+        self.processed_folder = processed_folder
+        self.incremental = incremental
+        self.delete_missing = delete_missing
+        self.indices = indices or {}
+        self.save_manifests = save_manifests
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.shard = shard
+        self.changes = change_feed.load_changes(year, changes_since)
+        self.manifests = {}
+
+    def get_index(self, language):
+        return self.indices.get(language) or get_elastic_config().get(
+            f"index_{language}"
+        )
+
+    def get_manifest(self, language):
+        if language not in self.manifests:
+            self.manifests[language] = IndexManifest.load(
+                get_elastic_config().get(f"index_{language}"),
+                self.year,
+                shard=self.shard,
+            )
+        return self.manifests[language]
 
     def generate_actions(self, language):
-        base_folder = f"processed/contracts/{year}"
+        base_folder = f"{self.processed_folder}/contracts/{self.year}"
         for folder in os.listdir(base_folder):
+            if not in_shard(folder, self.shard) or not in_changes(folder, self.changes):
+                continue
             if os.path.isdir(f"{base_folder}/{folder}/{language}"):
                 contract = self.get_contract(
-                    f"{base_folder}/{folder}/{language}"
+                    f"{base_folder}/{folder}/{language}", language
                 )
                 if contract:
-                    yield contract
+                    yield {"_id": contract["id"], "_source": contract}
+
+        for doc_id in self.get_deleted_ids(language):
+            yield {"_op_type": "delete", "_id": doc_id}
 
-    async def index_contracts(self):
+    def get_deleted_ids(self, language):
+        """the contracts to delete from the index: the ones removed from the listing with a
+        change feed, or with --delete-missing the indexed ones that are not in disk. With a
+        change feed only the changed folders are read, so the rest are not missing.
+        """
+        if self.changes is not None:
+            return self.get_removed_ids()
+        if self.incremental and self.delete_missing:
+            return self.get_manifest(language).missing_ids()
+        return []
+
+    def get_removed_ids(self):
+        """ the contracts removed from the listing, according to the change feed """
+        if self.changes is None:
+            return []
+        return sorted(
+            doc_id for doc_id in self.changes["removed"] if in_shard(doc_id, self.shard)
+        )
+
+    def record_result(self, language, ok, item):
+        """ keep the manifest up to date with the result of each bulk action """
+        if not self.incremental:
+            return
+
+        manifest = self.get_manifest(language)
+        op_type, result = next(iter(item.items()))
+        if op_type == "delete" and (ok or result.get("status") == 404):
+            manifest.remove(result["_id"])
+        elif ok:
+            manifest.confirm(result["_id"])
+
+    def save_manifest(self, language):
+        if self.incremental and self.save_manifests:
+            self.get_manifest(language).dump()
+
+    def index_contracts(self):
         client = connect(get_elastic_config())
-        for language in ["es", "eu"]:
+        for language in LANGUAGES:
             successes = 0
             print(f"Indexing {language}...")
-            for ok, action in streaming_bulk(
-                client=client,
-                index=get_elastic_config().get(f"index_{language}"),
-                actions=self.generate_actions(language),
-            ):
-                successes += ok
+            ensure_index(client, self.get_index(language))
+            try:
+                with stage(f"index_{language}") as current:
+                    for ok, item in streaming_bulk(
+                        client=client,
+                        index=self.get_index(language),
+                        actions=self.generate_actions(language),
+                        ignore_status=(404,),
+                        # rejected documents can only be retried without raising errors
+                        raise_on_error=not self.max_retries,
+                        max_retries=self.max_retries,
+                        initial_backoff=self.initial_backoff,
+                    ):
+                        successes += ok
+                        self.record_result(language, ok, item)
+                        current.add(ok=ok)
+            finally:
+                self.save_manifest(language)
+            print(f"Indexed {language}: {successes} items")
+
+    def index_contracts_parallel(
+        self,
+        thread_count=BULK_THREAD_COUNT,
+        chunk_size=BULK_CHUNK_SIZE,
+        max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+    ):
+        """index both languages at the same time, each of them with several bulk workers, and
+        reading the contracts from disk in a background thread while the bulk requests are sent
+        """
+        client = connect(get_elastic_config(), maxsize=thread_count * len(LANGUAGES))
+
+        def index_language(language):
+            successes = 0
+            # the actions sent and not answered yet, to send the rejected ones again
+            in_flight = {}
+            rejected = []
+
+            def remember(actions):
+                for action in actions:
+                    in_flight[action["_id"]] = action
+                    yield action
+
+            print(f"Indexing {language}...")
+            ensure_index(client, self.get_index(language))
+            try:
+                with stage(f"index_{language}") as current:
+                    for ok, item in parallel_bulk(
+                        client=client,
+                        index=self.get_index(language),
+                        actions=remember(
+                            prefetch(self.generate_actions(language), PREFETCH_SIZE)
+                        ),
+                        thread_count=thread_count,
+                        chunk_size=chunk_size,
+                        max_chunk_bytes=max_chunk_bytes,
+                        ignore_status=(404,),
+                        raise_on_error=False,
+                    ):
+                        result = next(iter(item.values()))
+                        action = in_flight.pop(result["_id"], None)
+                        if not ok and result.get("status") == 429 and self.max_retries:
+                            rejected.append(action)
+                            continue
+                        successes += ok
+                        self.record_result(language, ok, item)
+                        current.add(ok=ok)
+
+                    if rejected:
+                        successes += self.retry_rejected(
+                            client, language, rejected, current
+                        )
+            finally:
+                self.save_manifest(language)
             print(f"Indexed {language}: {successes} items")
+            return successes
 
-    def get_contract(self, folder):
+        with ThreadPoolExecutor(max_workers=len(LANGUAGES)) as executor:
+            return dict(zip(LANGUAGES, executor.map(index_language, LANGUAGES)))
+
+    def retry_rejected(self, client, language, actions, current):
+        """send again the actions rejected by the first parallel requests, waiting and
+        doubling the backoff before each retry as streaming_bulk does
+        """
+        successes = 0
+        time.sleep(self.initial_backoff)
+        for ok, item in streaming_bulk(
+            client=client,
+            index=self.get_index(language),
+            actions=actions,
+            ignore_status=(404,),
+            raise_on_error=False,
+            max_retries=self.max_retries - 1,
+            initial_backoff=self.initial_backoff * 2,
+        ):
+            successes += ok
+            self.record_result(language, ok, item)
+            current.add(ok=ok)
+        return successes
+
+    async def index_contracts_async(
+        self, client=None, semaphore=None, ensure_indices=True
+    ):
+        """index both languages at the same time with the async client. Each language sends
+        one bulk request at a time, while holding the semaphore, so a semaphore shared with
+        other years bounds the bulk requests in flight.
+        """
+        own_client = client is None
+        if own_client:
+            client = connect_async(get_elastic_config())
+        semaphore = semaphore or asyncio.Semaphore(MAX_IN_FLIGHT)
+
+        async def index_language(language):
+            successes = 0
+            print(f"Indexing {self.year} {language}...")
+            if ensure_indices:
+                await ensure_index_async(client, self.get_index(language))
+            try:
+                async with semaphore:
+                    with stage(f"index_{language}") as current:
+                        async for ok, item in async_streaming_bulk(
+                            client=client,
+                            index=self.get_index(language),
+                            actions=self.generate_actions_async(language),
+                            ignore_status=(404,),
+                            raise_on_error=not self.max_retries,
+                            max_retries=self.max_retries,
+                            initial_backoff=self.initial_backoff,
+                        ):
+                            successes += ok
+                            self.record_result(language, ok, item)
+                            current.add(ok=ok)
+            finally:
+                self.save_manifest(language)
+            print(f"Indexed {self.year} {language}: {successes} items")
+            return successes
+
+        try:
+            results = await asyncio.gather(
+                *[index_language(language) for language in LANGUAGES]
+            )
+        finally:
+            if own_client:
+                await client.close()
+
+        return dict(zip(LANGUAGES, results))
+
+    async def generate_actions_async(self, language):
+        """the same actions as generate_actions, reading the files with aiofiles in a task that
+        keeps up to PREFETCH_SIZE contracts ready
+        """
+        base_folder = f"{self.processed_folder}/contracts/{self.year}"
+        loop = asyncio.get_running_loop()
+        folders = await loop.run_in_executor(None, os.listdir, base_folder)
+        contracts = asyncio.Queue(maxsize=PREFETCH_SIZE)
+        end = object()
+
+        async def read_contracts():
+            try:
+                for folder in folders:
+                    if not in_shard(folder, self.shard):
+                        continue
+                    if not in_changes(folder, self.changes):
+                        continue
+                    contract = await self.get_contract_async(
+                        f"{base_folder}/{folder}/{language}", language
+                    )
+                    if contract:
+                        await contracts.put(contract)
+            finally:
+                await contracts.put(end)
+
+        reader = asyncio.create_task(read_contracts())
+        while True:
+            contract = await contracts.get()
+            if contract is end:
+                break
+            yield {"_id": contract["id"], "_source": contract}
+        await reader
+
+        for doc_id in self.get_deleted_ids(language):
+            yield {"_op_type": "delete", "_id": doc_id}
+
+    def get_contract(self, folder, language="es"):
+        """load the contract, unless the indexing is incremental and its contents have not
+        changed since the last time it was indexed
+        """
         contract_filename = f"{folder}/contract.json"
 
         if os.path.exists(contract_filename):
-            with open(contract_filename, "r") as fp:
-                return json.load(fp)
+            with open(contract_filename, "rb") as fp:
+                content = fp.read()
+
+            return self.load_contract(folder, language, content)
+
+    async def get_contract_async(self, folder, language="es"):
+        try:
+            async with aiofiles.open(f"{folder}/contract.json", "rb") as fp:
+                content = await fp.read()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+        return self.load_contract(folder, language, content)
+
+    def load_contract(self, folder, language, content):
+        if self.incremental:
+            doc_id = folder.split("/")[-2]
+            if not self.get_manifest(language).check(doc_id, content_hash(content)):
+                return None
+
+        return upgrade_contract_shape(json.loads(content))
+
+
+class IndexRebuilder:
+    """Rebuild the contract indices from scratch without downtime.
+
+    The contracts are indexed in new versioned indices, with refresh and replicas disabled
+    during the load. Then they are force-merged, their settings are restored and the aliases
+    (contracts_es and contracts_eu) are swapped atomically to point to them, so searches never
+    see a half-built index.
+
+    Every year with processed contracts is indexed: the new indices replace the old ones,
+    so a year left out would disappear from the search.
+    """
+
+    def __init__(
+        self,
+        parallel=False,
+        thread_count=BULK_THREAD_COUNT,
+        chunk_size=BULK_CHUNK_SIZE,
+        max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+        delete_old=False,
+        processed_folder="processed",
+    ):
+        self.processed_folder = processed_folder
+        self.parallel = parallel
+        self.thread_count = thread_count
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.delete_old = delete_old
+        self.client = connect(get_elastic_config())
+
+    def get_live_settings(self, alias):
+        """ the replicas and refresh interval of the current index, to restore them later"""
+        settings = {
+            "number_of_replicas": LIVE_REPLICAS,
+            "refresh_interval": LIVE_REFRESH,
+        }
+        if self.client.indices.exists(index=alias):
+            for data in self.client.indices.get_settings(index=alias).values():
+                index_settings = data["settings"]["index"]
+                settings["number_of_replicas"] = index_settings.get(
+                    "number_of_replicas", LIVE_REPLICAS
+                )
+                settings["refresh_interval"] = index_settings.get(
+                    "refresh_interval", LIVE_REFRESH
+                )
+        return settings
+
+    def get_years(self):
+        """ the years with processed contracts """
+        return [
+            year
+            for year in CONTRACT_URLS.keys()
+            if os.path.isdir(f"{self.processed_folder}/contracts/{year}")
+        ]
+
+    def create_index(self, alias, suffix):
+        index = f"{alias}_v{MAPPING_VERSION}_{suffix}"
+        body = get_index_body()
+        body["settings"] = {"refresh_interval": "-1", "number_of_replicas": 0}
+        self.client.indices.create(index=index, body=body)
+        return index
+
+    def swap_alias(self, alias, index):
+        """point the alias to the new index, removing it from the previous ones in the same
+        request. If there is a concrete index named as the alias, it is deleted.
+        """
+        old_indices = []
+        actions = []
+        if self.client.indices.exists_alias(name=alias):
+            old_indices = list(self.client.indices.get_alias(name=alias).keys())
+            for old_index in old_indices:
+                actions.append({"remove": {"index": old_index, "alias": alias}})
+        elif self.client.indices.exists(index=alias):
+            actions.append({"remove_index": {"index": alias}})
+
+        actions.append({"add": {"index": index, "alias": alias}})
+        self.client.indices.update_aliases(body={"actions": actions})
+        return old_indices
+
+    def rebuild(self):
+        suffix = time.strftime("%Y%m%d%H%M%S")
+        aliases = {
+            language: get_elastic_config().get(f"index_{language}")
+            for language in LANGUAGES
+        }
+        live_settings = {
+            language: self.get_live_settings(alias)
+            for language, alias in aliases.items()
+        }
+        indices = {
+            language: self.create_index(alias, suffix)
+            for language, alias in aliases.items()
+        }
+
+        indexers = []
+        for year in self.get_years():
+            print(f"Indexing year {year}")
+            indexer = ContractIndexer(
+                year,
+                processed_folder=self.processed_folder,
+                incremental=True,
+                indices=indices,
+                save_manifests=False,
+            )
+            for language in LANGUAGES:
+                indexer.manifests[language] = IndexManifest.load(
+                    aliases[language], year, reset=True
+                )
+            if self.parallel:
+                indexer.index_contracts_parallel(
+                    self.thread_count, self.chunk_size, self.max_chunk_bytes
+                )
+            else:
+                indexer.index_contracts()
+            indexers.append(indexer)
+
+        for language, index in indices.items():
+            print(f"Optimizing {index}")
+            self.client.indices.forcemerge(index=index, max_num_segments=1)
+            self.client.indices.put_settings(index=index, body=live_settings[language])
+            self.client.indices.refresh(index=index)
+            old_indices = self.swap_alias(aliases[language], index)
+            print(f"{aliases[language]} now points to {index}")
+            if self.delete_old:
+                for old_index in old_indices:
+                    self.client.indices.delete(index=old_index)
+
+        # the manifests describe the new indices, save them once they are live
+        for indexer in indexers:
+            for manifest in indexer.manifests.values():
+                manifest.dump()
+
+        return indices
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Index contracts in Elastic")
     parser.add_argument("--year", help="Enter the year to parse")
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Index both languages at the same time with several bulk workers",
+    )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Index one language after the other, with the synchronous client",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=MAX_IN_FLIGHT,
+        help="Maximum bulk requests at the same time, when indexing asynchronously",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=BULK_THREAD_COUNT,
+        help="Bulk workers per language, when indexing in parallel",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=BULK_CHUNK_SIZE,
+        help="Maximum number of documents per bulk request, when indexing in parallel",
+    )
+    parser.add_argument(
+        "--max-chunk-bytes",
+        type=int,
+        default=BULK_MAX_CHUNK_BYTES,
+        help="Maximum size in bytes of each bulk request, when indexing in parallel",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Index only the contracts that are new or have changed since the last run",
+    )
+    parser.add_argument(
+        "--delete-missing",
+        action="store_true",
+        help="With --incremental, delete from the index the contracts that are not in disk",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Rebuild the indices with all the years, in new indices swapped by alias",
+    )
+    parser.add_argument(
+        "--delete-old",
+        action="store_true",
+        help="With --rebuild, delete the previous indices once the aliases are swapped",
+    )
+    parser.add_argument(
+        "--suggestions",
+        action="store_true",
+        help="Update the authority and company suggestion indices afterwards",
+    )
+    instrumentation.add_arguments(parser)
+    sharding.add_argument(parser)
+    change_feed.add_argument(parser)
 
     myargs = parser.parse_args()
+    sharding.set_report_filename(myargs, "step_05")
+    instrumentation.configure_from_args(myargs)
 
     year = myargs.year
 
+    def index_years(years):
+        """ index the years asynchronously, unless --parallel or --sequential are used """
+        options = {
+            "incremental": myargs.incremental,
+            "delete_missing": myargs.delete_missing,
+            "shard": myargs.shard,
+            "changes_since": myargs.changes,
+        }
+        if not myargs.parallel and not myargs.sequential:
+            asyncio.run(index_years_async(years, myargs.max_in_flight, **options))
+            return
+
+        for year in years:
+            print(f"Processing year {year}")
+            cd = ContractIndexer(year, **options)
+            if myargs.parallel:
+                cd.index_contracts_parallel(
+                    myargs.threads, myargs.chunk_size, myargs.max_chunk_bytes
+                )
+            else:
+                cd.index_contracts()
+            print(f"Done year {year}")
+
+    def index_suggestions():
+        """ update the suggestion indices from the step_03 rollups, with --suggestions """
+        if not myargs.suggestions:
+            return
+
+        from entity_suggestions import SuggestionIndexer
+
+        for language in LANGUAGES:
+            SuggestionIndexer(language).index_suggestions()
+
     if year and year not in CONTRACT_URLS.keys():
         print(
             "Year must be one of the followings: {}".format(
                 ",".join(CONTRACT_URLS.keys())
             )
         )
+    elif myargs.rebuild and myargs.shard:
+        print("The indices can not be rebuilt by shards, rebuild them without --shard")
+    elif myargs.rebuild and year:
+        # the rebuilt indices replace the old ones, that have the rest of the years
+        print("The indices are rebuilt with every year, rebuild them without --year")
+    elif myargs.rebuild:
+        rebuilder = IndexRebuilder(
+            parallel=myargs.parallel,
+            thread_count=myargs.threads,
+            chunk_size=myargs.chunk_size,
+            max_chunk_bytes=myargs.max_chunk_bytes,
+            delete_old=myargs.delete_old,
+        )
+        rebuilder.rebuild()
+        index_suggestions()
     elif year:
-        cp = ContractIndexer(year)
-        cp.index_contracts()
+        index_years([year])
+        index_suggestions()
     else:
-        for year in CONTRACT_URLS.keys():
-            print(f"Processing year {year}")
-            cd = ContractIndexer(year)
-            asyncio.run(cd.index_contracts())
-            print(f"Done year {year}")
+        index_years(list(CONTRACT_URLS.keys()))
+        index_suggestions()
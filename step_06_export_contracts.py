@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Export the processed contracts as flat tables, in NDJSON and CSV, for anyone that wants
+the data without Elastic.
+
+Every contract (both languages) is flattened into a row of the contracts table, and its
+winners, offerers and resolutions into rows of their own tables, with the id, year and
+language of the contract and their position in it:
+
+- contracts: the contract, with the authority and the name and code of its categories
+- winners, offerers and resolutions: one row per item of the contract
+
+Each year is exported by a worker process to {export_folder}/{year}/{table}.{format},
+compressed while it is written (gzip by default, zstd needs the zstandard package).
+exports/manifest.json has the rows, bytes and sha256 checksum of every file.
+
+    python step_06_export_contracts.py
+    python step_06_export_contracts.py --year 2021 --format csv --compression zstd
+"""
+import argparse
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from contract_shape import upgrade_contract_shape
+from instrumentation import stage
+from years import CONTRACT_URLS
+
+EXPORT_FOLDER = "exports"
+MANIFEST_FILENAME = "manifest.json"
+LANGUAGES = ["es", "eu"]
+FORMATS = ["ndjson", "csv"]
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+# fast levels, so that exporting is bound by reading the contracts
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+EXPORT_WORKERS = os.cpu_count() or 1
+
+CATEGORIES = ["status", "contract_type", "processing_type", "adjudication_procedure"]
+ITEM_KEYS = ["contract_id", "year", "language", "position"]
+TABLES = {
+    "contracts": ["id", "year", "language", "title"]
+    + ["authority_name", "authority_cif", "authority_code", "authority_slug"]
+    + ["budget"]
+    + [f"{category}_{key}" for category in CATEGORIES for key in ("code", "name")]
+    + ["minor_contract", "offerer_count", "adjudication_date"]
+    + ["winner_count", "offerer_total", "resolution_count"],
+    "winners": ITEM_KEYS + ["name", "cif", "slug"],
+    "offerers": ITEM_KEYS + ["name", "cif", "sme", "date"],
+    "resolutions": ITEM_KEYS + ["priceWithVAT"],
+}
+
+
+def get_dict(value):
+    return value if isinstance(value, dict) else {}
+
+
+def get_list(value):
+    return value if isinstance(value, list) else []
+
+
+def flatten_contract(contract, year, language):
+    """ table -> rows of the contract, with the columns of TABLES """
+    authority = get_dict(contract.get("authority"))
+    row = {
+        "id": contract.get("id"),
+        "year": contract.get("year") or year,
+        "language": language,
+        "title": contract.get("title"),
+        "authority_name": authority.get("name"),
+        "authority_cif": authority.get("cif"),
+        "authority_code": authority.get("code"),
+        "authority_slug": authority.get("slug"),
+        "budget": contract.get("budget"),
+        "minor_contract": contract.get("minor_contract"),
+        "offerer_count": contract.get("offerer_count"),
+        "adjudication_date": contract.get("adjudication_date"),
+        "winner_count": len(get_list(contract.get("winners"))),
+        "offerer_total": len(get_list(contract.get("offerers"))),
+        "resolution_count": len(get_list(contract.get("resolutions"))),
+    }
+    for category in CATEGORIES:
+        value = get_dict(contract.get(category))
+        row[f"{category}_code"] = value.get("code")
+        row[f"{category}_name"] = value.get("name")
+
+    # NDJSON rows have the keys in the order of the CSV columns
+    rows = {"contracts": [{column: row[column] for column in TABLES["contracts"]}]}
+    # the items of these tables are the lists of the contract with the same name
+    for table in ("winners", "offerers", "resolutions"):
+        rows[table] = []
+        for position, item in enumerate(get_list(contract.get(table))):
+            item = get_dict(item)
+            item_row = {
+                "contract_id": row["id"],
+                "year": row["year"],
+                "language": language,
+                "position": position,
+            }
+            for column in TABLES[table][len(ITEM_KEYS) :]:
+                item_row[column] = item.get(column)
+            rows[table].append(item_row)
+    return rows
+
+
+def iter_contracts(year, processed_folder="processed", languages=LANGUAGES):
+    """ the (language, contract) of every processed contract of the year, sorted by id """
+    base_folder = f"{processed_folder}/contracts/{year}"
+    try:
+        folders = sorted(os.listdir(base_folder))
+    except FileNotFoundError:
+        return
+    for folder in folders:
+        for language in languages:
+            try:
+                with open(f"{base_folder}/{folder}/{language}/contract.json") as fp:
+                    contract = json.load(fp)
+            except FileNotFoundError:
+                continue
+            yield language, upgrade_contract_shape(contract)
+
+
+class HashingWriter(io.RawIOBase):
+    """ a binary file that keeps the sha256 and size of what is written to it """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.fp.write(data)
+
+
+def open_compressed(fp, compression):
+    """ a binary stream that compresses what is written to it into fp """
+    if compression == "gzip":
+        # without the modification time, the same contracts give the same files
+        return gzip.GzipFile(fileobj=fp, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression needs the zstandard package installed")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(
+            fp, closefd=False
+        )
+    return io.BufferedWriter(fp)
+
+
+class TableWriter:
+    """ writes the rows of a table to a compressed NDJSON or CSV file """
+
+    def __init__(self, filename, table, output_format, compression):
+        self.filename = filename
+        self.temporary_filename = f"{filename}.tmp"
+        self.columns = TABLES[table]
+        self.output_format = output_format
+        self.rows = 0
+        self.raw = open(self.temporary_filename, "wb")
+        self.hashing = HashingWriter(self.raw)
+        self.compressed = open_compressed(self.hashing, compression)
+        self.text = io.TextIOWrapper(
+            self.compressed, encoding="utf-8", newline="", write_through=False
+        )
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.writer(self.text)
+            self.csv_writer.writerow(self.columns)
+
+    def write(self, row):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(
+                [csv_value(row[column]) for column in self.columns]
+            )
+        else:
+            self.text.write(json.dumps(row, ensure_ascii=False))
+            self.text.write("\n")
+        self.rows += 1
+
+    def close(self):
+        """ finish the file, and return its manifest entry """
+        # closing the text stream closes the compressed one, that writes its footer
+        self.text.close()
+        self.raw.close()
+        os.replace(self.temporary_filename, self.filename)
+        return {
+            "rows": self.rows,
+            "bytes": self.hashing.size,
+            "sha256": self.hashing.sha256.hexdigest(),
+        }
+
+
+def csv_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else value
+
+
+def export_year(
+    year,
+    processed_folder="processed",
+    export_folder=EXPORT_FOLDER,
+    formats=FORMATS,
+    compression="gzip",
+):
+    """export the contracts of the year to a file per table and format, and return their
+    manifest entries. It runs in a worker process.
+    """
+    folder = f"{export_folder}/{year}"
+    os.makedirs(folder, exist_ok=True)
+    extension = COMPRESSIONS[compression]
+    writers = {
+        (table, output_format): TableWriter(
+            f"{folder}/{table}.{output_format}{extension}",
+            table,
+            output_format,
+            compression,
+        )
+        for table in TABLES
+        for output_format in formats
+    }
+    for language, contract in iter_contracts(year, processed_folder):
+        for table, rows in flatten_contract(contract, year, language).items():
+            for output_format in formats:
+                writer = writers[(table, output_format)]
+                for row in rows:
+                    writer.write(row)
+
+    entries = []
+    for (table, output_format), writer in writers.items():
+        entry = {
+            "path": os.path.relpath(writer.filename, export_folder),
+            "year": year,
+            "table": table,
+            "format": output_format,
+            "compression": compression,
+        }
+        entry.update(writer.close())
+        entries.append(entry)
+    return entries
+
+
+def update_manifest(export_folder, entries):
+    """ add the entries to the manifest, replacing the previous ones of the same files """
+    filename = f"{export_folder}/{MANIFEST_FILENAME}"
+    try:
+        with open(filename) as fp:
+            files = {entry["path"]: entry for entry in json.load(fp)["files"]}
+    except (FileNotFoundError, ValueError):
+        files = {}
+    files.update((entry["path"], entry) for entry in entries)
+
+    manifest = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "files": [files[path] for path in sorted(files)],
+    }
+    with open(f"{filename}.tmp", "w") as fp:
+        json.dump(manifest, fp, indent=4)
+    os.replace(f"{filename}.tmp", filename)
+    return manifest
+
+
+def export_contracts(
+    years=None,
+    processed_folder="processed",
+    export_folder=EXPORT_FOLDER,
+    formats=FORMATS,
+    compression="gzip",
+    workers=EXPORT_WORKERS,
+):
+    """export the years (every year by default) in parallel, a year per worker process,
+    and return the manifest
+    """
+    years = years or list(CONTRACT_URLS.keys())
+    if compression == "zstd":
+        # fail before starting the workers
+        open_compressed(io.BytesIO(), compression)
+
+    os.makedirs(export_folder, exist_ok=True)
+    entries = []
+    with stage("export_years", total=len(years)) as current:
+        with ProcessPoolExecutor(max_workers=min(workers, len(years))) as executor:
+            futures = [
+                executor.submit(
+                    export_year,
+                    year,
+                    processed_folder,
+                    export_folder,
+                    formats,
+                    compression,
+                )
+                for year in years
+            ]
+            for future in futures:
+                year_entries = future.result()
+                entries.extend(year_entries)
+                instrumentation.count(
+                    "rows",
+                    sum(
+                        entry["rows"]
+                        for entry in year_entries
+                        if entry["table"] == "contracts"
+                    ),
+                )
+                current.add()
+    return update_manifest(export_folder, entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the processed contracts to NDJSON and CSV files"
+    )
+    parser.add_argument("--year", help="Enter the year to export")
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        action="append",
+        help="Format of the files, both of them by default",
+    )
+    parser.add_argument("--compression", choices=list(COMPRESSIONS), default="gzip")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=EXPORT_WORKERS,
+        help="Years exported at the same time, each of them in its own process",
+    )
+    parser.add_argument("--output", default=EXPORT_FOLDER, help="Folder of the files")
+    instrumentation.add_arguments(parser)
+    myargs = parser.parse_args()
+    instrumentation.configure_from_args(myargs)
+
+    year = myargs.year
+    if year and year not in CONTRACT_URLS.keys():
+        print(
+            "Year must be one of the followings: {}".format(
+                ",".join(CONTRACT_URLS.keys())
+            )
+        )
+    else:
+        manifest = export_contracts(
+            [year] if year else None,
+            export_folder=myargs.output,
+            formats=myargs.format or FORMATS,
+            compression=myargs.compression,
+            workers=myargs.workers,
+        )
+        print(f"{len(manifest['files'])} files in {myargs.output}/{MANIFEST_FILENAME}")
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic contracts built by mutating the demo samples, to benchmark and test the pipeline
+with any number of contracts.
+
+The demo samples have both XML formats (the new contractingAnnouncement one and the legacy
+<item> one), so the generated raw contracts alternate between them.
+"""
+import copy
+import json
+import os
+import random
+
+DEMO_FOLDER = "demo"
+LANGUAGES = ["es", "eu"]
+RAW_FILENAMES = ["data.xml", "metadata.xml", "data.json"]
+RAW_ENCODING = "iso-8859-15"
+COMPANY_VARIANTS = 1000
+
+
+def load_demo_processed_contracts(demo_folder=DEMO_FOLDER):
+    """ the processed demo contracts, as a list of language -> contract dicts"""
+    contracts = []
+    base_folder = f"{demo_folder}/processed/contracts"
+    for contract_id in sorted(os.listdir(base_folder)):
+        contract = {}
+        for language in LANGUAGES:
+            with open(f"{base_folder}/{contract_id}/{language}/contract.json") as fp:
+                contract[language] = json.load(fp)
+        contracts.append(contract)
+
+    return contracts
+
+
+def synthetic_id(number):
+    return f"9{number:09d}"
+
+
+def mutate_processed_contract(contract, contract_id, factor):
+    """ copy of the contract with another id and its amounts multiplied by factor """
+    contract = copy.deepcopy(contract)
+    contract["id"] = contract_id
+    contract["title"] = "{} ({})".format(contract["title"], contract_id)
+    if contract.get("budget"):
+        contract["budget"] = round(contract["budget"] * factor, 2)
+    for resolution in contract.get("resolutions", []):
+        if resolution.get("priceWithVAT"):
+            resolution["priceWithVAT"] = round(resolution["priceWithVAT"] * factor, 2)
+    return contract
+
+
+def generate_processed_contracts(folder, year, count, seed=0, demo_folder=DEMO_FOLDER):
+    """write count processed contracts (both languages) to
+    {folder}/contracts/{year}/{id}/{language}/contract.json and return their ids
+    """
+    rng = random.Random(seed)
+    templates = load_demo_processed_contracts(demo_folder)
+    ids = []
+    for number in range(count):
+        contract_id = synthetic_id(number)
+        template = templates[number % len(templates)]
+        factor = rng.uniform(0.5, 2.0)
+        for language in LANGUAGES:
+            contract = mutate_processed_contract(
+                template[language], contract_id, factor
+            )
+            contract["year"] = year
+            contract_folder = f"{folder}/contracts/{year}/{contract_id}/{language}"
+            os.makedirs(contract_folder, exist_ok=True)
+            with open(f"{contract_folder}/contract.json", "w") as fp:
+                json.dump(contract, fp, indent=4)
+        ids.append(contract_id)
+
+    return ids
+
+
+def load_demo_raw_contracts(demo_folder=DEMO_FOLDER):
+    """the raw files of the demo contracts, as a list of (contract id, company names,
+    language -> filename -> text) tuples
+    """
+    processed = load_demo_processed_contracts(demo_folder)
+    contracts = []
+    base_folder = f"{demo_folder}/contracts"
+    for contract_id, processed_contract in zip(
+        sorted(os.listdir(base_folder)), processed
+    ):
+        files = {}
+        for language in LANGUAGES:
+            files[language] = {}
+            for filename in RAW_FILENAMES:
+                with open(
+                    f"{base_folder}/{contract_id}/{language}/{filename}",
+                    encoding=RAW_ENCODING,
+                    newline="",
+                ) as fp:
+                    files[language][filename] = fp.read()
+        names = {
+            winner["name"]
+            for contract in processed_contract.values()
+            for winner in contract["winners"]
+            if winner["name"]
+        }
+        contracts.append((contract_id, sorted(names, key=len, reverse=True), files))
+
+    return contracts
+
+
+def mutate_raw_contract(text, replacements):
+    for old, new in replacements:
+        text = text.replace(old, new)
+    return text
+
+
+def generate_raw_contracts(
+    folder,
+    year,
+    count,
+    seed=0,
+    demo_folder=DEMO_FOLDER,
+    company_variants=COMPANY_VARIANTS,
+):
+    """write count raw contracts (both languages), as downloaded in step_01, to
+    {folder}/contracts/{year}/{id}/{language}/ and return their ids. The winner names get
+    one of company_variants suffixes, so that there are many different companies.
+    """
+    rng = random.Random(seed)
+    templates = load_demo_raw_contracts(demo_folder)
+    ids = []
+    for number in range(count):
+        contract_id = synthetic_id(number)
+        template_id, names, files = templates[number % len(templates)]
+        variant = rng.randrange(company_variants)
+        replacements = [(name, f"{name} {variant}") for name in names]
+        replacements.append((template_id, contract_id))
+        for language in LANGUAGES:
+            contract_folder = f"{folder}/contracts/{year}/{contract_id}/{language}"
+            os.makedirs(contract_folder, exist_ok=True)
+            for filename, text in files[language].items():
+                with open(
+                    f"{contract_folder}/{filename}",
+                    "w",
+                    encoding=RAW_ENCODING,
+                    newline="",
+                ) as fp:
+                    fp.write(mutate_raw_contract(text, replacements))
+        ids.append(contract_id)
+
+    return ids
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import unittest
+
+from authorities_cifs_index import AuthorityCIFIndex
+
+NAMES = [
+    "DIPUTACIÓN FORAL DE ÁLAVA Araba",
+    "DIPUTACIÓN FORAL DE BIZKAIA Bizkaia",
+    "AYUNTAMIENTO DE VITORIA-GASTEIZ Araba",
+    "ARABAKO BILTZAR NAGUSIAK - JUNTAS GENERALES DE ALAVA Araba",
+]
+
+
+class TestAuthorityCIFIndex(unittest.TestCase):
+    def test_best_candidate_first(self):
+        index = AuthorityCIFIndex.build(NAMES)
+        candidates = index.candidates("Diputacion Foral de Alava")
+        self.assertEqual(candidates[0], "DIPUTACIÓN FORAL DE ÁLAVA Araba")
+
+    def test_candidates_are_limited(self):
+        index = AuthorityCIFIndex.build(NAMES)
+        candidates = index.candidates("Diputacion Foral", limit=2)
+        self.assertEqual(len(candidates), 2)
+
+    def test_unrelated_name_has_no_candidates(self):
+        index = AuthorityCIFIndex.build(NAMES)
+        self.assertEqual(index.candidates("xyzzy"), [])
+
+    def test_empty_name_has_no_candidates(self):
+        index = AuthorityCIFIndex.build(NAMES)
+        self.assertEqual(index.candidates(""), [])
+
+    def test_index_is_rebuilt_when_the_csv_changes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            csv_filename = os.path.join(folder, "data.csv")
+            index_filename = os.path.join(folder, "index.json")
+            with open(csv_filename, "w") as fp:
+                fp.write("first version")
+
+            index = AuthorityCIFIndex.load(NAMES, csv_filename, index_filename)
+            with open(index_filename) as fp:
+                first_checksum = json.load(fp)["checksum"]
+            self.assertEqual(index.checksum, first_checksum)
+
+            with open(csv_filename, "w") as fp:
+                fp.write("second version")
+
+            index = AuthorityCIFIndex.load(NAMES, csv_filename, index_filename)
+            with open(index_filename) as fp:
+                self.assertNotEqual(json.load(fp)["checksum"], first_checksum)
+            self.assertEqual(
+                index.candidates("Ayuntamiento de Vitoria")[0],
+                "AYUNTAMIENTO DE VITORIA-GASTEIZ Araba",
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
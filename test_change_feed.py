@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from change_feed import LATEST, ChangeFeed, in_changes, load_changes
+from step_01_get_contracts import ContractDownloader
+
+BASE_URL = "https://www.contratacion.euskadi.eus/contenidos/anuncio_contratacion"
+
+
+def listing_entry(contract_id, version=1):
+    folder = f"{BASE_URL}/expjaso{contract_id}"
+    return {
+        "title": f"Contract {contract_id}",
+        "dataXML": f"{folder}/es_doc/data/es_r01dtpd{version}/xml_data.xml",
+        "metadataXML": f"{folder}/r01Index/idxContent.xml",
+    }
+
+
+def listing(*contract_ids):
+    return {
+        contract_id: {
+            "es": listing_entry(contract_id),
+            "eu": listing_entry(contract_id),
+        }
+        for contract_id in contract_ids
+    }
+
+
+class TestChangeFeed(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.feed = ChangeFeed("2021", self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_record_changes(self):
+        feed = self.feed.record(listing("1", "2", "3"))
+        self.assertEqual(feed["sequence"], 1)
+        self.assertEqual(feed["added"], ["1", "2", "3"])
+
+        contracts = listing("1", "2", "4")
+        contracts["2"]["eu"] = listing_entry("2", version=2)
+        feed = self.feed.record(contracts)
+        self.assertEqual(feed["sequence"], 2)
+        self.assertEqual(
+            (feed["added"], feed["changed"], feed["removed"]), (["4"], ["2"], ["3"])
+        )
+
+        # the id we add to the entries in step_01 is not a change
+        contracts["1"]["es"]["id"] = "1"
+        self.assertEqual(self.feed.record(contracts)["sequence"], 2)
+        self.assertEqual(self.feed.sequences(), [1, 2])
+
+    def test_changes_since(self):
+        self.feed.record(listing("1", "2", "3"))
+        self.feed.record(listing("1", "2"))
+        contracts = listing("1", "2", "3")
+        contracts["1"]["es"] = listing_entry("1", version=2)
+        self.feed.record(contracts)
+
+        changes = self.feed.changes_since(LATEST)
+        self.assertEqual(changes["added"], {"3"})
+        self.assertEqual(changes["changed"], {"1"})
+
+        # removed and added again is a change
+        changes = self.feed.changes_since(1)
+        self.assertEqual(changes["changed"], {"1", "3"})
+        self.assertEqual(changes["removed"], set())
+        self.assertTrue(in_changes("3", changes))
+        self.assertFalse(in_changes("2", changes))
+        self.assertTrue(in_changes("2", None))
+
+    def test_step_01_downloads_changed_contracts_again(self):
+        cwd = os.getcwd()
+        os.chdir(self.folder)
+        try:
+            downloader = ContractDownloader("2021")
+            contracts = listing("233862")
+            with mock.patch.object(
+                downloader, "get_all_contracts", return_value=contracts
+            ):
+                downloader.get_contracts()
+            self.assertEqual(load_changes("2021", LATEST)["added"], {"233862"})
+            self.assertIsNone(load_changes("2021", None))
+
+            # the files are downloaded again only when the contract has changed
+            for filename in ("data.xml", "metadata.xml"):
+                with open(f"contracts/2021/233862/es/{filename}", "w") as fp:
+                    fp.write("<xml/>")
+            entry = contracts["233862"]["es"]
+            self.assertEqual(downloader.parse_contract("233862", "es", entry), [])
+
+            contracts = listing("233862")
+            contracts["233862"]["es"] = listing_entry("233862", version=2)
+            with mock.patch.object(
+                downloader, "get_all_contracts", return_value=contracts
+            ):
+                downloader.get_contracts()
+            self.assertEqual(downloader.changed_ids, {"233862"})
+            entry = contracts["233862"]["es"]
+            self.assertEqual(len(downloader.parse_contract("233862", "es", entry)), 2)
+
+            # the pipeline downloads the files right away, they are not kept in ITEMS
+            with mock.patch("step_01_get_contracts.ITEMS", []) as items:
+                files = downloader.get_contract_items("233862", "es", entry)
+                self.assertEqual(len(files), 2)
+                self.assertEqual(items, [])
+                downloader.parse_contract("233862", "es", entry)
+                self.assertEqual(items, files)
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from company_resolution import UnionFind, blocking_keys, resolve_companies
+from company_resolution import significant_tokens
+
+
+class TestSignificantTokens(unittest.TestCase):
+    def test_legal_forms_are_ignored(self):
+        tokens = significant_tokens("LIZURBIDE SEGURIDAD , S.L")
+        self.assertEqual(tokens, ["lizurbide", "seguridad"])
+
+    def test_no_tokens_no_blocks(self):
+        self.assertEqual(blocking_keys(significant_tokens("S.L.")), [])
+
+
+class TestUnionFind(unittest.TestCase):
+    def test_different_cifs_are_not_joined(self):
+        clusters = UnionFind()
+        clusters.add("A", "A00000001")
+        clusters.add("B", "B00000002")
+        self.assertFalse(clusters.union("A", "B"))
+        self.assertNotEqual(clusters.find("A"), clusters.find("B"))
+
+    def test_cif_is_shared_with_the_cluster(self):
+        clusters = UnionFind()
+        clusters.add("A", "A00000001")
+        clusters.add("B")
+        clusters.add("C")
+        clusters.union("B", "C")
+        clusters.union("C", "A")
+        self.assertEqual(clusters.cif("B"), "A00000001")
+
+
+class TestResolveCompanies(unittest.TestCase):
+    def setUp(self):
+        self.companies = {
+            "B20000001": {"cif": "B20000001", "name": "LIZURBIDE SEGURIDAD, S.L."},
+            "A48000002": {"cif": "A48000002", "name": "COMPOSICIONES RALI, S.A."},
+        }
+
+    def test_same_name_with_other_legal_form(self):
+        companies_names = {"LIZURBIDE SEGURIDAD , S.L": {}}
+        mapping = resolve_companies(self.companies, companies_names)
+        self.assertEqual(
+            mapping["LIZURBIDE SEGURIDAD , S.L"],
+            {"cif": "B20000001", "name": "LIZURBIDE SEGURIDAD, S.L."},
+        )
+
+    def test_typo_in_the_name(self):
+        companies_names = {"COMPOSICIONES RALLI SA": {}}
+        mapping = resolve_companies(self.companies, companies_names)
+        self.assertEqual(mapping["COMPOSICIONES RALLI SA"]["cif"], "A48000002")
+
+    def test_unknown_company_is_not_mapped(self):
+        companies_names = {"EUSKO PRINTING SERVICE, S.L.": {}}
+        mapping = resolve_companies(self.companies, companies_names)
+        self.assertEqual(mapping, {})
+
+    def test_companies_with_the_same_name_and_different_cifs(self):
+        companies = dict(
+            self.companies,
+            B20000003={"cif": "B20000003", "name": "LIZURBIDE SEGURIDAD, S.L."},
+        )
+        companies_names = {
+            "LIZURBIDE SEGURIDAD SL": {},
+            "COMPOSICIONES RALI, S.A.": {},
+        }
+        # both CIFs are kept, so the name can not be mapped to any of them
+        mapping = resolve_companies(companies, companies_names)
+        self.assertEqual(list(mapping), ["COMPOSICIONES RALI, S.A."])
+
+        # a typo that matches companies with different CIFs is not mapped either
+        companies["A48000004"] = {"cif": "A48000004", "name": "COMPOSICIONES RALLI"}
+        companies_names = {"COMPOSICIONES RALIS SA": {}, "COMPOSICIONES RALI SA": {}}
+        mapping = resolve_companies(companies, companies_names)
+        self.assertEqual(
+            mapping, {"COMPOSICIONES RALI SA": self.companies["A48000002"]}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
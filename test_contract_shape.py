@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from contract_shape import upgrade_contract_shape
+
+
+class TestUpgradeContractShape(unittest.TestCase):
+    def test_numbered_keys_become_lists(self):
+        contract = {
+            "id": "1",
+            "winner_1": {"cif": "B", "name": "Second"},
+            "winner_0": {"cif": "A", "name": "First"},
+            "resolution_0": {"priceWithVAT": 10.0},
+        }
+        upgrade_contract_shape(contract)
+        self.assertEqual(
+            contract,
+            {
+                "id": "1",
+                "winners": [
+                    {"cif": "A", "name": "First"},
+                    {"cif": "B", "name": "Second"},
+                ],
+                "resolutions": [{"priceWithVAT": 10.0}],
+            },
+        )
+
+    def test_no_winner(self):
+        contract = upgrade_contract_shape({"id": "1", "winner": None})
+        self.assertEqual(contract, {"id": "1", "winners": [], "resolutions": []})
+
+    def test_new_shape_is_kept(self):
+        contract = {"winners": [{"cif": "A", "name": "First"}], "resolutions": []}
+        self.assertEqual(upgrade_contract_shape(dict(contract)), contract)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+
+from differential import (
+    TARGETS,
+    Corpus,
+    diff_values,
+    get_reference,
+    run_differential,
+)
+from step_02_process_contracts import ContractProcessor, clean_float_value
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+
+
+def truncating_float_value(value):
+    """ a wrong fast path: it ignores the decimals """
+    return float(int(clean_float_value(value)))
+
+
+def renaming_post_process(raw_contract):
+    contract = ContractProcessor.post_process_contract(None, raw_contract)
+    for winner in contract["winners"]:
+        winner["name"] = winner["name"].lower()
+    return contract
+
+
+class TestDifferential(unittest.TestCase):
+    def setUp(self):
+        self.corpus = Corpus(f"{DEMO_FOLDER}/contracts")
+
+    def test_reference_is_identical_to_itself(self):
+        for target in TARGETS:
+            result = run_differential(target, get_reference(target), self.corpus)
+            self.assertGreater(result.calls, 0, target)
+            self.assertEqual(result.mismatched_calls, 0, target)
+            self.assertEqual(result.mismatches, {}, target)
+            self.assertTrue(result.identical_fields(), target)
+
+    def test_mismatches_are_reported_by_field(self):
+        result = run_differential(
+            "clean_float_value", truncating_float_value, self.corpus
+        )
+        self.assertGreater(result.mismatched_calls, 0)
+        self.assertEqual(list(result.mismatches), ["(value)"])
+        self.assertEqual(result.identical_fields(), [])
+
+        result = run_differential(
+            "post_process_contract", renaming_post_process, self.corpus
+        )
+        self.assertEqual(result.calls, 2)
+        self.assertEqual(result.mismatches, {"winners[].name": 2})
+        example = result.examples["winners[].name"][0]
+        self.assertEqual(example["path"], "winners[0].name")
+        self.assertTrue(example["input"].endswith("233862/es"))
+        self.assertIn("title", result.identical_fields())
+        self.assertIn("winners[].cif", result.identical_fields())
+        self.assertNotIn("winners[].name", result.identical_fields())
+        self.assertIsNotNone(result.speedup)
+
+    def test_values_must_have_the_same_type(self):
+        self.assertEqual(list(diff_values({"a": [1.0]}, {"a": [1.0]})), [])
+        self.assertEqual(
+            list(diff_values({"a": [1.0]}, {"a": [1]})), [("a[0]", 1.0, 1)]
+        )
+        self.assertEqual(
+            list(diff_values({"a": 1, "b": None}, {"a": 1})),
+            [("b", None, "(missing)")],
+        )
+        self.assertEqual(
+            list(diff_values({"a": [1, 2]}, {"a": [1]})), [("a.length", 2, 1)]
+        )
+        self.assertEqual(list(diff_values(float("nan"), float("nan"))), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
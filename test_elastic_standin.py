@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import elasticsearch
+
+import step_05_index_contracts as indexing
+from change_feed import LATEST, ChangeFeed
+from elastic_standin import ElasticStandin
+from synthetic_corpus import generate_processed_contracts
+
+BASE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEMO_FOLDER = os.path.join(BASE_FOLDER, "demo")
+YEAR = "2021"
+
+
+class TestIndexingWithStandin(unittest.TestCase):
+    def setUp(self):
+        self.standin = ElasticStandin(store=True).start()
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+        self.ids = generate_processed_contracts(
+            "processed", YEAR, 10, demo_folder=DEMO_FOLDER
+        )
+        self.patches = [
+            mock.patch.object(indexing, "ELASTIC_HOST", "127.0.0.1"),
+            mock.patch.object(indexing, "ELASTIC_PORT", self.standin.port),
+            mock.patch.object(indexing, "_CLIENT", None),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+        self.standin.stop()
+
+    def count(self, index):
+        return sum(
+            self.standin.state.indices[name]["count"]
+            for name in self.standin.state.resolve(index)
+        )
+
+    def test_index_contracts(self):
+        indexing.ContractIndexer(YEAR).index_contracts()
+        self.assertEqual(self.count("contracts_es"), 10)
+        self.assertEqual(self.count("contracts_eu"), 10)
+        mapping = self.standin.state.indices["contracts_es"]["mappings"]
+        self.assertEqual(mapping["properties"]["winners"]["type"], "nested")
+
+    def test_index_contracts_parallel(self):
+        indexer = indexing.ContractIndexer(YEAR)
+        results = indexer.index_contracts_parallel(thread_count=2, chunk_size=3)
+        self.assertEqual(results, {"es": 10, "eu": 10})
+
+    def test_index_contracts_parallel_with_rejections(self):
+        self.standin.state.rejection_rate = 0.2
+        indexer = indexing.ContractIndexer(
+            YEAR, incremental=True, max_retries=10, initial_backoff=0.01
+        )
+        results = indexer.index_contracts_parallel(thread_count=2, chunk_size=3)
+        self.assertEqual(results, {"es": 10, "eu": 10})
+        self.assertGreater(self.standin.state.stats["rejected"], 0)
+        self.assertEqual(self.count("contracts_es"), 10)
+
+        # without retries, the rejected documents are not indexed, but they do not stop
+        # the rest
+        shutil.rmtree("cache/index_manifest")
+        self.standin.state.rejection_rate = 0.5
+        indexer = indexing.ContractIndexer(YEAR, incremental=True)
+        results = indexer.index_contracts_parallel(thread_count=2, chunk_size=3)
+        self.assertLess(results["es"], 10)
+        self.assertEqual(len(indexer.get_manifest("es").hashes), results["es"])
+
+    def test_index_years_async(self):
+        generate_processed_contracts("processed", "2020", 5, demo_folder=DEMO_FOLDER)
+        results = asyncio.run(indexing.index_years_async([YEAR, "2020"], 2))
+        self.assertEqual(
+            results, {YEAR: {"es": 10, "eu": 10}, "2020": {"es": 5, "eu": 5}}
+        )
+        self.assertEqual(self.count("contracts_es"), 10)
+        self.assertEqual(self.standin.state.stats["indexed"], 30)
+
+    def test_incremental_only_sends_changes(self):
+        indexer = indexing.ContractIndexer(YEAR, incremental=True)
+        indexer.index_contracts()
+        self.assertEqual(self.standin.state.stats["indexed"], 20)
+
+        indexing.ContractIndexer(YEAR, incremental=True).index_contracts()
+        self.assertEqual(self.standin.state.stats["indexed"], 20)
+
+        shutil.rmtree(f"processed/contracts/{YEAR}/{self.ids[0]}")
+        indexer = indexing.ContractIndexer(
+            YEAR, incremental=True, delete_missing=True
+        )
+        indexer.index_contracts()
+        self.assertEqual(self.standin.state.stats["deleted"], 2)
+        self.assertEqual(self.count("contracts_es"), 9)
+
+    def test_index_changes(self):
+        indexing.ContractIndexer(YEAR).index_contracts()
+        feed = ChangeFeed(YEAR)
+        feed.record({contract_id: {} for contract_id in self.ids})
+        contracts = {contract_id: {} for contract_id in self.ids[1:]}
+        contracts[self.ids[1]] = {"es": {"title": "Changed"}}
+        feed.record(contracts)
+
+        # the changed contract is indexed again, and the removed one is deleted
+        indexing.ContractIndexer(YEAR, changes_since=LATEST).index_contracts()
+        self.assertEqual(self.standin.state.stats["indexed"], 22)
+        self.assertEqual(self.standin.state.stats["deleted"], 2)
+        self.assertEqual(self.count("contracts_es"), 9)
+
+    def test_index_changes_with_delete_missing(self):
+        indexing.ContractIndexer(YEAR, incremental=True).index_contracts()
+        feed = ChangeFeed(YEAR)
+        feed.record({contract_id: {} for contract_id in self.ids})
+        contracts = {contract_id: {} for contract_id in self.ids[1:]}
+        contracts[self.ids[1]] = {"es": {"title": "Changed"}}
+        feed.record(contracts)
+
+        # the unchanged contracts are not read, but they are not missing either
+        indexer = indexing.ContractIndexer(
+            YEAR, incremental=True, delete_missing=True, changes_since=LATEST
+        )
+        actions = list(indexer.generate_actions("es"))
+        self.assertEqual(
+            [action["_id"] for action in actions if action.get("_op_type")],
+            [self.ids[0]],
+        )
+        indexing.ContractIndexer(
+            YEAR, incremental=True, delete_missing=True, changes_since=LATEST
+        ).index_contracts()
+        self.assertEqual(self.standin.state.stats["deleted"], 2)
+        self.assertEqual(self.count("contracts_es"), 9)
+
+        asyncio.run(
+            indexing.index_years_async(
+                [YEAR],
+                2,
+                incremental=True,
+                delete_missing=True,
+                changes_since=LATEST,
+            )
+        )
+        self.assertEqual(self.count("contracts_es"), 9)
+        self.assertEqual(self.count("contracts_eu"), 9)
+
+    def test_rebuild_swaps_the_alias(self):
+        indexing.ContractIndexer(YEAR).index_contracts()
+        indices = indexing.IndexRebuilder().rebuild()
+        self.assertNotIn("contracts_es", self.standin.state.indices)
+        self.assertEqual(self.standin.state.resolve("contracts_es"), [indices["es"]])
+        self.assertEqual(self.count("contracts_es"), 10)
+        settings = self.standin.state.indices[indices["es"]]["settings"]
+        self.assertEqual(settings["refresh_interval"], indexing.LIVE_REFRESH)
+
+    def test_rebuild_keeps_every_year(self):
+        # the synthetic ids are the same every year, 2020 contracts get their own ones
+        generate_processed_contracts("processed", "2020", 5, demo_folder=DEMO_FOLDER)
+        base_folder = "processed/contracts/2020"
+        for contract_id in os.listdir(base_folder):
+            new_id = f"8{contract_id[1:]}"
+            for language in ("es", "eu"):
+                filename = f"{base_folder}/{contract_id}/{language}/contract.json"
+                with open(filename) as fp:
+                    contract = json.load(fp)
+                contract["id"] = new_id
+                with open(filename, "w") as fp:
+                    json.dump(contract, fp)
+            os.rename(f"{base_folder}/{contract_id}", f"{base_folder}/{new_id}")
+        asyncio.run(indexing.index_years_async([YEAR, "2020"], 2))
+
+        # a rebuild of a single year would replace the indices with the rest of years
+        result = subprocess.run(
+            [sys.executable, f"{BASE_FOLDER}/step_05_index_contracts.py"]
+            + ["--rebuild", "--year", YEAR, "--delete-old"],
+            env=dict(
+                os.environ,
+                PYTHONPATH=BASE_FOLDER,
+                ELASTIC_HOST="127.0.0.1",
+                ELASTIC_PORT=str(self.standin.port),
+            ),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertIn("rebuild them without --year", result.stdout)
+        self.assertEqual(self.standin.state.resolve("contracts_es"), ["contracts_es"])
+        self.assertEqual(self.count("contracts_es"), 15)
+
+        indices = indexing.IndexRebuilder(delete_old=True).rebuild()
+        self.assertEqual(self.standin.state.resolve("contracts_eu"), [indices["eu"]])
+        self.assertEqual(self.count("contracts_es"), 15)
+        self.assertEqual(self.count("contracts_eu"), 15)
+        documents = self.standin.state.indices[indices["es"]]["docs"]
+        years = {document["year"] for document in documents.values()}
+        self.assertEqual(years, {YEAR, "2020"})
+
+    def test_buffered_indexer(self):
+        contract = {"id": "1", "title": "Test"}
+        with indexing.BufferedIndexer(max_docs=2) as indexer:
+            indexer.add(contract, "es")
+            self.assertEqual(self.count("contracts_es"), 0)
+            indexer.add(dict(contract, id="2"), "es")
+            self.assertEqual(self.count("contracts_es"), 2)
+            indexer.add(dict(contract, id="3"), "eu")
+        self.assertEqual(self.count("contracts_eu"), 1)
+        self.assertEqual(indexer.indexed, 3)
+
+    def test_buffered_indexer_keeps_the_documents_of_failed_requests(self):
+        client = indexing.get_client()
+        send_bulk = client.bulk
+        calls = []
+
+        def failing_bulk(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise elasticsearch.ConnectionError(None, "connection lost", None)
+            return send_bulk(*args, **kwargs)
+
+        contract = {"id": "1", "title": "Test"}
+        with mock.patch.object(client, "bulk", side_effect=failing_bulk):
+            indexer = indexing.BufferedIndexer(client, max_docs=2)
+            indexer.add(contract, "es")
+            with self.assertRaises(elasticsearch.ConnectionError):
+                indexer.add(dict(contract, id="2"), "es")
+            self.assertEqual(len(indexer.actions), 2)
+            indexer.close()
+        self.assertEqual(self.count("contracts_es"), 2)
+        self.assertEqual(indexer.indexed, 2)
+
+        # the periodic flushes go on after an error
+        calls.clear()
+        with mock.patch.object(client, "bulk", side_effect=failing_bulk):
+            with indexing.BufferedIndexer(client, max_age=0.1) as indexer:
+                indexer.add(dict(contract, id="3"), "es")
+                for _ in range(50):
+                    if indexer.indexed:
+                        break
+                    time.sleep(0.05)
+                self.assertTrue(indexer.flusher.is_alive())
+        self.assertEqual(indexer.indexed, 1)
+        self.assertEqual(len(indexer.flush_exceptions), 1)
+        self.assertEqual(self.count("contracts_es"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
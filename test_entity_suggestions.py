@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from elastic_standin import ElasticStandin
+from entity_suggestions import SuggestionIndexer, build_suggestions, suggest
+from step_03_build_aggregates import AggregateBuilder
+from step_05_index_contracts import connect
+from synthetic_corpus import generate_processed_contracts
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+YEAR = "2021"
+
+
+class TestEntitySuggestions(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        # the manifests are written to cache/index_manifest
+        os.chdir(self.folder)
+        self.ids = generate_processed_contracts(
+            "processed", YEAR, 10, demo_folder=DEMO_FOLDER
+        )
+        self.build_rollups()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def build_rollups(self):
+        builder = AggregateBuilder("es", "aggregates", "processed")
+        builder.update([YEAR])
+        builder.dump()
+
+    def test_build_suggestions(self):
+        companies = build_suggestions("company", "es", "aggregates")
+        # the demo contracts alternate between two winners
+        self.assertEqual(
+            sorted(companies),
+            ["fotocomposicion-ipar-s-coop", "lizurbide-seguridad-s-l"],
+        )
+        company = companies["fotocomposicion-ipar-s-coop"]
+        self.assertEqual(company["contracts"], 5)
+        self.assertEqual(company["keys"], ["F48130975"])
+        self.assertEqual(
+            company["suggest"],
+            {
+                "input": [
+                    "FOTOCOMPOSICIÓN IPAR, S. COOP.",
+                    "IPAR, S. COOP.",
+                    "F48130975",
+                ],
+                "weight": 5,
+            },
+        )
+        # companies without CIF are keyed by their slug, that is not an input
+        company = companies["lizurbide-seguridad-s-l"]
+        self.assertEqual(company["suggest"]["input"][-1], "SEGURIDAD , S.L")
+
+        authorities = build_suggestions("authority", "es", "aggregates")
+        self.assertEqual(authorities["gobierno-vasco"]["keys"], ["1"])
+
+    def test_index_and_suggest(self):
+        with ElasticStandin(store=True) as standin:
+            client = connect({"host": "127.0.0.1", "port": standin.port})
+            indexer = SuggestionIndexer("es", "aggregates", client)
+            results = indexer.index_suggestions()
+            self.assertEqual(results, {"authority": 2, "company": 2})
+            mapping = standin.state.indices["suggest_companies_es"]["mappings"]
+            self.assertEqual(mapping["properties"]["suggest"]["type"], "completion")
+
+            entities = suggest(client, "osaki", "authority")
+            self.assertEqual(
+                [entity["slug"] for entity in entities],
+                ["osakidetza-servicio-vasco-de-salud"],
+            )
+            # from any of the first words, without accents, and by CIF
+            entities = suggest(client, "vasc", "authority")
+            self.assertEqual(len(entities), 2)
+            entities = suggest(client, "fotocomposicion", "company")
+            self.assertEqual(entities[0]["keys"], ["F48130975"])
+            self.assertEqual(suggest(client, "f4813", "company"), entities)
+
+            # only the changes are sent afterwards
+            results = indexer.index_suggestions()
+            self.assertEqual(results, {"authority": 0, "company": 0})
+
+            # the contracts of Osakidetza (and its winner) are gone
+            for contract_id in self.ids[::2]:
+                shutil.rmtree(f"processed/contracts/{YEAR}/{contract_id}")
+            self.build_rollups()
+            results = indexer.index_suggestions()
+            self.assertEqual(results, {"authority": 1, "company": 1})
+            count = standin.state.indices["suggest_authorities_es"]["count"]
+            self.assertEqual(count, 1)
+            self.assertEqual(suggest(client, "osaki", "authority"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+
+from fix_cache import FixCache
+
+
+class TestFixCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.reference_filename = f"{self.folder}/companies.json"
+        self.cache_filename = f"{self.folder}/cache/fix_cache.json"
+        with open(self.reference_filename, "w") as fp:
+            fp.write("{}")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load(self, max_size=10):
+        return FixCache.load(
+            [self.reference_filename], self.cache_filename, max_size=max_size
+        )
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = FixCache(max_size=2)
+        cache.get_or_set("company", "A", lambda: "a")
+        cache.get_or_set("company", "B", lambda: "b")
+        # A is used again, so B is the least recently used one
+        self.assertEqual(cache.get_or_set("company", "A", lambda: "other"), "a")
+        cache.get_or_set("company", "C", lambda: "c")
+        self.assertEqual(list(cache.entries), ["company:A", "company:C"])
+        self.assertEqual(cache.get_or_set("company", "B", lambda: "new b"), "new b")
+        self.assertEqual(list(cache.entries), ["company:C", "company:B"])
+
+    def test_stats(self):
+        cache = FixCache()
+        for key in ["A", "B", "A", "A"]:
+            cache.get_or_set("company", key, lambda: key.lower())
+        cache.get_or_set("authority", "1:es", lambda: {})
+        self.assertEqual(
+            cache.stats(),
+            {
+                "authority": {"hits": 0, "misses": 1, "hit_rate": 0.0},
+                "company": {"hits": 2, "misses": 2, "hit_rate": 0.5},
+            },
+        )
+
+    def test_saved_cache_is_discarded_when_the_reference_data_changes(self):
+        cache = self.load()
+        for key in ["A", "B", "C"]:
+            cache.get_or_set("company", key, lambda: key.lower())
+        cache.dump(self.cache_filename)
+
+        cache = self.load()
+        self.assertEqual(cache.get_or_set("company", "A", lambda: "other"), "a")
+        # only the most recently used entries are loaded into a smaller cache
+        cache = self.load(max_size=2)
+        self.assertEqual(list(cache.entries), ["company:B", "company:C"])
+
+        with open(self.reference_filename, "w") as fp:
+            fp.write('{"B20000001": {}}')
+        cache = self.load()
+        self.assertEqual(len(cache.entries), 0)
+        self.assertEqual(cache.get_or_set("company", "A", lambda: "other"), "other")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import instrumentation
+from instrumentation import RunReport, instrument, stage
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.report = RunReport()
+        patch = mock.patch.object(instrumentation, "REPORT", self.report)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_stage(self):
+        with stage("parse", total=3) as current:
+            for ok in (True, True, False):
+                current.add(ok=ok)
+            instrumentation.count("not_found")
+        with self.assertRaises(ValueError):
+            with stage("parse"):
+                raise ValueError()
+
+        stats = self.report.stages["parse"].as_dict()
+        self.assertEqual(stats["calls"], 2)
+        self.assertEqual(stats["items"], 3)
+        self.assertEqual(stats["errors"], 2)
+        self.assertEqual(stats["counters"], {"not_found": 1})
+        self.assertIsNotNone(stats["items_per_second"])
+
+    def test_instrument(self):
+        @instrument()
+        def parse(value):
+            return value * 2
+
+        @instrument("fix")
+        async def fix(value):
+            instrumentation.error()
+            return value
+
+        async def fix_all():
+            return await asyncio.gather(*[fix(value) for value in range(3)])
+
+        self.assertEqual([parse(value) for value in range(4)], [0, 2, 4, 6])
+        self.assertEqual(asyncio.run(fix_all()), [0, 1, 2])
+        self.assertEqual(self.report.stages["parse"].items, 4)
+        self.assertEqual(self.report.stages["fix"].items, 3)
+        self.assertEqual(self.report.stages["fix"].errors, 3)
+
+    def test_report_with_sampling_profiler(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "report.json")
+            self.report.report_filename = filename
+            self.report.start_profiling("sample")
+            with stage("sleep") as current:
+                time.sleep(0.05)
+                current.add()
+            self.report.finish()
+
+            with open(filename) as fp:
+                report = json.load(fp)
+        self.assertEqual(report["stages"]["sleep"]["items"], 1)
+        self.assertGreater(report["profile"]["samples"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+import kontrata
+
+BASE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEMO_FOLDER = os.path.join(BASE_FOLDER, "demo")
+HEAVY_MODULES = ["aiohttp", "elasticsearch", "requests", "slugify", "tqdm", "xmltodict"]
+
+
+class TestKontrata(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+        shutil.copytree(f"{DEMO_FOLDER}/contracts", "contracts/2021")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def run_main(self, *argv):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            kontrata.main(list(argv))
+        return output.getvalue()
+
+    def test_status_does_not_import_heavy_modules(self):
+        code = (
+            "import sys, kontrata; kontrata.main(['status']); "
+            f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=self.folder,
+            env=dict(os.environ, PYTHONPATH=BASE_FOLDER),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertIn("2021: listings -, 2 downloaded, 0 processed", result.stdout)
+        self.assertEqual(result.stdout.splitlines()[-1], "[]")
+
+    def test_reprocess(self):
+        output = self.run_main("reprocess", "--year", "2021", "233862")
+        self.assertIn("Processed contracts/2021/233862/eu", output)
+        with open("processed/contracts/2021/233862/es/contract.json") as fp:
+            self.assertEqual(json.load(fp)["id"], "233862")
+        self.assertEqual(kontrata.get_status(["2021"])["2021"]["processed"], 1)
+
+    def test_steps_are_run_with_their_options(self):
+        argv = sys.argv
+
+        def run_module(module, run_name, alter_sys):
+            self.assertEqual(module, "step_02_process_contracts")
+            self.assertEqual(run_name, "__main__")
+            self.assertEqual(sys.argv[1:], ["--year", "2021", "--help"])
+
+        with mock.patch.object(kontrata.runpy, "run_module", side_effect=run_module):
+            self.run_main("process", "--year", "2021", "--help")
+        self.assertEqual(sys.argv, argv)
+        with self.assertRaises(SystemExit):
+            self.run_main("status", "--unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import step_05_index_contracts as indexing
+from elastic_standin import ElasticStandin
+from pipeline import ContractPipeline, Pipeline, Stage
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+YEAR = "2021"
+
+
+class TestPipeline(unittest.TestCase):
+    def test_items_flow_through_the_stages(self):
+        results = []
+        stats = Pipeline(
+            [
+                Stage("double", lambda item: item * 2, workers=3),
+                Stage("odd", lambda item: item if item % 4 else None, workers=2),
+                Stage("collect", results.append, workers=1),
+            ]
+        ).run(range(10))
+        self.assertEqual(sorted(results), [2, 6, 10, 14, 18])
+        self.assertEqual(stats["double"]["processed"], 10)
+        self.assertEqual(stats["odd"]["dropped"], 5)
+        self.assertIsNotNone(stats["odd"]["first_output_seconds"])
+
+    def test_errors_do_not_stop_the_pipeline(self):
+        stats = Pipeline([Stage("invert", lambda item: 1 / item, workers=2)]).run(
+            [1, 0, 2]
+        )
+        self.assertEqual(stats["invert"]["errors"], 1)
+        self.assertEqual(stats["invert"]["processed"], 2)
+
+    def test_queues_are_bounded(self):
+        sizes = []
+
+        def slow(item):
+            time.sleep(0.01)
+            return item
+
+        def feed():
+            for item in range(20):
+                sizes.append(first.queue.qsize())
+                yield item
+
+        first = Stage("slow", slow, workers=1, queue_size=2)
+        Pipeline([first]).run(feed())
+        self.assertEqual(max(sizes), 2)
+
+
+class TestContractPipeline(unittest.TestCase):
+    def setUp(self):
+        self.standin = ElasticStandin().start()
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+        shutil.copytree(f"{DEMO_FOLDER}/contracts", f"contracts/{YEAR}")
+        self.patches = [
+            mock.patch.object(indexing, "ELASTIC_HOST", "127.0.0.1"),
+            mock.patch.object(indexing, "ELASTIC_PORT", self.standin.port),
+            mock.patch.object(indexing, "_CLIENT", None),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+        self.standin.stop()
+
+    def test_contracts_are_processed_and_indexed(self):
+        contract_ids = os.listdir(f"contracts/{YEAR}")
+        contracts = {
+            contract_id: {
+                language: {"dataXML": "data.xml", "metadataXML": "metadata.xml"}
+                for language in ("es", "eu")
+            }
+            for contract_id in contract_ids
+        }
+        contract_pipeline = ContractPipeline(YEAR, fix=False)
+        with mock.patch.object(
+            contract_pipeline.downloader, "get_all_contracts", return_value=contracts
+        ):
+            stats = contract_pipeline.run()
+
+        self.assertEqual(stats["index"]["indexed"], 2 * len(contract_ids))
+        self.assertEqual(self.standin.state.indices["contracts_es"]["count"], 2)
+        for contract_id in contract_ids:
+            folder = f"processed/contracts/{YEAR}/{contract_id}"
+            self.assertTrue(os.path.exists(f"{folder}/eu/contract.json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from contract_shape import upgrade_contract_shape
+from records import CodeTable, ContractRecord, load_contract_record
+from synthetic_corpus import generate_processed_contracts
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+
+
+class TestRecords(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load_contracts(self, count):
+        generate_processed_contracts(
+            f"{self.folder}/processed", "2021", count, demo_folder=DEMO_FOLDER
+        )
+        return sorted(
+            glob.glob(f"{self.folder}/processed/contracts/2021/*/*/contract.json")
+        )
+
+    def test_records_are_converted_back_to_the_same_contract(self):
+        table = CodeTable("2021")
+        for filename in self.load_contracts(4):
+            with open(filename) as fp:
+                contract = upgrade_contract_shape(json.load(fp))
+            record = load_contract_record(filename, table)
+            self.assertEqual(record.to_dict(), contract)
+            self.assertEqual(list(record.to_dict()), list(contract))
+            self.assertEqual(record["authority"], contract["authority"])
+            self.assertEqual(record.get("unknown", 1), 1)
+
+        # the names of each code are kept once per language
+        self.assertEqual(
+            table.names["contract_type"]["1"], {"es": "Obras", "eu": "Obrak"}
+        )
+
+    def test_values_that_do_not_fit_are_kept_as_they_are(self):
+        table = CodeTable()
+        contract = {
+            "id": "1",
+            "status": "",
+            "contract_type": {"name": "Obras", "code": "1"},
+            "winners": [{"name": "A", "cif": "B1", "sme": True}],
+            "other": [1, 2],
+        }
+        other = dict(contract, contract_type={"name": "Works", "code": "1"})
+        for value in (contract, other):
+            record = ContractRecord.from_dict(value, table, "es")
+            self.assertEqual(record.to_dict(), value)
+
+        # the same winner is a single shared record
+        first = ContractRecord.from_dict(contract, table, "es")
+        second = ContractRecord.from_dict(dict(contract, id="2"), table, "es")
+        self.assertIs(first.winners[0], second.winners[0])
+
+    def test_records_use_less_memory(self):
+        filenames = self.load_contracts(200)
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            contracts = []
+            for filename in filenames:
+                with open(filename) as fp:
+                    contracts.append(json.load(fp))
+            contracts_size = tracemalloc.get_traced_memory()[0] - start
+
+            start = tracemalloc.get_traced_memory()[0]
+            table = CodeTable("2021")
+            records = [load_contract_record(filename, table) for filename in filenames]
+            records_size = tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(records), len(contracts))
+        self.assertLess(records_size * 3, contracts_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import reference_snapshot
+from reference_snapshot import COMPANIES_MAPPING_FILENAME, load_snapshot
+
+COMPANIES_MAPPING = {"LIZURBIDE SEGURIDAD , S.L": {"cif": "B20000001"}}
+
+
+class TestReferenceSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+        os.makedirs("cache")
+        os.makedirs("cifs")
+        with open("cifs/data.csv", "w") as fp:
+            fp.write('"Razón social";"Provincia";"CIF"\n')
+            fp.write('"DIPUTACIÓN FORAL DE ÁLAVA";"Araba";"P0100000I"\n')
+        with open("cache/contractors.json", "w") as fp:
+            json.dump([{"codPerfil": 1, "nombreLargoEs": "Gobierno Vasco"}], fp)
+        with open("cache/companies.json", "w") as fp:
+            json.dump({}, fp)
+        with open(COMPANIES_MAPPING_FILENAME, "w") as fp:
+            json.dump(COMPANIES_MAPPING, fp)
+        self.patches = [
+            mock.patch.object(reference_snapshot, "_SNAPSHOT", None),
+            mock.patch.object(
+                reference_snapshot,
+                "build_snapshot",
+                wraps=reference_snapshot.build_snapshot,
+            ),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    @property
+    def builds(self):
+        return reference_snapshot.build_snapshot.call_count
+
+    def test_unchanged_sources_reuse_the_snapshot(self):
+        snapshot = load_snapshot()
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(snapshot["authorities"][1]["nombreLargoEs"], "Gobierno Vasco")
+        self.assertEqual(snapshot["companies_mapping"], COMPANIES_MAPPING)
+        # the copy in memory
+        self.assertIs(load_snapshot(), snapshot)
+        # the pickled file, in a new process
+        reference_snapshot._SNAPSHOT = None
+        loaded = load_snapshot()
+        self.assertIsNot(loaded, snapshot)
+        self.assertEqual(loaded["authorities"], snapshot["authorities"])
+        self.assertEqual(self.builds, 1)
+
+    def test_changed_sources_rebuild_the_snapshot(self):
+        snapshot = load_snapshot()
+
+        # the size of the file changes
+        mapping = dict(COMPANIES_MAPPING, **{"OTRA EMPRESA, S.A.": {"cif": ""}})
+        with open(COMPANIES_MAPPING_FILENAME, "w") as fp:
+            json.dump(mapping, fp)
+        snapshot = load_snapshot()
+        self.assertEqual(self.builds, 2)
+        self.assertEqual(snapshot["companies_mapping"], mapping)
+
+        # only the modification time changes
+        stat = os.stat("cache/contractors.json")
+        os.utime("cache/contractors.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertIsNot(load_snapshot(), snapshot)
+        self.assertEqual(self.builds, 3)
+
+        # the pickled file is rebuilt too
+        reference_snapshot._SNAPSHOT = None
+        load_snapshot()
+        self.assertEqual(self.builds, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from search_index import SearchIndex, SearchIndexBuilder, build_index
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+
+
+def make_contract(contract_id, title, authority, winners, budget, price, date):
+    return {
+        "id": contract_id,
+        "title": title,
+        "authority": {"name": authority[1], "code": authority[0], "cif": ""},
+        "budget": budget,
+        "winners": [{"name": name, "cif": cif} for name, cif in winners],
+        "resolutions": [{"priceWithVAT": price}] if price is not None else [],
+        "adjudication_date": date,
+    }
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        builder = SearchIndexBuilder("es")
+        contracts = [
+            make_contract(
+                "1",
+                "Limpieza de edificios",
+                ("10", "Ayuntamiento de Bilbao"),
+                [("Garbiketak, S.L.", "B1")],
+                1000.0,
+                1210.0,
+                "2021-03-01",
+            ),
+            make_contract(
+                "2",
+                "Limpieza viaria",
+                ("10", "Ayuntamiento de Bilbao"),
+                [("Garbiketak, S.L.", "B1"), ("Kaleak, S.A.", "A2")],
+                5000.0,
+                None,
+                "2021-06-01",
+            ),
+            make_contract(
+                "3",
+                "Suministro de ordenadores",
+                ("20", "Diputación Foral de Álava"),
+                [("Informática Araba", "")],
+                "",
+                363.0,
+                None,
+            ),
+        ]
+        for contract, year in zip(contracts, ["2021", "2021", "2020"]):
+            builder.add_contract(contract, year)
+        builder.dump(self.folder)
+        self.index = SearchIndex.load("es", self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_search_text(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search("limpieza"), [0, 1])
+        self.assertEqual(self.index.search("LIMPIEZA viaria"), [1])
+        # normalized like slugify, without accents
+        self.assertEqual(self.index.search("diputacion alava"), [2])
+        self.assertEqual(self.index.search("garbiketak"), [0, 1])
+        self.assertEqual(self.index.search("garbiketak", ["title"]), [])
+        self.assertEqual(self.index.search("limpieza ordenadores"), [])
+        self.assertEqual(self.index.search(""), [0, 1, 2])
+
+    def test_search_filters(self):
+        self.assertEqual(self.index.search(year="2020"), [2])
+        self.assertEqual(self.index.search(authority="10"), [0, 1])
+        self.assertEqual(self.index.search(company="A2"), [1])
+        self.assertEqual(self.index.search(company="Informatica Araba".lower()), [2])
+        # companies without CIF can be found by their name too
+        self.assertEqual(self.index.search(company="Informática  Araba"), [2])
+        self.assertEqual(self.index.search(company="Kaleak, S.A."), [])
+        self.assertEqual(self.index.search(authority="Ayuntamiento de Bilbao"), [])
+        self.assertEqual(self.index.search(min_budget=2000), [1])
+        # contracts without price or date are left out of the range filters
+        self.assertEqual(self.index.search(max_price=10000), [0, 2])
+        self.assertEqual(self.index.search(date_to="2021-12-31"), [0, 1])
+        self.assertEqual(
+            self.index.search("limpieza", date_from="2021-04-01", authority="10"), [1]
+        )
+
+    def test_aggregate(self):
+        result = self.index.aggregate(self.index.search(), "company")
+        self.assertEqual(result[0]["key"], "B1")
+        self.assertEqual(result[0]["label"], "Garbiketak, S.L.")
+        self.assertEqual(result[0]["count"], 2)
+        self.assertEqual(result[0]["budget"], 6000.0)
+        self.assertEqual(result[0]["price"], 1210.0)
+
+        result = self.index.aggregate(self.index.search(), "year")
+        self.assertEqual(
+            [(r["key"], r["count"]) for r in result], [("2021", 2), ("2020", 1)]
+        )
+
+        docs = self.index.search("limpieza")
+        result = self.index.aggregate(docs, "authority", size=1)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]["label"], "Ayuntamiento de Bilbao")
+
+        description = self.index.describe(2)
+        self.assertEqual(description["id"], "3")
+        self.assertIsNone(description["budget"])
+        self.assertIsNone(description["adjudication_date"])
+
+    def test_build_from_processed_contracts(self):
+        processed_folder = os.path.join(self.folder, "processed")
+        for year in ("2021", "2020"):
+            shutil.copytree(
+                f"{DEMO_FOLDER}/processed/contracts",
+                f"{processed_folder}/contracts/{year}",
+            )
+        # the index always has every year
+        count = build_index("eu", processed_folder, self.folder)
+        self.assertEqual(count, 4)
+
+        index = SearchIndex.load("eu", self.folder)
+        docs = index.search("eusko jaurlaritza")
+        self.assertEqual(
+            [index.describe(doc)["id"] for doc in docs], ["233862", "233862"]
+        )
+        self.assertEqual(index.describe(docs[0])["price"], 1713.0)
+        self.assertEqual(index.describe(docs[0])["adjudication_date"], "2021-09-06")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from index_manifest import IndexManifest
+from sharding import in_shard, merge_manifests, parse_shard, shard_of
+from step_01_get_contracts import ContractDownloader
+
+
+class TestSharding(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("0/4"), (0, 4))
+        self.assertEqual(parse_shard("3/4"), (3, 4))
+        for value in ("4/4", "-1/4", "1/0", "a/4", "1"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(value)
+
+    def test_every_contract_is_in_a_single_shard(self):
+        ids = [str(number) for number in range(1000)]
+        sizes = []
+        for index in range(4):
+            sizes.append(len([i for i in ids if in_shard(i, (index, 4))]))
+        self.assertEqual(sum(sizes), 1000)
+        self.assertTrue(all(200 < size < 300 for size in sizes))
+        self.assertTrue(all(in_shard(i, None) for i in ids))
+        # the shard does not depend on the process, unlike hash()
+        self.assertEqual(shard_of("233862", 4), shard_of("233862", 4))
+        self.assertEqual(shard_of("233862", 1), 0)
+
+    def test_contract_id_without_zip_file(self):
+        downloader = ContractDownloader("2021")
+        base_url = "https://www.contratacion.euskadi.eus/contenidos/anuncio_contratacion"
+        contract = {
+            "metadataXML": f"{base_url}/expjaso233862/r01Index/idxContent.xml",
+            "title": "Test",
+        }
+        self.assertEqual(downloader.get_contract_id(contract), "233862")
+
+        contract = {"title": "Test"}
+        contract_id = downloader.get_contract_id(contract)
+        self.assertEqual(contract_id, downloader.get_contract_id(dict(contract)))
+        self.assertNotEqual(contract_id, downloader.get_contract_id({"title": "Other"}))
+
+
+class TestShardedManifests(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_shard_manifests_are_merged(self):
+        ids = [str(number) for number in range(20)]
+        manifest = IndexManifest.load("contracts_es", "2021", self.folder)
+        manifest.hashes = {doc_id: "old" for doc_id in ids}
+        manifest.dump()
+
+        for index in range(2):
+            shard = (index, 2)
+            manifest = IndexManifest.load(
+                "contracts_es", "2021", self.folder, shard=shard
+            )
+            self.assertTrue(all(in_shard(doc_id, shard) for doc_id in manifest.hashes))
+            for doc_id in list(manifest.hashes):
+                if doc_id == "0":
+                    manifest.remove(doc_id)
+                else:
+                    manifest.hashes[doc_id] = "new"
+            manifest.dump()
+
+        self.assertEqual(len(merge_manifests("2021", self.folder)), 2)
+        self.assertEqual(os.listdir(f"{self.folder}/2021"), ["contracts_es.json"])
+        with open(f"{self.folder}/2021/contracts_es.json") as fp:
+            hashes = json.load(fp)
+        self.assertEqual(hashes, {doc_id: "new" for doc_id in ids[1:]})
+
+
+if __name__ == "__main__":
+    unittest.main()
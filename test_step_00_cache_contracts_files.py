@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import step_00_cache_contracts_files as step_00
+
+LISTING = [{"title": f"Contrato {number} de señalización"} for number in range(5000)]
+CONTENT = ("jsonCallback(" + json.dumps(LISTING, ensure_ascii=False) + ");").encode(
+    "utf-8"
+)
+ETAG = '"listing-1"'
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get("Range")))
+            interrupt = server.interruptions > 0
+            server.interruptions -= 1
+        # like most servers, ranges are applied to the compressed content
+        content = CONTENT
+        compressed = server.compress and "gzip" in self.headers.get(
+            "Accept-Encoding", ""
+        )
+        if compressed:
+            content = gzip.compress(CONTENT, mtime=0)
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start = 0
+        status = 200
+        requested = self.headers.get("Range")
+        if requested and self.headers.get("If-Range", ETAG) == ETAG:
+            start = int(requested.split("=")[1].rstrip("-"))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        body = content[start:]
+        self.send_response(status)
+        self.send_header("Content-Type", "application/javascript; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", ETAG)
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        if status == 206:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}"
+            )
+        self.end_headers()
+        if interrupt:
+            # the connection is lost in the middle of the file
+            self.wfile.write(body[: len(body) // 3])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class TestListingDownloads(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ListingHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.interruptions = 0
+        self.server.compress = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        urls = {
+            year: {
+                language: f"{base_url}/{year}/{language}.json"
+                for language in ("es", "eu")
+            }
+            for year in ("2021", "2020")
+        }
+        urls["2019"] = {"es": f"{base_url}/missing.json", "eu": f"{base_url}/missing"}
+
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+        self.patches = [
+            mock.patch.object(step_00, "CONTRACT_URLS", urls),
+            mock.patch.object(step_00, "RETRY_BACKOFF", 0),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.session = step_00.get_session(4)
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.session.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def load_listing(self, year="2021", language="es"):
+        filename = step_00.get_listing_filename(year, language)
+        with open(filename) as fp:
+            return json.load(fp)
+
+    def test_interrupted_downloads_are_resumed(self):
+        self.server.interruptions = 1
+        result = step_00.download_listing(self.session, "2021", "es")
+        self.assertEqual(result, "downloaded")
+        self.assertEqual(self.load_listing(), LISTING)
+        # the second request asks only for the rest of the file
+        ranges = [requested for path, requested in self.server.requests]
+        self.assertEqual(ranges[0], None)
+        offset = int(ranges[1].split("=")[1].rstrip("-"))
+        self.assertTrue(0 < offset < len(CONTENT))
+        self.assertEqual(os.listdir("cache/2021/es"), ["contratos.json"])
+
+        # cached files are not downloaded again, unless they are updated
+        result = step_00.download_listing(self.session, "2021", "es")
+        self.assertEqual(result, "cached")
+        result = step_00.download_listing(self.session, "2021", "es", update=True)
+        self.assertEqual(result, "downloaded")
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_compressing_servers(self):
+        self.server.compress = True
+        self.server.interruptions = 1
+        result = step_00.download_listing(self.session, "2021", "es")
+        self.assertEqual(result, "downloaded")
+        self.assertEqual(self.load_listing(), LISTING)
+        # the file is requested without compression, so the ranges match the part
+        self.assertEqual(len(self.server.requests), 2)
+        offset = int(self.server.requests[1][1].split("=")[1].rstrip("-"))
+        self.assertTrue(0 < offset < len(CONTENT))
+
+    def test_parts_of_changed_or_complete_files(self):
+        url = step_00.CONTRACT_URLS["2021"]["es"]
+        filename = "cache/2021/es/contratos.json"
+        os.makedirs("cache/2021/es")
+
+        # the file changed in the server since the part was downloaded
+        with open(f"{filename}.part", "wb") as fp:
+            fp.write(b"jsonCallback([old")
+        with open(f"{filename}.part.json", "w") as fp:
+            json.dump({"url": url, "etag": '"listing-0"'}, fp)
+        self.assertEqual(
+            step_00.download_listing(self.session, "2021", "es"), "downloaded"
+        )
+        self.assertEqual(self.load_listing(), LISTING)
+
+        # the part has the whole file already
+        with open(f"{filename}.part", "wb") as fp:
+            fp.write(CONTENT)
+        with open(f"{filename}.part.json", "w") as fp:
+            json.dump({"url": url, "etag": ETAG, "encoding": "utf-8"}, fp)
+        result = step_00.download_listing(self.session, "2021", "es", update=True)
+        self.assertEqual(result, "downloaded")
+        self.assertEqual(self.load_listing(), LISTING)
+        self.assertEqual(self.server.requests[-1][1], f"bytes={len(CONTENT)}-")
+
+    def test_warm_cache(self):
+        self.server.interruptions = 2
+        results = step_00.warm_cache(["2021", "2020", "2019"], session=self.session)
+        self.assertEqual(
+            results,
+            {
+                ("2021", "es"): "downloaded",
+                ("2021", "eu"): "downloaded",
+                ("2020", "es"): "downloaded",
+                ("2020", "eu"): "downloaded",
+                ("2019", "es"): "failed",
+                ("2019", "eu"): "failed",
+            },
+        )
+        for year in ("2021", "2020"):
+            for language in ("es", "eu"):
+                self.assertEqual(self.load_listing(year, language), LISTING)
+
+        results = step_00.warm_cache(["2021", "2020"], session=self.session)
+        self.assertEqual(set(results.values()), {"cached"})
+
+
+if __name__ == "__main__":
+    unittest.main()
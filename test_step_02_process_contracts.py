@@ -2,9 +2,31 @@
 from step_02_process_contracts import clean_float_value
 from step_02_process_contracts import clean_float_value_old_xml
 from step_02_process_contracts import clean_date_value
-
+from step_02_process_contracts import ContractProcessor
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 
+BASE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+CONTRACTORS = [
+    {
+        "codPerfil": 1,
+        "nombreLargoEs": "Administración General de la Comunidad Autónoma de Euskadi",
+        "nombreLargoEu": "Euskadiko Autonomia Erkidegoko Administrazio Orokorra",
+    },
+]
+COMPANIES_MAPPING = {
+    "LIZURBIDE SEGURIDAD , S.L": {
+        "cif": "B20000001",
+        "name": "LIZURBIDE SEGURIDAD, S.L.",
+    },
+}
+
 
 class TestCleanFloatValue(unittest.TestCase):
     def test_dot_as_decimal(self):
@@ -154,5 +176,107 @@ class TestCleanDateValue(unittest.TestCase):
         self.assertEqual(new_value, "2020-11-17")
 
 
+class TestPostProcessContract(unittest.TestCase):
+    def process_demo_contract(self, contract_id, language):
+        folder = f"demo/contracts/{contract_id}/{language}"
+        cp = ContractProcessor.__new__(ContractProcessor)
+        raw_contract_json = cp.build_dict(
+            f"{folder}/metadata.xml", f"{folder}/data.xml", f"{folder}/data.json"
+        )
+        raw_contract_json["id"] = contract_id
+        if "contractingAnnouncement" in raw_contract_json:
+            return cp.post_process_contract(raw_contract_json)
+        return cp.post_process_old_contract(raw_contract_json)
+
+    def test_winners_and_resolutions_are_lists(self):
+        contract_json = self.process_demo_contract("233862", "es")
+        self.assertEqual(
+            contract_json["winners"],
+            [{"cif": "F48130975", "name": "FOTOCOMPOSICIÓN IPAR, S. COOP."}],
+        )
+        self.assertEqual(contract_json["resolutions"], [{"priceWithVAT": 1713.0}])
+
+    def test_no_numbered_keys(self):
+        for contract_id in ["233862", "2021001002"]:
+            contract_json = self.process_demo_contract(contract_id, "eu")
+            numbered_keys = [
+                key
+                for key in contract_json
+                if key.startswith("winner_") or key.startswith("resolution_")
+            ]
+            self.assertEqual(numbered_keys, [])
+
+    def test_same_as_demo_processed_contract(self):
+        for contract_id in ["233862", "2021001002"]:
+            contract_json = self.process_demo_contract(contract_id, "es")
+            contract_json["year"] = "2021"
+            with open(f"demo/processed/contracts/{contract_id}/es/contract.json") as fp:
+                self.assertEqual(contract_json, json.load(fp))
+
+
+class TestProcessContractsWithFix(unittest.TestCase):
+    def setUp(self):
+        self.folders = []
+
+    def tearDown(self):
+        for folder in self.folders:
+            shutil.rmtree(folder)
+
+    def make_folder(self):
+        """ a folder with the demo contracts of 2021 and the reference data of step_04 """
+        folder = tempfile.mkdtemp()
+        self.folders.append(folder)
+        shutil.copytree(f"{BASE_FOLDER}/demo/contracts", f"{folder}/contracts/2021")
+        shutil.copytree(f"{BASE_FOLDER}/cifs", f"{folder}/cifs")
+        os.makedirs(f"{folder}/cache")
+        for filename, data in (
+            ("contractors.json", CONTRACTORS),
+            ("companies.json", {}),
+            ("companies_mapping.json", COMPANIES_MAPPING),
+        ):
+            with open(f"{folder}/cache/{filename}", "w") as fp:
+                json.dump(data, fp)
+        return folder
+
+    def run_step(self, folder, script, *args):
+        subprocess.run(
+            [sys.executable, f"{BASE_FOLDER}/{script}", "--year", "2021", *args],
+            cwd=folder,
+            capture_output=True,
+            check=True,
+        )
+
+    def load_contracts(self, folder):
+        contracts = {}
+        for contract_id in ("233862", "2021001002"):
+            for language in ("es", "eu"):
+                filename = f"processed/contracts/2021/{contract_id}/{language}"
+                with open(f"{folder}/{filename}/contract.json") as fp:
+                    contracts[(contract_id, language)] = json.load(fp)
+        return contracts
+
+    def test_same_as_step_04(self):
+        fixed_folder = self.make_folder()
+        self.run_step(fixed_folder, "step_02_process_contracts.py", "--fix")
+        contracts = self.load_contracts(fixed_folder)
+
+        contract = contracts[("233862", "es")]
+        authority = contract["authority"]
+        self.assertEqual(authority["name"], CONTRACTORS[0]["nombreLargoEs"])
+        self.assertEqual(
+            authority["slug"],
+            "administracion-general-de-la-comunidad-autonoma-de-euskadi",
+        )
+        self.assertEqual(contract["winners"][0]["slug"], "fotocomposicion-ipar-s-coop")
+        contract = contracts[("2021001002", "eu")]
+        self.assertEqual(contract["winners"][0]["slug"], "lizurbide-seguridad-s-l")
+        self.assertEqual(contract["winners"][0]["cif"], "B20000001")
+
+        folder = self.make_folder()
+        self.run_step(folder, "step_02_process_contracts.py")
+        self.run_step(folder, "step_04_fix_authority_and_company_data_async.py")
+        self.assertEqual(self.load_contracts(folder), contracts)
+
+
 if __name__ == "__main__":
     unittest.main()
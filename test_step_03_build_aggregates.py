@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from elastic_standin import ElasticStandin
+from step_03_build_aggregates import AggregateBuilder
+from step_05_index_contracts import connect
+from synthetic_corpus import generate_processed_contracts
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+YEAR = "2021"
+
+
+class TestAggregates(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        self.processed_folder = f"{self.folder}/processed"
+        self.aggregates_folder = f"{self.folder}/aggregates"
+        self.ids = generate_processed_contracts(
+            self.processed_folder, YEAR, 10, demo_folder=DEMO_FOLDER
+        )
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def build(self, aggregates_folder=None):
+        builder = AggregateBuilder(
+            "es", aggregates_folder or self.aggregates_folder, self.processed_folder
+        )
+        stats = builder.update([YEAR])
+        builder.dump()
+        return builder, stats
+
+    def load_export(self, filename, aggregates_folder=None):
+        folder = aggregates_folder or self.aggregates_folder
+        with open(f"{folder}/es/{filename}") as fp:
+            return json.load(fp)
+
+    def test_rollups(self):
+        builder, stats = self.build()
+        self.assertEqual(stats["added"], 10)
+
+        authorities = self.load_export("authorities.json")
+        # the demo contracts alternate between Gobierno Vasco (1) and Osakidetza (40)
+        self.assertEqual(set(authorities["authority"]), {"1", "40"})
+        osakidetza = authorities["authority"]["40"]
+        self.assertEqual(osakidetza["total"]["contracts"], 5)
+        self.assertEqual(osakidetza["total"]["minor_ratio"], 1.0)
+        self.assertEqual(osakidetza["total"]["average_offerers"], 1.0)
+        self.assertEqual(list(osakidetza["years"][YEAR]), ["1"])
+        self.assertEqual(authorities["contract_types"]["1"], "Obras")
+
+        companies = self.load_export("companies.json")["company"]
+        # companies without CIF are keyed by their slug
+        self.assertIn("lizurbide-seguridad-s-l", companies)
+        self.assertEqual(companies["F48130975"]["total"]["contracts"], 5)
+        self.assertEqual(
+            companies["F48130975"]["total"]["awarded"],
+            authorities["authority"]["1"]["total"]["awarded"],
+        )
+
+    def test_company_with_several_lots(self):
+        filename = f"{self.processed_folder}/contracts/{YEAR}/{self.ids[0]}/es/contract.json"
+        with open(filename) as fp:
+            contract = json.load(fp)
+        contract["winners"] = contract["winners"] * 2
+        with open(filename, "w") as fp:
+            json.dump(contract, fp)
+
+        self.build()
+        companies = self.load_export("companies.json")["company"]
+        self.assertEqual(companies["F48130975"]["total"]["contracts"], 5)
+
+        # the state saved by a previous version is built again
+        with open(f"{self.aggregates_folder}/es/state.json") as fp:
+            state = json.load(fp)
+        del state["version"]
+        for metrics in state["rollups"]["company"]["F48130975"]["groups"].values():
+            metrics["contracts"] += 1
+        with open(f"{self.aggregates_folder}/es/state.json", "w") as fp:
+            json.dump(state, fp)
+        _, stats = self.build()
+        self.assertEqual(stats["added"], 10)
+        companies = self.load_export("companies.json")["company"]
+        self.assertEqual(companies["F48130975"]["total"]["contracts"], 5)
+
+    def test_incremental_update(self):
+        self.build()
+        contract_folder = f"{self.processed_folder}/contracts/{YEAR}"
+        filename = f"{contract_folder}/{self.ids[0]}/es/contract.json"
+        with open(filename) as fp:
+            contract = json.load(fp)
+        contract["authority"]["code"] = "99"
+        contract["authority"]["name"] = "Other"
+        with open(filename, "w") as fp:
+            json.dump(contract, fp)
+        shutil.rmtree(f"{contract_folder}/{self.ids[1]}")
+
+        builder, stats = self.build()
+        self.assertEqual(
+            stats, {"added": 0, "changed": 1, "removed": 1, "unchanged": 8}
+        )
+        # the same result as building from scratch
+        _, stats = self.build(f"{self.folder}/fresh")
+        self.assertEqual(stats["added"], 9)
+        for filename in ("authorities.json", "companies.json"):
+            self.assertEqual(
+                self.load_export(filename),
+                self.load_export(filename, f"{self.folder}/fresh"),
+            )
+        authority = self.load_export("authorities.json")["authority"]["99"]
+        self.assertEqual(authority["total"]["contracts"], 1)
+
+    def test_index_rollups(self):
+        # the manifest of the indexed rollups is written to cache/index_manifest
+        os.chdir(self.folder)
+        with ElasticStandin(store=True) as standin:
+            client = connect({"host": "127.0.0.1", "port": standin.port})
+            builder, _ = self.build()
+            indexed = builder.index_rollups(client)
+            count = standin.state.indices["aggregates_es"]["count"]
+            self.assertEqual(indexed, count)
+            # 2 authorities and 2 companies, each of them in a single group
+            self.assertEqual(count, 4)
+
+            shutil.rmtree(f"{self.processed_folder}/contracts/{YEAR}")
+            builder, stats = self.build()
+            self.assertEqual(stats["removed"], 10)
+            builder.index_rollups(client)
+            self.assertEqual(standin.state.indices["aggregates_es"]["count"], 0)
+
+    def test_changes_are_indexed_by_a_later_run(self):
+        os.chdir(self.folder)
+        with ElasticStandin(store=True) as standin:
+            client = connect({"host": "127.0.0.1", "port": standin.port})
+            builder, _ = self.build()
+            self.assertEqual(builder.index_rollups(client), 4)
+            self.assertEqual(builder.index_rollups(client), 0)
+
+            # a run without --index
+            shutil.rmtree(f"{self.processed_folder}/contracts/{YEAR}/{self.ids[0]}")
+            self.build()
+            # and a run whose requests are rejected
+            shutil.rmtree(f"{self.processed_folder}/contracts/{YEAR}/{self.ids[1]}")
+            builder, _ = self.build()
+            standin.state.rejection_rate = 1.0
+            self.assertEqual(builder.index_rollups(client), 0)
+
+            standin.state.rejection_rate = 0.0
+            builder = AggregateBuilder(
+                "es", self.aggregates_folder, self.processed_folder
+            )
+            # the rollups of both authorities and both companies have changed
+            self.assertEqual(builder.index_rollups(client), 4)
+            documents = standin.state.indices["aggregates_es"]["docs"]
+            self.assertEqual(
+                sorted(document["contracts"] for document in documents.values()),
+                [4, 4, 4, 4],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import reference_snapshot
+from step_04_fix_authority_and_company_data_async import ContractProcessor
+
+COMPANIES_MAPPING = {
+    "LIZURBIDE SEGURIDAD, S.L.": {
+        "cif": "B20000001",
+        "name": "LIZURBIDE SEGURIDAD, S.L.",
+    },
+}
+
+
+class TestFindCorrectCompany(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+        os.makedirs("cache")
+        os.makedirs("cifs")
+        with open("cifs/data.csv", "w") as fp:
+            fp.write('"Razón social";"Provincia";"CIF"\n')
+        for filename, data in (
+            ("cache/contractors.json", []),
+            ("cache/companies.json", {}),
+            ("cache/companies_mapping.json", COMPANIES_MAPPING),
+        ):
+            with open(filename, "w") as fp:
+                json.dump(data, fp)
+        self.patch = mock.patch.object(reference_snapshot, "_SNAPSHOT", None)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def fix_companies(self, names):
+        processor = ContractProcessor("2021")
+        return [
+            processor.find_correct_company({"name": name, "cif": ""}) for name in names
+        ]
+
+    def test_variants_of_a_name_get_the_same_cif(self):
+        names = ["LIZURBIDE SEGURIDAD, S.L.", "Lizurbide  Seguridad, S.L."]
+        # the result does not depend on which variant is seen first
+        for ordered_names in (names, names[::-1]):
+            companies = self.fix_companies(ordered_names)
+            self.assertEqual(
+                [company["cif"] for company in companies], ["B20000001"] * 2
+            )
+            self.assertEqual(
+                {company["slug"] for company in companies},
+                {"lizurbide-seguridad-s-l"},
+            )
+
+    def test_company_cif_is_kept(self):
+        processor = ContractProcessor("2021")
+        company = processor.find_correct_company(
+            {"name": "LIZURBIDE SEGURIDAD, S.L.", "cif": "B99999999"}
+        )
+        self.assertEqual(company["cif"], "B99999999")
+        company = processor.find_correct_company(
+            {"name": "OTRA EMPRESA, S.A.", "cif": ""}
+        )
+        self.assertEqual(company["cif"], "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from step_06_export_contracts import TABLES, export_contracts, flatten_contract
+from synthetic_corpus import generate_processed_contracts
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TestExportContracts(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.processed_folder = f"{self.folder}/processed"
+        self.export_folder = f"{self.folder}/exports"
+        for year in ("2021", "2020"):
+            generate_processed_contracts(
+                self.processed_folder, year, 10, demo_folder=DEMO_FOLDER
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def export(self, years, **options):
+        return export_contracts(
+            years, self.processed_folder, self.export_folder, workers=2, **options
+        )
+
+    def test_export(self):
+        manifest = self.export(["2021", "2020"])
+        self.assertEqual(len(manifest["files"]), 2 * len(TABLES) * 2)
+        for entry in manifest["files"]:
+            with open(f"{self.export_folder}/{entry['path']}", "rb") as fp:
+                content = fp.read()
+            self.assertEqual(len(content), entry["bytes"])
+            self.assertEqual(hashlib.sha256(content).hexdigest(), entry["sha256"])
+
+            text = gzip.decompress(content).decode("utf-8")
+            if entry["format"] == "csv":
+                rows = list(csv.DictReader(io.StringIO(text, newline="")))
+            else:
+                rows = [json.loads(line) for line in text.splitlines()]
+            self.assertEqual(len(rows), entry["rows"])
+            self.assertEqual(list(rows[0]), TABLES[entry["table"]])
+            self.assertEqual({row["year"] for row in rows}, {entry["year"]})
+
+        rows = {
+            (entry["year"], entry["table"]): entry["rows"]
+            for entry in manifest["files"]
+        }
+        # 10 contracts in both languages, with a winner and a resolution each
+        self.assertEqual(rows[("2021", "contracts")], 20)
+        self.assertEqual(rows[("2021", "winners")], 20)
+        self.assertEqual(rows[("2021", "resolutions")], 20)
+
+        # exporting a year again replaces its files in the manifest
+        generate_processed_contracts(
+            self.processed_folder, "2021", 12, demo_folder=DEMO_FOLDER
+        )
+        manifest = self.export(["2021"], formats=["csv"])
+        rows = {entry["path"]: entry["rows"] for entry in manifest["files"]}
+        self.assertEqual(len(rows), 2 * len(TABLES) * 2)
+        self.assertEqual(rows["2021/contracts.csv.gz"], 24)
+        self.assertEqual(rows["2021/contracts.ndjson.gz"], 20)
+
+    def test_flatten_contract(self):
+        with open(f"{DEMO_FOLDER}/processed/contracts/233862/es/contract.json") as fp:
+            contract = json.load(fp)
+        rows = flatten_contract(contract, "2021", "es")
+        row = rows["contracts"][0]
+        self.assertEqual(row["authority_name"], "Gobierno Vasco")
+        self.assertEqual(row["contract_type_name"], "Servicios")
+        self.assertEqual(row["offerer_total"], len(contract["offerers"]))
+        self.assertEqual(
+            [winner["name"] for winner in rows["winners"]],
+            [winner["name"] for winner in contract["winners"]],
+        )
+        self.assertEqual(rows["offerers"][1]["position"], 1)
+        self.assertEqual(rows["offerers"][1]["contract_id"], "233862")
+        for table, table_rows in rows.items():
+            for table_row in table_rows:
+                self.assertEqual(list(table_row), TABLES[table])
+
+    def test_uncompressed_and_zstd_exports(self):
+        manifest = self.export(["2021"], formats=["ndjson"], compression="none")
+        paths = [entry["path"] for entry in manifest["files"]]
+        self.assertIn("2021/winners.ndjson", paths)
+        with open(f"{self.export_folder}/2021/contracts.ndjson") as fp:
+            self.assertEqual(len(fp.readlines()), 20)
+
+        if zstandard is None:
+            with self.assertRaises(ValueError):
+                self.export(["2021"], compression="zstd")
+            return
+        self.export(["2021"], formats=["ndjson"], compression="zstd")
+        with open(f"{self.export_folder}/2021/contracts.ndjson.zst", "rb") as fp:
+            text = zstandard.ZstdDecompressor().stream_reader(fp).read()
+        self.assertEqual(len(text.splitlines()), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmark_pipeline import run_benchmark
+from step_02_process_contracts import ContractProcessor
+from synthetic_corpus import generate_raw_contracts
+
+DEMO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo")
+YEAR = "2021"
+
+
+class TestSyntheticCorpus(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def test_raw_contracts_in_both_formats(self):
+        ids = generate_raw_contracts(".", YEAR, 4, demo_folder=DEMO_FOLDER)
+        processor = ContractProcessor(YEAR)
+        formats = set()
+        winners = set()
+        for contract_id in ids:
+            folder = f"contracts/{YEAR}/{contract_id}/es"
+            with open(f"{folder}/data.xml", encoding="iso-8859-15") as fp:
+                formats.add("contractingAnnouncement" in fp.read())
+            contract = processor.build_contract(folder, write_raw=False)
+            self.assertEqual(contract["id"], contract_id)
+            winners.update(winner["name"] for winner in contract["winners"])
+        self.assertEqual(formats, {True, False})
+        self.assertEqual(len(winners), 4)
+
+
+class TestBenchmarkPipeline(unittest.TestCase):
+    def test_run_benchmark(self):
+        results = run_benchmark(4)
+        self.assertEqual(results["build_dict"]["calls"], 8)
+        self.assertEqual(results["post_process_contract"]["calls"], 4)
+        self.assertEqual(results["post_process_old_contract"]["calls"], 4)
+        self.assertEqual(results["fix_contents"]["calls"], 8)
+        self.assertIn("generate_actions", results)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,64 @@
-def print_progress(func):
-    """ print the progress of the func running"""
+import hashlib
+import queue
+import threading
 
-    def wrapper(*args, **kwargs):
-        print("Running {} ({})...".format(func.__name__, args and args[0] or ""))
-        result = func(*args, **kwargs)
-        print("Running {} done".format(func.__name__))
-        return result
 
-    return wrapper
+def normalize_text(value):
+    """ normalize the text the same way slugify does, but keeping the words separated by spaces"""
+    # imported here, so that the modules that only need the other helpers start faster
+    from slugify import slugify
+
+    return slugify(value or "", separator=" ")
+
+
+def trigrams(value):
+    """ return the set of character trigrams of the normalized value"""
+    normalized = normalize_text(value)
+    if not normalized:
+        return set()
+
+    padded = f"  {normalized} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def file_checksum(filename):
+    """ return the sha1 checksum of the given file, or an empty string if it does not exist"""
+    checksum = hashlib.sha1()
+    try:
+        with open(filename, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                checksum.update(chunk)
+    except FileNotFoundError:
+        return ""
+
+    return checksum.hexdigest()
+
+
+def prefetch(iterable, size=1000):
+    """iterate over the iterable in a background thread, keeping up to size items ready, so that
+    producing the items (reading files from disk, for instance) overlaps with consuming them
+    """
+    items = queue.Queue(maxsize=size)
+    end = object()
+    errors = []
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            items.put(end)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while True:
+        item = items.get()
+        if item is end:
+            break
+        yield item
+
+    thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the years with open data contracts, and the urls of their listings.
+
+Data extracted from:
+
+https://opendata.euskadi.eus/catalogo/-/contrataciones-administrativas-del-2021/
+
+https://opendata.euskadi.eus/katalogoa/-/2021eko-kontratazio-administratiboak/
+
+To add a new year, add it to YEARS. This module only uses the standard library, so that
+importing the year list does not slow the start of the steps down.
+"""
+
+YEARS = [
+    "2021",
+    "2020",
+    "2019",
+    "2018",
+    "2017",
+    "2016",
+    "2015",
+    "2014",
+    "2013",
+    "2012",
+    "2011",
+]
+
+LISTING_URL = (
+    "https://opendata.euskadi.eus/contenidos/ds_contrataciones/"
+    "contrataciones_admin_{year}/opendata/{filename}"
+)
+LISTING_FILENAMES = {"es": "contratos.json", "eu": "kontratuak.json"}
+
+CONTRACT_URLS = {
+    year: {
+        language: LISTING_URL.format(year=year, filename=filename)
+        for language, filename in LISTING_FILENAMES.items()
+    }
+    for year in YEARS
+}
+
+
+def get_listing_filename(year, language):
+    """ the file where step_00 and step_01 cache the listing of the year """
+    return f"cache/{year}/{language}/{LISTING_FILENAMES[language]}"